@@ -0,0 +1,10 @@
+"""
+benchmarks
+
+Offline throughput benchmarks for xssmap - a local stand-in for the demo target
+site, a stub renderer speaking the phantom-render.js protocol, and scripted
+scenarios. Run with:
+
+    python -m benchmarks.run_benchmarks
+
+"""
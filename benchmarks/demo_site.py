@@ -0,0 +1,175 @@
+##
+## Application Security Threat Attack Modeling (ASTAM)
+##
+## Copyright (C) 2017 Applied Visions - http://securedecisions.com
+##
+## Written by Aspect Security - http://aspectsecurity.com
+##
+## Licensed under the Apache License, Version 2.0 (the "License");
+## you may not use this file except in compliance with the License.
+## You may obtain a copy of the License at
+##
+##     http://www.apache.org/licenses/LICENSE-2.0
+##
+## Unless required by applicable law or agreed to in writing, software
+## distributed under the License is distributed on an "AS IS" BASIS,
+## WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+## See the License for the specific language governing permissions and
+## limitations under the License.
+##
+
+"""
+demo_site.py
+
+Local stand-in for demo-xss-site.php, the target the json/samples inputs point at.
+Reflects each known parameter, unencoded, into its own context, except 'html',
+which is dropped as in the samples where it does not reflect.
+
+    python -m benchmarks.demo_site [port]
+"""
+
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+import sys
+import threading
+from urllib.parse import parse_qsl, urlsplit
+
+DEMO_PATH = '/demo-xss-site.php'
+
+DEMO_PARAMS = [
+    'tagName', 'attributeName', 'singleQuotedAttributeValue', 'doubleQuotedAttributeValue',
+    'unquotedAttributeValue', 'html', 'htmlComment', 'styleTag', 'styleAttribute',
+    'idAttribute', 'classAttribute', 'jsSingleQuotedString', 'jsDoubleQuotedString',
+    'jsSingleLineComment', 'jsMultiLineComment', 'js'
+    ]
+
+DEMO_PAGE = '''<html>
+<head>
+<title>Demo XSS site</title>
+<style>body {{ color: {styleTag}; }}</style>
+<script>var singleQuoted = '{jsSingleQuotedString}';</script>
+<script>var doubleQuoted = "{jsDoubleQuotedString}";</script>
+<script>// {jsSingleLineComment}
+</script>
+<script>/* {jsMultiLineComment} */</script>
+<script>{js}</script>
+</head>
+<body>
+<{tagName}>tag name</{tagName}>
+<div {attributeName}="x">attribute name</div>
+<div title='{singleQuotedAttributeValue}'>single quoted attribute value</div>
+<div title="{doubleQuotedAttributeValue}">double quoted attribute value</div>
+<div title={unquotedAttributeValue}>unquoted attribute value</div>
+<p>{html}</p>
+<!-- {htmlComment} -->
+<div style="color: {styleAttribute}">style attribute</div>
+<div id="{idAttribute}">id attribute</div>
+<div class="{classAttribute}">class attribute</div>
+</body>
+</html>
+'''
+
+def render_demo_page(params):
+    """
+    Fill the demo page with the given parameter values.
+
+    Args:
+        params (dict)
+
+    Returns:
+        (str)
+    """
+
+    values = {}
+    for name in DEMO_PARAMS:
+        values[name] = params.get(name, 'foo')
+
+    # HTML-encoding would still reflect the alphabetic reflection trigger
+    values['html'] = 'not reflected'
+
+    # An empty tag name would make the page unparseable rather than just unhelpful
+    if not values['tagName']:
+        values['tagName'] = 'span'
+
+    return DEMO_PAGE.format(**values)
+
+class DemoSiteHandler(BaseHTTPRequestHandler):
+    """
+    Serves the demo page for GET and form-encoded POST requests.
+    """
+
+    protocol_version = 'HTTP/1.1'
+
+    def __respond(self, params):
+        body = render_demo_page(params).encode('utf-8')
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def __query_params(self):
+        parts = urlsplit(self.path)
+        if parts.path != DEMO_PATH:
+            self.send_error(404)
+            return None
+        return dict(parse_qsl(parts.query, keep_blank_values=True))
+
+    def do_GET(self):
+        params = self.__query_params()
+        if params is not None:
+            self.__respond(params)
+
+    def do_POST(self):
+        params = self.__query_params()
+        if params is None:
+            return
+
+        length = int(self.headers.get('Content-Length', 0))
+        body = self.rfile.read(length).decode('utf-8')
+        params.update(parse_qsl(body, keep_blank_values=True))
+
+        self.__respond(params)
+
+    def log_message(self, format, *args):
+        pass
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+def start_demo_site(port=0):
+    """
+    Start the demo site on a background thread.
+
+    Args:
+        port (int) - 0 picks a free port
+
+    Returns:
+        (HTTPServer) - base URL of the demo page is demo_url(server)
+    """
+
+    server = ThreadingHTTPServer(('127.0.0.1', port), DemoSiteHandler)
+
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+
+    return server
+
+def demo_url(server):
+    """
+    URL of the demo page on a running demo site.
+
+    Args:
+        server (HTTPServer)
+
+    Returns:
+        (str)
+    """
+
+    return 'http://127.0.0.1:' + str(server.server_address[1]) + DEMO_PATH
+
+if __name__ == '__main__':
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8080
+    ThreadingHTTPServer(('127.0.0.1', port), DemoSiteHandler).serve_forever()
@@ -0,0 +1,228 @@
+##
+## Application Security Threat Attack Modeling (ASTAM)
+##
+## Copyright (C) 2017 Applied Visions - http://securedecisions.com
+##
+## Written by Aspect Security - http://aspectsecurity.com
+##
+## Licensed under the Apache License, Version 2.0 (the "License");
+## you may not use this file except in compliance with the License.
+## You may obtain a copy of the License at
+##
+##     http://www.apache.org/licenses/LICENSE-2.0
+##
+## Unless required by applicable law or agreed to in writing, software
+## distributed under the License is distributed on an "AS IS" BASIS,
+## WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+## See the License for the specific language governing permissions and
+## limitations under the License.
+##
+
+"""
+run_benchmarks.py
+
+Scripted end-to-end scenarios against the local demo site and stub renderer.
+Reports renders/sec, p50/p99 latency of assess_GET_request / assess_POST_request
+and peak Python memory for each, and fails if a scenario's XSS findings differ from
+those of the scenario it must match (see FINDINGS_MATCH).
+
+    python -m benchmarks.run_benchmarks [-i iterations] [-d render_delay_ms]
+                                        [-s scenario ...] [-p protocol_version]
+                                        [--json output.json]
+"""
+
+import argparse
+import json
+import re
+import sys
+import time
+import tracemalloc
+
+from xssmap.PageRenderAPI import PhantomRenderClient
+from xssmap.XssMap import XssMap
+
+from .demo_site import DEMO_PARAMS, demo_url, start_demo_site
+from .stub_renderer import StubRenderer
+
+# name : (request type, XssMap keyword arguments)
+SCENARIOS = [
+    ('reflect_GET', 'GET', {'do_xss' : False}),
+    ('reflect_POST', 'POST', {'do_xss' : False}),
+    ('full_GET', 'GET', {}),
+    ('full_POST', 'POST', {}),
+    ('full_GET_concurrent', 'GET', {'concurrency' : 8}),
+    ('full_GET_batch', 'GET', {'concurrency' : 4, 'batch' : True}),
+    ('full_GET_stop_first_certain', 'GET', {'stop_policy' : 'first_certain_per_param'}),
+    ('full_GET_stop_first_certain_concurrent', 'GET', {'concurrency' : 8, \
+            'stop_policy' : 'first_certain_per_param'}),
+    ('xss_only_GET', 'GET', {'do_reflect' : False, 'concurrency' : 8}),
+    ]
+
+# Scenario : scenario whose XSS findings it must report exactly - how a scan renders
+# must never change what it finds, and a stop policy finds the same whatever the
+# concurrency
+FINDINGS_MATCH = {
+    'reflect_POST' : 'reflect_GET',
+    'full_POST' : 'full_GET',
+    'full_GET_concurrent' : 'full_GET',
+    'full_GET_batch' : 'full_GET',
+    'full_GET_stop_first_certain_concurrent' : 'full_GET_stop_first_certain',
+    }
+
+# Triggers are random, so findings are compared with them masked out
+TRIGGER_PATTERN = re.compile(r'\d{9}')
+
+def percentile(values, fraction):
+    """
+    Nearest-rank percentile of a list of numbers.
+
+    Args:
+        values (list)
+        fraction (float) - 0.5 for p50, 0.99 for p99
+
+    Returns:
+        (float)
+    """
+
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, int(round(fraction * len(ordered) + 0.5)) - 1))
+
+    return ordered[rank]
+
+def run_scenario(name, request_type, options, site_url, renderer, stub, iterations):
+    """
+    Run one scenario and measure it.
+
+    Returns:
+        (dict)
+    """
+
+    query = '&'.join(param + '=foo' for param in DEMO_PARAMS)
+
+    stub.reset_counters()
+    latencies = []
+
+    tracemalloc.start()
+    started = time.perf_counter()
+
+    for i in range(iterations):
+        xss_map = XssMap(renderer=renderer, **options)
+
+        call_started = time.perf_counter()
+        if request_type == 'GET':
+            output = xss_map.assess_GET_request(site_url + '?' + query)
+        else:
+            output = xss_map.assess_POST_request(site_url, query)
+        latencies.append(time.perf_counter() - call_started)
+
+    elapsed = time.perf_counter() - started
+    current_memory, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    result = {}
+    result['scenario'] = name
+    result['iterations'] = iterations
+    result['renders'] = stub.renders_served
+    result['renderer_requests'] = stub.requests_served
+    result['renders_per_sec'] = stub.renders_served / elapsed if elapsed else 0.0
+    result['p50_ms'] = percentile(latencies, 0.5) * 1000
+    result['p99_ms'] = percentile(latencies, 0.99) * 1000
+    result['peak_memory_kb'] = peak_memory / 1024.0
+    result['findings'] = sorted([finding['parameter'], finding['certainty'], \
+            TRIGGER_PATTERN.sub('N', finding['attack'])] \
+            for finding in output['results'].get('xss_scan', []))
+
+    return result
+
+def print_results(results):
+    """
+    Print scenario results as a table.
+
+    Args:
+        results (list)
+    """
+
+    header = '%-40s %8s %8s %11s %10s %10s %12s %8s' % ('scenario', 'renders', \
+            'requests', 'renders/s', 'p50 ms', 'p99 ms', 'peak mem KB', 'findings')
+    print(header)
+    print('-' * len(header))
+
+    for r in results:
+        print('%-40s %8d %8d %11.1f %10.1f %10.1f %12.0f %8d' % (r['scenario'], \
+                r['renders'], r['renderer_requests'], r['renders_per_sec'], r['p50_ms'], \
+                r['p99_ms'], r['peak_memory_kb'], len(r['findings'])))
+
+def check_findings(results):
+    """
+    Compare findings between the scenarios FINDINGS_MATCH pairs up, where both ran,
+    printing any difference. Run with -s, a scenario is only checked if the one it
+    must match is also given.
+
+    Args:
+        results (list)
+
+    Returns:
+        (bool) - whether all matched
+    """
+
+    findings = dict((r['scenario'], r['findings']) for r in results)
+    matched = True
+
+    for name, reference in sorted(FINDINGS_MATCH.items()):
+        if name not in findings or reference not in findings:
+            continue
+
+        missing = [f for f in findings[reference] if f not in findings[name]]
+        extra = [f for f in findings[name] if f not in findings[reference]]
+        if missing or extra:
+            matched = False
+            print(name + ' findings differ from ' + reference + ':')
+            for finding in missing:
+                print('    missing ' + ' '.join(finding))
+            for finding in extra:
+                print('    extra   ' + ' '.join(finding))
+
+    return matched
+
+def main():
+    parser = argparse.ArgumentParser(description='Offline xssmap throughput benchmarks.')
+    parser.add_argument('-i', '--iterations', type=int, default=5)
+    parser.add_argument('-d', '--render-delay', type=float, default=0, \
+            help='milliseconds the stub renderer waits per render')
+    parser.add_argument('-s', '--scenario', action='append', \
+            help='only run this scenario, may be repeated')
+    parser.add_argument('-p', '--protocol', type=int, default=None, \
+            help='renderer wire protocol version, negotiated if not given')
+    parser.add_argument('--json', help='also write results to this file')
+    args = parser.parse_args()
+
+    site = start_demo_site()
+    stub = StubRenderer(render_delay_ms=args.render_delay)
+    stub.start()
+
+    renderer = PhantomRenderClient(stub.address, pool_maxsize=16, protocol_version=args.protocol)
+
+    results = []
+    for name, request_type, options in SCENARIOS:
+        if args.scenario and name not in args.scenario:
+            continue
+        results.append(run_scenario(name, request_type, options, demo_url(site), renderer, \
+                stub, args.iterations))
+
+    print_results(results)
+    matched = check_findings(results)
+
+    if args.json:
+        with open(args.json, 'w') as outfile:
+            json.dump(results, outfile, indent=2)
+
+    renderer.close()
+    stub.shutdown()
+    site.shutdown()
+
+    if not matched:
+        sys.exit(1)
+
+# Run from command line
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,315 @@
+##
+## Application Security Threat Attack Modeling (ASTAM)
+##
+## Copyright (C) 2017 Applied Visions - http://securedecisions.com
+##
+## Written by Aspect Security - http://aspectsecurity.com
+##
+## Licensed under the Apache License, Version 2.0 (the "License");
+## you may not use this file except in compliance with the License.
+## You may obtain a copy of the License at
+##
+##     http://www.apache.org/licenses/LICENSE-2.0
+##
+## Unless required by applicable law or agreed to in writing, software
+## distributed under the License is distributed on an "AS IS" BASIS,
+## WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+## See the License for the specific language governing permissions and
+## limitations under the License.
+##
+
+"""
+stub_renderer.py
+
+Fake rendering engine speaking the renderers/phantom-render.js protocol, so
+xssmap can run without PhantomJS. It fetches the page over plain HTTP and, in
+place of running Javascript, reports an alert for every alert(...) call found in
+a <script> element or an on* attribute. An optional delay stands in for browser
+render time. It speaks both wire protocol versions unless limited to some.
+
+    python -m benchmarks.stub_renderer [port] [render_delay_ms] [protocols, like 1,2]
+"""
+
+import base64
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import json
+import re
+from socketserver import ThreadingMixIn
+import sys
+import threading
+import time
+from urllib.parse import parse_qsl, quote
+import urllib.request
+
+from lxml import html
+
+ALERT_PATTERN = re.compile(r'alert\(([^)]*)\)')
+
+def fetch_page(method, url, body, headers, cookies):
+    """
+    Fetch a page the way the renderer would load it.
+
+    Returns:
+        (str)
+    """
+
+    # Browsers percent-encode what the scanner leaves raw in attack URLs
+    url = quote(url, safe=':/?&=%#;,+@!$\'()*[]~')
+
+    request_headers = dict(headers or {})
+    if cookies:
+        request_headers['Cookie'] = '; '.join(c['name'] + '=' + c['value'] \
+                if isinstance(c, dict) else c[0] + '=' + c[1] for c in cookies)
+
+    data = None
+    if method == 'POST':
+        data = (body or '').encode('utf-8')
+
+    request = urllib.request.Request(url, data=data, headers=request_headers, method=method)
+
+    with urllib.request.urlopen(request) as response:
+        return response.read().decode('utf-8', 'replace')
+
+def find_alerts(page_html):
+    """
+    Stand-in for Javascript execution - alert(...) arguments in scripts and handlers.
+
+    Args:
+        page_html (str)
+
+    Returns:
+        (list)
+    """
+
+    alerts = []
+
+    try:
+        tree = html.fromstring(page_html)
+    except Exception:
+        return alerts
+
+    for element in tree.getroottree().getroot().iter():
+        if not isinstance(element.tag, str):
+            continue
+        if element.tag == 'script' and element.text:
+            alerts.extend(ALERT_PATTERN.findall(element.text))
+        for name, value in element.attrib.items():
+            if name.startswith('on'):
+                alerts.extend(ALERT_PATTERN.findall(value))
+
+    return alerts
+
+def render_job(job, render_delay):
+    """
+    Render one decoded job into the protocol's response object.
+
+    Args:
+        job (dict)
+        render_delay (float) - seconds
+
+    Returns:
+        (dict)
+    """
+
+    try:
+        page_html = fetch_page(job['method'], job['url'], job['body'], job['headers'], \
+                job['cookies'])
+        errors = []
+    except Exception as e:
+        page_html = '<html></html>'
+        errors = [str(e)]
+
+    # A render running past its deadline sends back what it has
+    timed_out = False
+    if job.get('deadlineMs') and render_delay * 1000 > job['deadlineMs']:
+        render_delay = job['deadlineMs'] / 1000.0
+        timed_out = True
+
+    if render_delay:
+        time.sleep(render_delay)
+
+    outputs = job.get('outputs', ['html', 'events'])
+
+    res = {}
+    if 'html' in outputs:
+        res['html'] = page_html
+    if 'events' in outputs:
+        res['errors'] = errors
+        res['consoleMessages'] = []
+        res['alerts'] = find_alerts(page_html)
+        res['confirms'] = []
+        res['prompts'] = []
+    res['timedOut'] = timed_out
+
+    return res
+
+def decode_job(fields, version=1):
+    """
+    Decode one job from its fields, base64 encoded under protocol version 1.
+
+    Args:
+        fields (dict)
+        version (int)
+
+    Returns:
+        (dict)
+    """
+
+    job = {}
+    job['method'] = fields.get('method', 'GET')
+    job['body'] = None
+    job['headers'] = None
+    job['cookies'] = None
+
+    job['outputs'] = ['html', 'events']
+    job['deadlineMs'] = int(fields.get('deadlineMs') or 0)
+
+    if version >= 2:
+        job['outputs'] = fields.get('outputs') or job['outputs']
+        job['url'] = fields['url']
+        job['body'] = fields.get('body')
+        job['headers'] = fields.get('headers')
+        job['cookies'] = fields.get('cookies')
+        return job
+
+    job['url'] = base64.b64decode(fields['url']).decode('utf-8')
+
+    if 'body' in fields:
+        job['body'] = base64.b64decode(fields['body']).decode('utf-8')
+    if 'headers' in fields:
+        job['headers'] = json.loads(base64.b64decode(fields['headers']).decode('utf-8'))
+    if 'cookies' in fields:
+        job['cookies'] = json.loads(base64.b64decode(fields['cookies']).decode('utf-8'))
+
+    return job
+
+def encode_result(res):
+    """
+    Wrap each field of a response object the way phantom-render.js does.
+
+    Args:
+        res (dict)
+
+    Returns:
+        (dict)
+    """
+
+    encoded = {}
+    encoded['html'] = base64.b64encode(res['html'].encode('utf-8')).decode('ascii')
+    for field in ['errors', 'consoleMessages', 'alerts', 'confirms', 'prompts']:
+        encoded[field] = base64.b64encode(json.dumps(res[field]).encode('utf-8')).decode('ascii')
+    encoded['timedOut'] = res['timedOut']
+
+    return encoded
+
+class StubRendererHandler(BaseHTTPRequestHandler):
+    """
+    Handles protocol negotiation, and single and batch render requests.
+    """
+
+    protocol_version = 'HTTP/1.1'
+
+    def __respond(self, response):
+        body = json.dumps(response).encode('utf-8')
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if 2 not in self.server.protocols:
+            # Version 1 only engines do not take part in negotiation
+            self.send_error(404)
+            return
+
+        response = {}
+        response['protocols'] = self.server.protocols
+        self.__respond(response)
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        raw = self.rfile.read(length).decode('utf-8')
+
+        self.server.count_request()
+        render_delay = self.server.render_delay
+
+        if self.headers.get('Content-Type', '').startswith('application/json'):
+            message = json.loads(raw)
+            jobs = [decode_job(f, 2) for f in message['jobs']]
+            self.server.count_renders(len(jobs))
+            response = {}
+            response['version'] = 2
+            response['results'] = [render_job(job, render_delay) for job in jobs]
+            self.__respond(response)
+            return
+
+        fields = dict(parse_qsl(raw, keep_blank_values=True))
+
+        if 'jobs' in fields:
+            jobs = [decode_job(f) for f in json.loads(base64.b64decode(fields['jobs']))]
+            self.server.count_renders(len(jobs))
+            response = [encode_result(render_job(job, render_delay)) for job in jobs]
+        else:
+            self.server.count_renders(1)
+            response = encode_result(render_job(decode_job(fields), render_delay))
+
+        self.__respond(response)
+
+    def log_message(self, format, *args):
+        pass
+
+class StubRenderer(ThreadingMixIn, HTTPServer):
+    """
+    Threaded stub rendering engine, counting requests and renders it served.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, port=0, render_delay_ms=0, protocols=(1, 2)):
+        HTTPServer.__init__(self, ('127.0.0.1', port), StubRendererHandler)
+
+        self.render_delay = render_delay_ms / 1000.0
+        self.protocols = list(protocols)
+        self.counter_lock = threading.Lock()
+        self.requests_served = 0
+        self.renders_served = 0
+
+    @property
+    def address(self):
+        return 'http://127.0.0.1:' + str(self.server_address[1])
+
+    def count_request(self):
+        with self.counter_lock:
+            self.requests_served += 1
+
+    def count_renders(self, count):
+        with self.counter_lock:
+            self.renders_served += count
+
+    def reset_counters(self):
+        with self.counter_lock:
+            self.requests_served = 0
+            self.renders_served = 0
+
+    def handle_error(self, request, client_address):
+        # Clients abandoning renders they no longer need hang up mid-request
+        if isinstance(sys.exc_info()[1], ConnectionError):
+            return
+        HTTPServer.handle_error(self, request, client_address)
+
+    def start(self):
+        """
+        Serve on a background thread.
+        """
+
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+if __name__ == '__main__':
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8888
+    delay = float(sys.argv[2]) if len(sys.argv) > 2 else 0
+    protocols = [int(v) for v in sys.argv[3].split(',')] if len(sys.argv) > 3 else [1, 2]
+    StubRenderer(port, delay, protocols).serve_forever()
@@ -28,177 +28,666 @@ var webserver = require('webserver');
 var host = '127.0.0.1';
 var port = '8888';
 
+// Wire protocol versions this renderer speaks, see PhantomRenderClient
+//   1 - form fields and response fields each base64 encoded
+//   2 - one JSON object each way with plain strings
+var PROTOCOL_VERSIONS = [1, 2];
+
+// Debug logging (including every rendered page) only with --verbose
+var verbose = false;
+
+// Warm page pool - up to pagePoolSize idle pages are kept configured for the next
+// job, each closed after maxPageReuse renders to contain leaks. Set with
+// --pool-size=N and --max-reuse=N
+var pagePoolSize = 4;
+var maxPageReuse = 50;
+
+// Default per-render deadline, after which whatever was rendered so far is sent back
+// flagged as timed out, and default settle window - how long the network must stay
+// idle after load before the page counts as done. Jobs may give their own, set the
+// defaults with --deadline-ms=N and --settle-ms=N
+var defaultDeadlineMs = 30000;
+var defaultSettleMs = 0;
+
+var positionalArgs = [];
+for (var a = 1; a < system.args.length; a++) {
+	var arg = system.args[a];
+	if (arg === '--verbose') {
+		verbose = true;
+	} else if (arg.indexOf('--pool-size=') === 0) {
+		pagePoolSize = parseInt(arg.split('=')[1], 10);
+	} else if (arg.indexOf('--max-reuse=') === 0) {
+		maxPageReuse = Math.max(1, parseInt(arg.split('=')[1], 10));
+	} else if (arg.indexOf('--deadline-ms=') === 0) {
+		defaultDeadlineMs = parseInt(arg.split('=')[1], 10);
+	} else if (arg.indexOf('--settle-ms=') === 0) {
+		defaultSettleMs = parseInt(arg.split('=')[1], 10);
+	} else {
+		positionalArgs.push(arg);
+	}
+}
+
+// Port may be given as first argument, so several renderers can run side by side
+if (positionalArgs.length > 0) {
+	port = positionalArgs[0];
+}
+
+// Default number of pages rendered at once for a batch, may be given as second argument
+var batchConcurrency = 4;
+if (positionalArgs.length > 1) {
+	batchConcurrency = parseInt(positionalArgs[1], 10);
+}
+
 var server = webserver.create();
 
 console.log('[INFO] Starting PhantomJS rendering engine on ' + host + ':' + port);
 
 var requestCounter = 1;
 
-// Start rendering engine, listen for requests to fulfill
-var service = server.listen(host + ':' + port, function(request, response)
+function debug(message)
 {
-	if (request.method == 'POST')
+	if (verbose) {
+		console.log('[DEBUG] ' + message);
+	}
+}
+
+// Read one render job from its fields - base64 encoded under protocol version 1,
+// plain values under version 2
+function parseJob(fields, version)
+{
+	function field(name, isJson)
 	{
-		console.log('[DEBUG] Got request ' + requestCounter);
-		requestCounter++;
+		if (!fields.hasOwnProperty(name) || fields[name] == null) {
+			return null;
+		}
+		if (version >= 2) {
+			return fields[name];
+		}
+		var value = atob(fields[name]);
+		return isJson ? JSON.parse(value) : value;
+	}
+
+	var job = {};
+
+	job.url = field('url', false);
+
+	job.method = 'GET';
+	if (fields.hasOwnProperty('method')) {
+		job.method = fields['method'];
+	}
+
+	debug('method: ' + job.method);
+	debug('url: ' + job.url);
+
+	job.body = field('body', false);
+
+	debug('body: ');
+	debug('\t' + job.body);
+
+	job.headers = field('headers', true);
+
+	debug('headers: ');
+	debug('\t' + JSON.stringify(job.headers));
+
+	job.cookies = field('cookies', true);
 
-		var url = atob(request.post['url']);
+	debug('cookies: ');
+	debug('\t' + JSON.stringify(job.cookies));
 
-		var method = 'GET';
-		if (request.post.hasOwnProperty('method')) {
-			method = request.post['method'];
+	job.provokePageEvents = false;
+	if (fields.hasOwnProperty('provokePageEvents')) {
+		job.provokePageEvents = fields['provokePageEvents'];
+	}
+
+	debug('provokePageEvents: ' + job.provokePageEvents);
+
+	// Which of 'html' and 'events' to send back, html and events by default
+	job.outputs = field('outputs', true);
+	if (job.outputs == null) {
+		job.outputs = ['html', 'events'];
+	}
+
+	debug('outputs: ' + job.outputs.join(', '));
+
+	// Subresources to skip, see ResourcePolicy - everything loads without one
+	job.resourcePolicy = field('resourcePolicy', true);
+
+	debug('resourcePolicy: ' + JSON.stringify(job.resourcePolicy));
+
+	// Plain numbers under either protocol version
+	job.deadlineMs = defaultDeadlineMs;
+	if (fields.hasOwnProperty('deadlineMs') && fields['deadlineMs'] != null) {
+		job.deadlineMs = parseInt(fields['deadlineMs'], 10);
+	}
+
+	job.settleMs = defaultSettleMs;
+	if (fields.hasOwnProperty('settleMs') && fields['settleMs'] != null) {
+		job.settleMs = parseInt(fields['settleMs'], 10);
+	}
+
+	debug('deadlineMs: ' + job.deadlineMs + ', settleMs: ' + job.settleMs);
+
+	return job;
+}
+
+var IMAGE_URL_PATTERN = /\.(png|jpe?g|gif|webp|bmp|ico|svg)([?#]|$)/i;
+var STYLESHEET_URL_PATTERN = /\.css([?#]|$)/i;
+var FONT_URL_PATTERN = /\.(woff2?|ttf|otf|eot)([?#]|$)/i;
+
+// Scheme, host and port of a URL, lowercased - null for URLs without one, like data:
+function urlOrigin(url)
+{
+	var match = /^[a-z][a-z0-9+.\-]*:\/\/[^\/?#]+/i.exec(url);
+	return match ? match[0].toLowerCase() : null;
+}
+
+function requestAccepts(requestData, type)
+{
+	for (var i = 0; i < requestData.headers.length; i++) {
+		var header = requestData.headers[i];
+		if (header.name.toLowerCase() === 'accept' && header.value.indexOf(type) === 0) {
+			return true;
 		}
+	}
+	return false;
+}
 
-		console.log('[DEBUG] method: ' + method);
-		console.log('[DEBUG] url: ' + url);
+// Whether a job's resource policy skips a subresource request
+function isBlockedResource(job, patterns, requestData)
+{
+	var policy = job.resourcePolicy;
+	var url = requestData.url;
 
-		var body = null;
-		if (request.post.hasOwnProperty('body')) {
-			body = atob(request.post['body']);
+	if (policy.blockImages && (IMAGE_URL_PATTERN.test(url) || requestAccepts(requestData, 'image/'))) {
+		return true;
+	}
+	if (policy.blockStylesheets &&
+			(STYLESHEET_URL_PATTERN.test(url) || requestAccepts(requestData, 'text/css'))) {
+		return true;
+	}
+	if (policy.blockFonts && FONT_URL_PATTERN.test(url)) {
+		return true;
+	}
+
+	var origin = urlOrigin(url);
+	if (origin != null && policy.allowedOrigins && policy.allowedOrigins.length > 0 &&
+			origin !== urlOrigin(job.url) && policy.allowedOrigins.indexOf(origin) < 0) {
+		return true;
+	}
+
+	for (var i = 0; i < patterns.length; i++) {
+		if (patterns[i].test(url)) {
+			return true;
 		}
+	}
+
+	return false;
+}
+
+// Function telling whether a job's resource policy skips a resource request
+function makeResourceFilter(job)
+{
+	var policy = job.resourcePolicy;
+
+	if (policy == null) {
+		return function() {
+			return false;
+		};
+	}
 
-		console.log('[DEBUG] body: ');
-		console.log('[DEBUG] \t' + body);
+	var patterns = [];
+	var patternSources = policy.blockedUrlPatterns || [];
+	for (var i = 0; i < patternSources.length; i++) {
+		patterns.push(new RegExp(patternSources[i]));
+	}
+
+	// The first request is the page itself, always let through
+	var documentRequested = false;
 
-		var headers = null;
-		if (request.post.hasOwnProperty('headers')) {
-			headers = JSON.parse(atob(request.post['headers']));
+	return function(requestData) {
+		if (!documentRequested) {
+			documentRequested = true;
+			return false;
 		}
+		return isBlockedResource(job, patterns, requestData);
+	};
+}
+
+// Wrap a render result for the wire, each field base64 encoded under protocol version 1
+function encodeResult(res, version)
+{
+	if (version >= 2) {
+		return res;
+	}
 
-		console.log('[DEBUG] headers: ');
-		console.log('[DEBUG] \t' + headers);
+	var encoded = {};
+	if (res.hasOwnProperty('error')) {
+		encoded.error = btoa(res.error);
+		return encoded;
+	}
 
-		var cookies = null;
-		if (request.post.hasOwnProperty('cookies')) {
-			cookies = JSON.parse(atob(request.post['cookies']));
+	encoded.html = btoa(res.html);
+	encoded.errors = btoa(JSON.stringify(res.errors));
+	encoded.consoleMessages = btoa(JSON.stringify(res.consoleMessages));
+	encoded.alerts = btoa(JSON.stringify(res.alerts));
+	encoded.confirms = btoa(JSON.stringify(res.confirms));
+	encoded.prompts = btoa(JSON.stringify(res.prompts));
+	encoded.timedOut = res.timedOut;
+
+	return encoded;
+}
+
+var idlePages = [];
+
+function ignoreEvent() {
+}
+
+function createPage()
+{
+	debug('Creating page');
+
+	var page = webpage.create();
+
+	// Play fast and loose with security settings
+	page.settings.javascriptEnabled = true;
+	page.settings.loadImages = true;
+	page.settings.localToRemoteUrlAccessEnabled = true;
+	page.settings.webSecurityEnabled = false;
+	page.settings.XSSAuditingEnabled = false;
+
+	page.renderCount = 0;
+
+	return page;
+}
+
+// An idle pooled page, or a new one when all are busy
+function acquirePage()
+{
+	if (idlePages.length > 0) {
+		return idlePages.pop();
+	}
+
+	return createPage();
+}
+
+// Detach a finished job from its page, then blank the page and return it to the pool -
+// or close it, if worn out or the pool is full
+function releasePage(page)
+{
+	page.renderCount++;
+
+	page.onError = ignoreEvent;
+	page.onConsoleMessage = ignoreEvent;
+	page.onAlert = ignoreEvent;
+	page.onConfirm = ignoreEvent;
+	page.onPrompt = ignoreEvent;
+	page.onLoadFinished = ignoreEvent;
+	page.onResourceRequested = ignoreEvent;
+	page.onResourceReceived = ignoreEvent;
+	page.onResourceError = ignoreEvent;
+	page.onResourceTimeout = ignoreEvent;
+	page.customHeaders = {};
+
+	if (page.renderCount >= maxPageReuse || idlePages.length >= pagePoolSize) {
+		page.close();
+		return;
+	}
+
+	// Leaving the job's page stops its scripts and timers before the next job
+	var blanked = false;
+	page.open('about:blank', function() {
+		if (blanked) {
+			return;
 		}
+		blanked = true;
 
-		console.log('[DEBUG] cookies: ');
-		console.log('[DEBUG] \t' + cookies);
+		page.onLoadFinished = ignoreEvent;
 
-		var provokePageEvents = false;
-		if (request.post.hasOwnProperty('provokePageEvents')) {
-			provokePageEvents = request.post['provokePageEvents'];
+		if (idlePages.length >= pagePoolSize) {
+			page.close();
+		} else {
+			idlePages.push(page);
 		}
+	});
+}
 
-		console.log('[DEBUG] provokePageEvents: ' + provokePageEvents);
+// Render one job on a pooled page, then hand its result object to done - once the
+// page has loaded and settled, or with what there is when the job's deadline passes
+function renderJob(job, done)
+{
+	var errors = [];
+	var consoleMessages = [];
+	var alerts = [];
+	var confirms = [];
+	var prompts = [];
+
+	var loaded = false;
+	var finished = false;
+	var deadlineTimer = null;
+	var settleTimer = null;
+
+	var pendingRequests = {};
+	var pendingCount = 0;
+	var lastNetworkActivity = Date.now();
+
+	// Patterns are checked with Python's re before they are sent, which accepts some
+	// Javascript cannot compile - those fail the job rather than the engine
+	var isBlocked;
+	try {
+		isBlocked = makeResourceFilter(job);
+	} catch (e) {
+		done({error: 'Invalid blocked URL pattern: ' + e.message});
+		return;
+	}
 
-		var errors = [];
-		var consoleMessages = [];
-		var alerts = [];
-		var confirms = [];
-		var prompts = [];
+	var page = acquirePage();
 
-		var page = webpage.create();
+	page.onError = function(message) {
+		errors.push(message);
+	};
 
-		// Play fast and loose with security settings
-		page.settings.javascriptEnabled = true;
-		page.settings.loadImages = true;
-		page.settings.localToRemoteUrlAccessEnabled = true;
-		page.settings.webSecurityEnabled = false;
-		page.settings.XSSAuditingEnabled = false;
+	page.onConsoleMessage = function(message) {
+		consoleMessages.push(message);
+	};
 
-		page.onError = function(message) {
-			errors.push(message);
-		};
+	page.onAlert = function(message) {
+		alerts.push(message);
+	};
 
-		page.onConsoleMessage = function(message) {
-			consoleMessages.push(message);
-		};
+	page.onConfirm = function(message) {
+		confirms.push(message);
+	};
 
-		page.onAlert = function(message) {
-			alerts.push(message);
-		};
+	page.onPrompt = function(message) {
+		prompts.push(message);
+	};
 
-		page.onConfirm = function(message) {
-			confirms.push(message);
-		};
+	page.customHeaders = {};
+	if (job.headers != null) {
+		page.customHeaders = job.headers;
+	}
 
-		page.onPrompt = function(message) {
-			prompts.push(message);
-		};
+	page.settings.loadImages = !(job.resourcePolicy != null && job.resourcePolicy.blockImages);
 
-		if (headers != null) {
-			page.customHeaders = headers;
+	page.onResourceRequested = function(requestData, networkRequest) {
+		lastNetworkActivity = Date.now();
+		if (isBlocked(requestData)) {
+			debug('Blocked ' + requestData.url);
+			networkRequest.abort();
+			return;
 		}
+		pendingRequests[requestData.id] = true;
+		pendingCount++;
+	};
+
+	function requestDone(id) {
+		lastNetworkActivity = Date.now();
+		if (pendingRequests.hasOwnProperty(id)) {
+			delete pendingRequests[id];
+			pendingCount--;
+		}
+	}
 
-		if (cookies != null) {
-			for (var i = 0; i < cookies.length; i++) {
-				phantom.addCookie(cookies[i]);
-			}
+	page.onResourceReceived = function(response) {
+		if (response.stage === 'end') {
+			requestDone(response.id);
 		}
+	};
 
-		if (method === 'GET')
-		{
-			page.open(url, {encoding: 'utf-8'});
+	page.onResourceError = function(resourceError) {
+		requestDone(resourceError.id);
+	};
+
+	page.onResourceTimeout = function(request) {
+		requestDone(request.id);
+	};
+
+	if (job.cookies != null) {
+		for (var i = 0; i < job.cookies.length; i++) {
+			phantom.addCookie(job.cookies[i]);
 		}
-		else if (method === 'POST')
-		{
-			if (body == null)
-			{
-				body = '';
+	}
+
+	function finish(timedOut)
+	{
+		if (finished) {
+			return;
+		}
+		finished = true;
+
+		clearTimeout(deadlineTimer);
+		clearInterval(settleTimer);
+
+		var res = {};
+		if (job.outputs.indexOf('html') >= 0) {
+			res.html = page.content;
+		}
+		if (job.outputs.indexOf('events') >= 0) {
+			res.errors = errors;
+			res.consoleMessages = consoleMessages;
+			res.alerts = alerts;
+			res.confirms = confirms;
+			res.prompts = prompts;
+		}
+		res.timedOut = timedOut;
+
+		if (verbose) {
+			debug('Dumping interpreted page.content \n\n');
+			console.log(page.content);
+			console.log('\n\n');
+		}
+
+		debug('End of render' + (timedOut ? ', deadline passed' : ''));
+
+		releasePage(page);
+
+		done(res);
+	}
+
+	// Done once no request has been in flight for the settle window
+	function settle()
+	{
+		if (job.settleMs <= 0) {
+			finish(false);
+			return;
+		}
+
+		settleTimer = setInterval(function() {
+			if (pendingCount === 0 && Date.now() - lastNetworkActivity >= job.settleMs) {
+				finish(false);
 			}
+		}, Math.min(50, job.settleMs));
+	}
+
+	if (job.deadlineMs > 0) {
+		deadlineTimer = setTimeout(function() {
+			finish(true);
+		}, job.deadlineMs);
+	}
 
-			//page.open(url, method, body);
-			page.open(url, {operation: 'post', data: body, encoding: 'utf-8'});
+	page.onLoadFinished = function(status)
+	{
+		// Frames and redirects can finish loading more than once
+		if (loaded || finished) {
+			return;
 		}
+		loaded = true;
+
+		debug('Page load finished');
 
-		page.onLoadFinished = function(status)
+		if (job.provokePageEvents)
 		{
-			console.log('[DEBUG] Page load finished');
+			debug('Starting page events');
 
-			if (provokePageEvents)
+			// Attempt to hit on all document event handling
+			page.evaluate(function()
 			{
-				console.log('[DEBUG] Starting page events');
-
-				// Attempt to hit on all document event handling
-				page.evaluate(function()
-				{
-					var mouseEvents = ['click', 'contextmenu', 'dblclick', 'mousedown',
-															'mouseenter', 'mouseleave', 'mousemove',
-															'mouseover', 'mouseout', 'mouseup'];
-
-					mouseEvents.forEach(function(mouseEvent) {
-						// Match all elements with a handler matching this event
-					  var elementsWithNonNullHandlers = document.querySelectorAll("*[on" + mouseEvent + "]");
-					  if (elementsWithNonNullHandlers != null ) {
-					      elementsWithNonNullHandlers.forEach(function(element) {
-									// create the trigger event
-									var triggerEvent = new MouseEvent(mouseEvent, {
-										bubbles: true,
-										cancelable: true,
-										view: window
-									});
-
-									// dispatch it
-									element.dispatchEvent(triggerEvent);
-					      });
-					  }
-					});
+				var mouseEvents = ['click', 'contextmenu', 'dblclick', 'mousedown',
+														'mouseenter', 'mouseleave', 'mousemove',
+														'mouseover', 'mouseout', 'mouseup'];
+
+				mouseEvents.forEach(function(mouseEvent) {
+					// Match all elements with a handler matching this event
+				  var elementsWithNonNullHandlers = document.querySelectorAll("*[on" + mouseEvent + "]");
+				  if (elementsWithNonNullHandlers != null ) {
+				      elementsWithNonNullHandlers.forEach(function(element) {
+								// create the trigger event
+								var triggerEvent = new MouseEvent(mouseEvent, {
+									bubbles: true,
+									cancelable: true,
+									view: window
+								});
+
+								// dispatch it
+								element.dispatchEvent(triggerEvent);
+				      });
+				  }
 				});
+			});
+
+			debug('Finished page events');
+		}
+
+		settle();
+	};
+
+	if (job.method === 'GET')
+	{
+		page.open(job.url, {encoding: 'utf-8'});
+	}
+	else if (job.method === 'POST')
+	{
+		var body = job.body;
+		if (body == null)
+		{
+			body = '';
+		}
+
+		page.open(job.url, {operation: 'post', data: body, encoding: 'utf-8'});
+	}
+}
+
+// Render a list of jobs, at most concurrency at a time, then hand the results
+// (in job order) to done
+function renderBatch(jobs, concurrency, done)
+{
+	var results = new Array(jobs.length);
+	var nextJob = 0;
+	var jobsFinished = 0;
 
-				console.log('[DEBUG] Finished page events');
+	if (jobs.length === 0) {
+		done(results);
+		return;
+	}
+
+	function startNextJob()
+	{
+		if (nextJob >= jobs.length) {
+			return;
+		}
+
+		var jobIndex = nextJob;
+		nextJob++;
+
+		renderJob(jobs[jobIndex], function(res) {
+			results[jobIndex] = res;
+			jobsFinished++;
+
+			if (jobsFinished === jobs.length) {
+				done(results);
+			} else {
+				startNextJob();
 			}
+		});
+	}
 
-			var res = {};
-			console.log('\n\n');
-			console.log('[DEBUG] Dumping interpreted page.content \n\n');
-			console.log(page.content);
-			console.log('\n\n');
-			res.html = btoa(page.content);
-			res.errors = btoa(JSON.stringify(errors));
-			res.consoleMessages = btoa(JSON.stringify(consoleMessages));
-			res.alerts = btoa(JSON.stringify(alerts));
-			res.confirms = btoa(JSON.stringify(confirms));
-			res.prompts = btoa(JSON.stringify(prompts));
+	for (var i = 0; i < concurrency && i < jobs.length; i++) {
+		startNextJob();
+	}
+}
 
-			console.log('[DEBUG] End of render, sending response');
+// Serialize as JSON with non-ASCII characters escaped, so the wire stays ASCII whatever
+// encoding the webserver writes in
+function toAsciiJson(obj)
+{
+	return JSON.stringify(obj).replace(/[\u007f-\uffff]/g, function(c) {
+		return '\\u' + ('0000' + c.charCodeAt(0).toString(16)).slice(-4);
+	});
+}
 
-			response.statusCode = 200;
-			response.write(JSON.stringify(res));
-			response.close();
+function sendResponse(response, res)
+{
+	debug('Sending response');
 
-			page.close();
+	response.statusCode = 200;
+	response.headers = {'Content-Type': 'application/json'};
+	response.write(toAsciiJson(res));
+	response.close();
+}
+
+// Warm the page pool, then start rendering engine, listen for requests to fulfill
+for (var p = 0; p < pagePoolSize; p++) {
+	idlePages.push(createPage());
+}
+
+var service = server.listen(host + ':' + port, function(request, response)
+{
+	if (request.method == 'GET')
+	{
+		// Protocol negotiation, renderers that do not answer here only speak version 1
+		sendResponse(response, {protocols: PROTOCOL_VERSIONS});
+	}
+	else if (request.method == 'POST')
+	{
+		debug('Got request ' + requestCounter);
+		requestCounter++;
+
+		var jobs = [];
+		var concurrency = batchConcurrency;
+
+		if (typeof request.post === 'string')
+		{
+			// Version 2 - a JSON body, {"version": 2, "jobs": [...], "concurrency": n}
+			var message = JSON.parse(request.post);
+			for (var j = 0; j < message.jobs.length; j++) {
+				jobs.push(parseJob(message.jobs[j], 2));
+			}
+
+			if (message.hasOwnProperty('concurrency') && message.concurrency != null) {
+				concurrency = parseInt(message.concurrency, 10);
+			}
+
+			debug('Version 2 batch of ' + jobs.length + ', concurrency ' + concurrency);
+
+			renderBatch(jobs, Math.max(1, concurrency), function(results) {
+				sendResponse(response, {version: 2, results: results});
+			});
+		}
+		else if (request.post.hasOwnProperty('jobs'))
+		{
+			// Batch of jobs, each with the same fields as a single request
+			var jobFields = JSON.parse(atob(request.post['jobs']));
+			for (var i = 0; i < jobFields.length; i++) {
+				jobs.push(parseJob(jobFields[i], 1));
+			}
+
+			if (request.post.hasOwnProperty('concurrency')) {
+				concurrency = parseInt(request.post['concurrency'], 10);
+			}
+
+			debug('Batch of ' + jobs.length + ', concurrency ' + concurrency);
+
+			renderBatch(jobs, Math.max(1, concurrency), function(results) {
+				sendResponse(response, results.map(function(res) {
+					return encodeResult(res, 1);
+				}));
+			});
+		}
+		else
+		{
+			renderJob(parseJob(request.post, 1), function(res) {
+				sendResponse(response, encodeResult(res, 1));
+			});
 		}
 	}
 });
@@ -0,0 +1,227 @@
+##
+## Application Security Threat Attack Modeling (ASTAM)
+##
+## Copyright (C) 2017 Applied Visions - http://securedecisions.com
+##
+## Written by Aspect Security - http://aspectsecurity.com
+##
+## Licensed under the Apache License, Version 2.0 (the "License");
+## you may not use this file except in compliance with the License.
+## You may obtain a copy of the License at
+##
+##     http://www.apache.org/licenses/LICENSE-2.0
+##
+## Unless required by applicable law or agreed to in writing, software
+## distributed under the License is distributed on an "AS IS" BASIS,
+## WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+## See the License for the specific language governing permissions and
+## limitations under the License.
+##
+
+"""
+AsyncHttpClient.py
+"""
+
+import asyncio
+from urllib.parse import urlsplit
+
+import requests
+
+from .XssMapSettings import PHANTOM_POOL_MAXSIZE
+
+class AsyncHttpClient(object):
+    """
+    Small non-blocking HTTP/1.1 client on asyncio streams, enough for talking to the
+    rendering engines from a coroutine without tying up a thread. Keeps connections
+    alive for reuse, per host and per event loop. Fails with the same requests
+    exceptions as the blocking clients, so callers handle both alike.
+    """
+
+    def __init__(self, pool_maxsize=PHANTOM_POOL_MAXSIZE):
+        """
+        Args:
+            pool_maxsize (int) - max idle connections kept alive per host
+        """
+
+        self.pool_maxsize = pool_maxsize
+        self.idle = {}
+        self.loop = None
+
+    def close(self):
+        """
+        Close all idle connections.
+        """
+
+        # Connections of a loop that has since closed went with it
+        if self.loop is not None and not self.loop.is_closed():
+            for connections in self.idle.values():
+                for reader, writer in connections:
+                    writer.close()
+
+        self.idle = {}
+
+    def __idle_connections(self, host_key):
+        """
+        (Private) Idle connections to a host, on the running event loop. Connections
+        belong to the loop that opened them, so a new loop starts a fresh pool.
+
+        Args:
+            host_key (tuple)
+
+        Returns:
+            (list)
+        """
+
+        loop = asyncio.get_running_loop()
+        if loop is not self.loop:
+            self.idle = {}
+            self.loop = loop
+
+        return self.idle.setdefault(host_key, [])
+
+    async def __open(self, host_key, connect_timeout):
+        """
+        (Private) Open a new connection to a host.
+
+        Args:
+            host_key (tuple) - scheme, host and port
+            connect_timeout (float) - seconds, None to wait as long as it takes
+
+        Returns:
+            (tuple) - StreamReader and StreamWriter
+        """
+
+        scheme, host, port = host_key
+
+        try:
+            return await asyncio.wait_for(asyncio.open_connection(host, port, \
+                    ssl=(scheme == 'https')), connect_timeout)
+        except asyncio.TimeoutError:
+            raise requests.exceptions.ConnectTimeout('Timed out connecting to ' + host)
+        except OSError as e:
+            raise requests.exceptions.ConnectionError(str(e))
+
+    async def __read_response(self, reader):
+        """
+        (Private) Read one response off a connection.
+
+        Args:
+            reader (StreamReader)
+
+        Returns:
+            (tuple) - status (int), body (bytes) and whether the connection can be reused
+        """
+
+        status_line = await reader.readline()
+        if not status_line:
+            raise ConnectionResetError('Connection closed before a response came back')
+
+        status = int(status_line.split()[1])
+        keep_alive = not status_line.startswith(b'HTTP/1.0')
+
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        if headers.get('connection', '').lower() == 'close':
+            keep_alive = False
+
+        if headers.get('transfer-encoding', '').lower() == 'chunked':
+            chunks = []
+            while True:
+                size = int((await reader.readline()).split(b';')[0], 16)
+                if size == 0:
+                    # Trailers, if any, end with a blank line too
+                    while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                        pass
+                    break
+                chunks.append(await reader.readexactly(size))
+                await reader.readexactly(2)
+            body = b''.join(chunks)
+        elif 'content-length' in headers:
+            body = await reader.readexactly(int(headers['content-length']))
+        else:
+            # No length given, the body runs to the end of the connection
+            body = await reader.read()
+            keep_alive = False
+
+        return status, body, keep_alive
+
+    async def request(self, method, url, body=None, headers=None, timeout=None):
+        """
+        Make one request and wait for the whole response.
+
+        Args:
+            method (str)
+            url (str)
+            body (str or bytes)
+            headers (dict)
+            timeout (tuple or float) - connect and read timeouts in seconds, as requests
+                                       takes them, None to wait as long as it takes
+
+        Returns:
+            (tuple) - status (int) and body (bytes)
+        """
+
+        if isinstance(timeout, tuple):
+            connect_timeout, read_timeout = timeout
+        else:
+            connect_timeout, read_timeout = timeout, timeout
+
+        parts = urlsplit(url)
+        port = parts.port or (443 if parts.scheme == 'https' else 80)
+        host_key = (parts.scheme, parts.hostname, port)
+
+        path = parts.path or '/'
+        if parts.query:
+            path = path + '?' + parts.query
+
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+
+        lines = [method + ' ' + path + ' HTTP/1.1', 'Host: ' + parts.netloc]
+        for name, value in (headers or {}).items():
+            lines.append(name + ': ' + str(value))
+        lines.append('Content-Length: ' + str(len(body or b'')))
+        lines.append('Connection: keep-alive')
+        message = ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + (body or b'')
+
+        idle = self.__idle_connections(host_key)
+
+        while True:
+            reused = bool(idle)
+            if reused:
+                reader, writer = idle.pop()
+            else:
+                reader, writer = await self.__open(host_key, connect_timeout)
+
+            try:
+                writer.write(message)
+                await writer.drain()
+                status, response_body, keep_alive = await asyncio.wait_for( \
+                        self.__read_response(reader), read_timeout)
+                break
+            except asyncio.TimeoutError:
+                writer.close()
+                raise requests.exceptions.ReadTimeout('Timed out waiting on ' + url)
+            except asyncio.CancelledError:
+                # Abandoned mid-exchange, the connection cannot be reused
+                writer.close()
+                raise
+            except (OSError, asyncio.IncompleteReadError, ValueError, IndexError) as e:
+                writer.close()
+                # A kept-alive connection the server has since dropped, try a fresh one
+                if reused:
+                    continue
+                raise requests.exceptions.ConnectionError(str(e))
+
+        if keep_alive and len(idle) < self.pool_maxsize:
+            idle.append((reader, writer))
+        else:
+            writer.close()
+
+        return status, response_body
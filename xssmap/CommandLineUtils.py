@@ -30,6 +30,8 @@ and traditional argument parsing
 import json
 import time
 
+from .XssMapSettings import SCAN_SERVICE_PORT, SCAN_SERVICE_WORKERS
+
 def __print_command_line_usage():
     """
     (Private) Print XssMap.py command line usage
@@ -39,9 +41,35 @@ def __print_command_line_usage():
     print('   inputs "json_version" (float, currently 1.00 supported),')
     print('          "request_type" (str), request_url" (str),')
     print('          "request_type" (str), "do_reflect" (bool),')
-    print('          "do_xss" (bool),')
+    print('          "do_xss" (bool), "concurrency" (int), "batch" (bool),')
+    print('          "cache" (bool, or object with "memory_entries", "disk_dir",')
+    print('                   "disk_max_bytes", "max_age" (seconds)),')
+    print('          "stop_policy" (str, "none", "first_certain_per_param",')
+    print('                         "first_n_per_param", "first_per_target"),')
+    print('          "stop_after" (int, findings per param for "first_n_per_param"),')
+    print('          "renderer" (str, "phantom" or "static" for raw HTML without Javascript),')
+    print('          "render_addresses" (list of str, PhantomJS engines to render on, as')
+    print('                              printed by RenderFarm),')
+    print('          "prefilter" (bool, drop params not in the raw HTTP response first),')
+    print('          "resource_policy" (object with "block_images", "block_stylesheets",')
+    print('                             "block_fonts" (bool), "allowed_origins",')
+    print('                             "blocked_url_patterns" (list of str)),')
+    print('          "payloads" (str, JSONL payload corpus to use instead of the built-in')
+    print('                      payloads, see PayloadCorpus),')
+    print('          "expand_payloads" (bool, or list of encodings from "none", "url",')
+    print('                             "url_double", "html_entity", "case", "whitespace"),')
+    print('          "payload_stats" (bool, or object with "path", "ordering" ("thompson" or')
+    print('                           "success_rate"), "per_target" (bool), "top_k" (int)),')
+    print('          "char_probe" (bool, skip payloads needing characters the target filters),')
     print('          "headers" (list of objects with "name" and "value" fields),')
     print('          "cookies" (list of objects with "name" and "value" fields)')
+    print('OR stream many JSON inputs, one per line, results written one per line')
+    print(' python XssMap.py --bulk inputs.jsonl|- [outputs.jsonl|-]')
+    print('     "-" means stdin / stdout, output defaults to stdout')
+    print('OR run as a service taking the same JSON inputs over HTTP')
+    print(' python XssMap.py --serve [port] [workers]')
+    print('     POST /jobs queues an input, GET /jobs/<id> polls for its output')
+    print('     workers : number of jobs scanned at once')
     print('OR can use command line args for GET request targets only')
     print(' python XssMap.py url -x|r -c <cookies> -h <headers>')
     print('     url : target url, all arguments after this are optional...')
@@ -49,17 +77,32 @@ def __print_command_line_usage():
     print('     -b : put request body string after')
     print('     -x : only do xss scanning')
     print('     -r : only do reflection checking')
+    print('     -n : put number of attack renders to keep in flight after, default 1')
+    print('     --batch : send all attacks on a parameter to the renderer at once')
+    print('     --cache : serve repeated renders from an in-memory cache')
+    print('     --cache-dir : put directory after, also keep the render cache on disk there')
+    print('     --stop : put stop policy after, see "stop_policy" above')
+    print('     --stop-after : put findings per param after, for first_n_per_param')
+    print('     --renderer : put render backend after, "phantom" (default) or "static"')
+    print('     --render-addresses : put comma separated PhantomJS engine addresses after')
+    print('     --prefilter : drop params not in the raw HTTP response before rendering')
+    print('     --payloads : put JSONL payload corpus after, instead of built-in payloads')
+    print('     --expand : try every payload with each verify script in each encoding')
+    print('     --payload-stats : try payloads with the best success history first')
+    print('     --payload-stats-db : put database file after, keep payload history there')
+    print('     --char-probe : skip payloads needing characters the target filters')
     print('     -h : put headers after, like header1=value1 header2=value2')
     print('     -c : put cookies after, like cookie1=value1 cookie2=value2')
     exit()
 
-def __parse_json_input(json_version, arg_array):
+def parse_input_object(json_version, d):
     """
-    (Private) Parses XssMap.py input / startup params from a JSON file.
+    Parses XssMap.py input / startup params from an already loaded JSON object,
+    as described by json/xss-tool-input.schema.json.
 
     Args:
         json_version (float)
-        arg_array (list)
+        d (dict)
 
     Returns:
         request_type (str)
@@ -69,6 +112,7 @@ def __parse_json_input(json_version, arg_array):
         do_xss (bool)
         headers (list)
         cookies (list)
+        scan_options (dict)
     """
 
     request_type = 'GET'
@@ -78,48 +122,103 @@ def __parse_json_input(json_version, arg_array):
     do_xss = True
     headers = []
     cookies = []
+    scan_options = {}
 
-    with open(arg_array[1]) as json_data:
+    if 'json_version' in d:
+        if d['json_version'] != json_version:
+            raise RuntimeError('Supported JSON version is ' + str(json_version))
 
-        d = json.load(json_data)
+    if 'request_type' in d:
+        request_type = d['request_type']
+
+    # This is the one param we really require
+    if 'request_url' in d:
+        request_url = d['request_url']
+    else:
+        raise RuntimeError('Missing "request_url" param field in JSON config file.')
 
-        if 'json_version' in d:
-            if d['json_version'] != json_version:
-                raise RuntimeError('Supported JSON version is ' + str(json_version))
+    if 'request_body' in d:
+        request_body = d['request_body']
 
-        if 'request_type' in d:
-            request_type = d['request_type']
+    if 'do_reflect' in d:
+        do_reflect = d['do_reflect']
 
-        # This is the one param we really require
-        if 'request_url' in d:
-            request_url = d['request_url']
-        else:
-            raise RuntimeError('Missing "request_url" param field in JSON config file.')
+    if 'do_xss' in d:
+        do_xss = d['do_xss']
+
+    if 'headers' in d:
+        for header_dump in d['headers']:
+            header_name = header_dump['name']
+            header_val = header_dump['value']
+            header = header_name, header_val
+            headers.append(header)
+
+    if 'cookies' in d:
+        for cookie_dump in d['cookies']:
+            cookie_name = cookie_dump['name']
+            cookie_val = cookie_dump['value']
+            cookie = cookie_name, cookie_val
+            cookies.append(cookie)
+
+    if 'concurrency' in d:
+        scan_options['concurrency'] = int(d['concurrency'])
+
+    if 'batch' in d:
+        scan_options['batch'] = d['batch']
+
+    if 'cache' in d:
+        scan_options['cache'] = d['cache']
+
+    if 'stop_policy' in d:
+        scan_options['stop_policy'] = d['stop_policy']
+
+    if 'stop_after' in d:
+        scan_options['stop_after'] = int(d['stop_after'])
+
+    if 'renderer' in d:
+        scan_options['renderer'] = d['renderer']
 
-        if 'request_body' in d:
-            request_body = d['request_body']
+    if 'render_addresses' in d:
+        scan_options['render_addresses'] = list(d['render_addresses'])
 
-        if 'do_reflect' in d:
-            do_reflect = d['do_reflect']
+    if 'prefilter' in d:
+        scan_options['prefilter'] = d['prefilter']
 
-        if 'do_xss' in d:
-            do_xss = d['do_xss']
+    if 'resource_policy' in d:
+        scan_options['resource_policy'] = d['resource_policy']
 
-        if 'headers' in d:
-            for header_dump in d['headers']:
-                header_name = header_dump['name']
-                header_val = header_dump['value']
-                header = header_name, header_val
-                headers.append(header)
+    if 'payloads' in d:
+        scan_options['payloads'] = d['payloads']
+
+    if 'expand_payloads' in d:
+        scan_options['expand_payloads'] = d['expand_payloads']
+
+    if 'payload_stats' in d:
+        scan_options['payload_stats'] = d['payload_stats']
+
+    if 'char_probe' in d:
+        scan_options['char_probe'] = d['char_probe']
+
+    return request_type, request_url, request_body, do_reflect, do_xss, headers, cookies, \
+            scan_options
+
+def __parse_json_input(json_version, arg_array):
+    """
+    (Private) Parses XssMap.py input / startup params from a JSON file.
+
+    Args:
+        json_version (float)
+        arg_array (list)
+
+    Returns:
+        see parse_input_object
+    """
+
+    with open(arg_array[1]) as json_data:
 
-        if 'cookies' in d:
-            for cookie_dump in d['cookies']:
-                cookie_name = cookie_dump['name']
-                cookie_val = cookie_dump['value']
-                cookie = cookie_name, cookie_val
-                cookies.append(cookie)
+        d = json.load(json_data)
 
-    return request_type, request_url, request_body, do_reflect, do_xss, headers, cookies
+    return parse_input_object(json_version, d)
 
 def __parse_cli_input(arg_array):
     """
@@ -136,6 +235,7 @@ def __parse_cli_input(arg_array):
         do_xss (bool)
         headers (list)
         cookies (list)
+        scan_options (dict)
     """
 
     request_type = 'GET'
@@ -145,6 +245,7 @@ def __parse_cli_input(arg_array):
     do_xss = True
     cookies = []
     headers = []
+    scan_options = {}
 
     idx = 1
     while idx < len(arg_array):
@@ -161,6 +262,70 @@ def __parse_cli_input(arg_array):
         elif arg.lower() == '-x':
             do_reflect = False
             idx = idx + 1
+        elif arg.lower() == '-n':
+            if idx + 1 >= len(arg_array) or not arg_array[idx + 1].isdigit():
+                __print_command_line_usage()
+            scan_options['concurrency'] = int(arg_array[idx + 1])
+            idx = idx + 2
+        elif arg.lower() == '--batch':
+            scan_options['batch'] = True
+            idx = idx + 1
+        elif arg.lower() == '--prefilter':
+            scan_options['prefilter'] = True
+            idx = idx + 1
+        elif arg.lower() == '--cache':
+            if not isinstance(scan_options.get('cache'), dict):
+                scan_options['cache'] = {}
+            idx = idx + 1
+        elif arg.lower() == '--cache-dir':
+            if idx + 1 >= len(arg_array):
+                __print_command_line_usage()
+            if not isinstance(scan_options.get('cache'), dict):
+                scan_options['cache'] = {}
+            scan_options['cache']['disk_dir'] = arg_array[idx + 1]
+            idx = idx + 2
+        elif arg.lower() == '--stop':
+            if idx + 1 >= len(arg_array):
+                __print_command_line_usage()
+            scan_options['stop_policy'] = arg_array[idx + 1]
+            idx = idx + 2
+        elif arg.lower() == '--render-addresses':
+            if idx + 1 >= len(arg_array):
+                __print_command_line_usage()
+            scan_options['render_addresses'] = arg_array[idx + 1].split(',')
+            idx = idx + 2
+        elif arg.lower() == '--renderer':
+            if idx + 1 >= len(arg_array):
+                __print_command_line_usage()
+            scan_options['renderer'] = arg_array[idx + 1]
+            idx = idx + 2
+        elif arg.lower() == '--expand':
+            scan_options['expand_payloads'] = True
+            idx = idx + 1
+        elif arg.lower() == '--payloads':
+            if idx + 1 >= len(arg_array):
+                __print_command_line_usage()
+            scan_options['payloads'] = arg_array[idx + 1]
+            idx = idx + 2
+        elif arg.lower() == '--char-probe':
+            scan_options['char_probe'] = True
+            idx = idx + 1
+        elif arg.lower() == '--payload-stats':
+            if not isinstance(scan_options.get('payload_stats'), dict):
+                scan_options['payload_stats'] = {}
+            idx = idx + 1
+        elif arg.lower() == '--payload-stats-db':
+            if idx + 1 >= len(arg_array):
+                __print_command_line_usage()
+            if not isinstance(scan_options.get('payload_stats'), dict):
+                scan_options['payload_stats'] = {}
+            scan_options['payload_stats']['path'] = arg_array[idx + 1]
+            idx = idx + 2
+        elif arg.lower() == '--stop-after':
+            if idx + 1 >= len(arg_array) or not arg_array[idx + 1].isdigit():
+                __print_command_line_usage()
+            scan_options['stop_after'] = int(arg_array[idx + 1])
+            idx = idx + 2
         elif arg.lower() == '-c':
             idx = idx + 1
             while idx < len(arg_array) and '=' in arg_array[idx]:
@@ -176,7 +341,8 @@ def __parse_cli_input(arg_array):
         else:
             __print_command_line_usage()
 
-    return request_type, request_url, request_body, do_reflect, do_xss, headers, cookies
+    return request_type, request_url, request_body, do_reflect, do_xss, headers, cookies, \
+            scan_options
 
 def handle_input(json_version, arg_array):
     """
@@ -195,6 +361,7 @@ def handle_input(json_version, arg_array):
         do_xss (bool)
         headers (list)
         cookies (list)
+        scan_options (dict)
         output_filename (str)
     """
 
@@ -227,3 +394,54 @@ def handle_input(json_version, arg_array):
     else:
         # something went awry, print usage
         __print_command_line_usage()
+
+def handle_bulk_input(arg_array):
+    """
+    Interprets command line input for bulk mode - XssMap.py --bulk inputs [outputs].
+
+    Args:
+        arg_array (list)
+
+    Returns:
+        input_name (str) - JSONL input file, '-' for stdin
+        output_name (str) - JSONL output file, '-' for stdout
+    """
+
+    if len(arg_array) < 3 or len(arg_array) > 4:
+        __print_command_line_usage()
+
+    input_name = arg_array[2]
+    output_name = '-'
+
+    if len(arg_array) == 4:
+        output_name = arg_array[3]
+
+    return input_name, output_name
+
+def handle_serve_input(arg_array):
+    """
+    Interprets command line input for service mode - XssMap.py --serve [port] [workers].
+
+    Args:
+        arg_array (list)
+
+    Returns:
+        port (int)
+        workers (int)
+    """
+
+    if len(arg_array) > 4:
+        __print_command_line_usage()
+
+    port = SCAN_SERVICE_PORT
+    workers = SCAN_SERVICE_WORKERS
+
+    try:
+        if len(arg_array) > 2:
+            port = int(arg_array[2])
+        if len(arg_array) > 3:
+            workers = int(arg_array[3])
+    except ValueError:
+        __print_command_line_usage()
+
+    return port, workers
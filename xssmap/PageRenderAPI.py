@@ -22,94 +22,567 @@
 PageRenderAPI.py
 """
 
+import asyncio
 import base64
 import json
+import math
 import socket
+import threading
+import time
+from urllib.parse import urlencode
 
 import requests
-
-from .XssMapSettings import PHANTOM_ADDRESS
-
-class PageRenderAPI(object):
+from requests.adapters import HTTPAdapter
+
+from .AsyncHttpClient import AsyncHttpClient
+from .RenderBackend import RenderBackend
+from .StaticRenderBackend import StaticRenderBackend
+from .XssMapSettings import PHANTOM_ADDRESSES, PHANTOM_CONNECT_TIMEOUT, \
+        PHANTOM_NEGOTIATION_TIMEOUT, PHANTOM_POOL_CONNECTIONS, PHANTOM_POOL_MAXSIZE, \
+        PHANTOM_PROTOCOL_VERSION, PHANTOM_RESPONSE_MARGIN, PHANTOM_RETRIES, \
+        PHANTOM_RETRY_BACKOFF, RENDER_DEADLINE_MS, RENDER_SETTLE_MS
+
+# Wire protocol versions PhantomRenderClient speaks, see renderers/phantom-render.js
+#   1 - form fields and response fields each base64 encoded
+#   2 - one JSON object each way with plain strings
+RENDER_PROTOCOL_VERSIONS = [1, 2]
+
+class PhantomRenderClient(RenderBackend):
     """
-    Handles requests to XssMap's various Javascript engines,
-    returning rendered page data for analysis.
+    Long-lived client for the PhantomJS rendering engine. Holds a pooled, keep-alive
+    HTTP session so consecutive renders reuse connections instead of opening a new
+    one each time. When given several engine addresses (see RenderFarm), each render
+    is routed to the worker with the fewest renders in flight. The wire protocol
+    version is negotiated with each engine on first use, falling back to version 1
+    for engines that do not answer. Every render carries a deadline the engine
+    enforces, the client waits only a margin beyond it, and renders failing to connect
+    or answer in time are retried. The async render methods do the same over a
+    non-blocking connection pool, so an event loop can drive many renders at once.
     """
 
-    @staticmethod
-    def ensure_local_service_is_up(name, address):
+    def __init__(self, addresses=PHANTOM_ADDRESSES, pool_connections=PHANTOM_POOL_CONNECTIONS,
+                 pool_maxsize=PHANTOM_POOL_MAXSIZE, protocol_version=PHANTOM_PROTOCOL_VERSION,
+                 deadline_ms=RENDER_DEADLINE_MS, settle_ms=RENDER_SETTLE_MS,
+                 retries=PHANTOM_RETRIES):
         """
-        Checks if a local rendering service is up, error out if not.
+        Args:
+            addresses (list) - where the rendering engines listen, a single str is fine
+            pool_connections (int) - number of per-host connection pools to cache
+            pool_maxsize (int) - max connections kept alive per pool
+            protocol_version (int) - wire protocol to use, None to negotiate
+            deadline_ms (int) - per-render deadline, 0 for none
+            settle_ms (int) - network idle time after load before a page is done
+            retries (int) - extra tries for a render that failed to connect or answer
+        """
+
+        if protocol_version is not None and protocol_version not in RENDER_PROTOCOL_VERSIONS:
+            raise RuntimeError('Unsupported render protocol version: ' + str(protocol_version))
+
+        if isinstance(addresses, str):
+            addresses = [addresses]
+        if not addresses:
+            raise RuntimeError('PhantomRenderClient needs at least one engine address.')
+
+        self.addresses = list(addresses)
+        self.in_flight = dict((address, 0) for address in self.addresses)
+        self.session = requests.Session()
+
+        # Every worker is its own host:port, so needs its own pool
+        pool_connections = max(pool_connections, len(self.addresses))
+        adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        self.async_http = AsyncHttpClient(pool_maxsize)
+
+        self.deadline_ms = deadline_ms
+        self.settle_ms = settle_ms
+        self.retries = retries
+
+        self.services_checked = set()
+        self.protocol_version = protocol_version
+        self.protocol_versions = {}
+        self.lock = threading.Lock()
+
+    def render_identity(self):
+        """
+        See RenderBackend.render_identity - the engines, and the deadline and settle
+        window that decide how much of a page renders.
+        """
+
+        identity = RenderBackend.render_identity(self)
+        identity['addresses'] = sorted(self.addresses)
+        identity['deadline_ms'] = self.deadline_ms
+        identity['settle_ms'] = self.settle_ms
+
+        return identity
+
+    def close(self):
+        """
+        Close all pooled connections.
+        """
+
+        self.session.close()
+        self.async_http.close()
+
+    def __ensure_service_is_up(self, address):
+        """
+        (Private) Check a local rendering engine is listening, once per address.
 
         Args:
-            name (str) - name of service
-            address (str) - where to check for service
+            address (str)
         """
 
-        service_port = int(''.join(c for c in address.split(':')[-1] if c.isdigit()))
-        service_up = False
+        if address in self.services_checked:
+            return
 
-        test_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        if '127.0.0.1' in address or 'localhost' in address:
+            PageRenderAPI.ensure_local_service_is_up('PhantomJS rendering engine', address)
+
+        with self.lock:
+            self.services_checked.add(address)
+
+    def __negotiate_protocol_version(self, address):
+        """
+        (Private) Highest wire protocol version both sides speak, asked of the engine
+        once per address. Only an answer is remembered: if the engine cannot be reached
+        or does not answer in time, version 1 is used and it is asked again on the next
+        request.
+
+        Args:
+            address (str)
+
+        Returns:
+            (int)
+        """
+
+        if self.protocol_version is not None:
+            return self.protocol_version
+
+        with self.lock:
+            if address in self.protocol_versions:
+                return self.protocol_versions[address]
 
         try:
-            test_socket.bind(('127.0.0.1', service_port))
-            test_socket.close()
-        except socket.error:
-            # Could not bind to port, assume service is up there
-            service_up = True
+            response = self.session.get(address, timeout=PHANTOM_NEGOTIATION_TIMEOUT)
+        except requests.exceptions.RequestException:
+            # No answer to settle on, version 1 for now and ask again next time
+            return 1
 
-        if not service_up:
-            msg = name + ' does not seem to be running at ' + address
-            raise RuntimeError(msg)
+        answer = None
+        try:
+            answer = response.json()
+        except ValueError:
+            pass
 
-    @staticmethod
-    def render_page_with_phantom(method, url, body, headers, cookies, pageEvents=False):
+        return self.__record_protocol_version(address, answer)
+
+    async def __negotiate_protocol_version_async(self, address):
         """
-        Send request parameters to PhantomJS engine and get rendered page output.
+        (Private) Same as __negotiate_protocol_version, without blocking the event loop.
+
+        Args:
+            address (str)
+
+        Returns:
+            (int)
+        """
+
+        if self.protocol_version is not None:
+            return self.protocol_version
+
+        with self.lock:
+            if address in self.protocol_versions:
+                return self.protocol_versions[address]
+
+        try:
+            status, content = await self.async_http.request('GET', address, \
+                    timeout=PHANTOM_NEGOTIATION_TIMEOUT)
+        except requests.exceptions.RequestException:
+            return 1
+
+        answer = None
+        try:
+            answer = json.loads(content.decode('utf-8'))
+        except ValueError:
+            pass
+
+        return self.__record_protocol_version(address, answer)
+
+    def __record_protocol_version(self, address, answer):
+        """
+        (Private) Settle on the wire protocol version for an engine from its answer to
+        the negotiation request, version 1 if it gave none that makes sense.
+
+        Args:
+            address (str)
+            answer (obj) - decoded JSON, None if there was no answer
+
+        Returns:
+            (int)
+        """
+
+        version = 1
+        try:
+            common = set(answer['protocols']) & set(RENDER_PROTOCOL_VERSIONS)
+            if common:
+                version = max(common)
+        except (KeyError, TypeError):
+            pass
+
+        with self.lock:
+            self.protocol_versions[address] = version
+
+        return version
+
+    def __acquire_address(self):
+        """
+        (Private) Pick the engine with the fewest renders in flight and count one more
+        against it. Ties go to the earliest address.
+
+        Returns:
+            (str)
+        """
+
+        with self.lock:
+            address = min(self.addresses, key=lambda a: self.in_flight[a])
+            self.in_flight[address] += 1
+
+        return address
+
+    def __release_address(self, address):
+        """
+        (Private) Count a render against the given engine as finished.
+
+        Args:
+            address (str)
+        """
+
+        with self.lock:
+            self.in_flight[address] -= 1
+
+    def __response_timeout(self, job_count, concurrency):
+        """
+        (Private) Connect and read timeouts for a request carrying job_count renders,
+        enough for the engine to run them all to their deadline. None when renders have
+        no deadline.
+
+        Args:
+            job_count (int)
+            concurrency (int) - pages the engine renders at once, None for its default
+
+        Returns:
+            (tuple)
+        """
+
+        if not self.deadline_ms:
+            return None
+
+        # Unknown engine concurrency counts as one page at a time
+        rounds = math.ceil(job_count / float(max(1, concurrency or 1)))
+        read_timeout = rounds * (self.deadline_ms + self.settle_ms) / 1000.0
+        read_timeout = read_timeout + PHANTOM_RESPONSE_MARGIN
+
+        return (PHANTOM_CONNECT_TIMEOUT, read_timeout)
+
+    def __render_jobs(self, jobs, concurrency, batch):
+        """
+        (Private) Render jobs on the least busy rendering engine, retrying on another
+        pick if it cannot be reached or does not answer in time.
+
+        Args:
+            jobs (list) - dicts as for render_batch
+            concurrency (int) - pages the engine renders at once, None for its default
+            batch (bool) - under version 1, send as a batch rather than a single job
+
+        Returns:
+            (list) - one rendered page output per job, in job order
+        """
+
+        attempt = 0
+
+        while True:
+            address = self.__acquire_address()
+
+            try:
+                self.__ensure_service_is_up(address)
+                results = self.__post_jobs(address, jobs, concurrency, batch)
+                break
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                if attempt >= self.retries:
+                    raise
+            finally:
+                self.__release_address(address)
+
+            time.sleep(PHANTOM_RETRY_BACKOFF * (2 ** attempt))
+            attempt += 1
+
+        # Version 1 engines send everything, version 2 ones only what was asked for
+        return [self.select_outputs(output, job.get('outputs')) \
+                for job, output in zip(jobs, results)]
+
+    async def __render_jobs_async(self, jobs, concurrency, batch):
+        """
+        (Private) Same as __render_jobs, without blocking the event loop.
+
+        Args:
+            jobs (list)
+            concurrency (int)
+            batch (bool)
+
+        Returns:
+            (list)
+        """
+
+        attempt = 0
+
+        while True:
+            address = self.__acquire_address()
+
+            try:
+                self.__ensure_service_is_up(address)
+                results = await self.__post_jobs_async(address, jobs, concurrency, batch)
+                break
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                if attempt >= self.retries:
+                    raise
+            finally:
+                self.__release_address(address)
+
+            await asyncio.sleep(PHANTOM_RETRY_BACKOFF * (2 ** attempt))
+            attempt += 1
+
+        return [self.select_outputs(output, job.get('outputs')) \
+                for job, output in zip(jobs, results)]
+
+    def __post_jobs(self, address, jobs, concurrency, batch):
+        """
+        (Private) Render jobs on the given engine, in whichever wire protocol it speaks.
+
+        Args:
+            address (str)
+            jobs (list)
+            concurrency (int)
+            batch (bool)
+
+        Returns:
+            (list) - one decoded render result per job, in job order
+        """
+
+        version = self.__negotiate_protocol_version(address)
+        data, headers, decode = self.__encode_jobs(version, jobs, concurrency, batch)
+
+        r = self.session.post(address, data=data, headers=headers, \
+                timeout=self.__response_timeout(len(jobs), concurrency))
+        r.raise_for_status()
+
+        return decode(r.json())
+
+    async def __post_jobs_async(self, address, jobs, concurrency, batch):
+        """
+        (Private) Same as __post_jobs, without blocking the event loop.
+
+        Args:
+            address (str)
+            jobs (list)
+            concurrency (int)
+            batch (bool)
+
+        Returns:
+            (list)
+        """
+
+        version = await self.__negotiate_protocol_version_async(address)
+        data, headers, decode = self.__encode_jobs(version, jobs, concurrency, batch)
+
+        status, content = await self.async_http.request('POST', address, data, headers, \
+                self.__response_timeout(len(jobs), concurrency))
+
+        if status < 200 or status >= 300:
+            raise requests.exceptions.HTTPError('Rendering engine at ' + address + \
+                    ' answered with HTTP status ' + str(status))
+
+        return decode(json.loads(content.decode('utf-8')))
+
+    def __encode_jobs(self, version, jobs, concurrency, batch):
+        """
+        (Private) The request carrying jobs in the given wire protocol version, and how
+        to turn the engine's decoded JSON answer into render results.
+
+        Args:
+            version (int)
+            jobs (list)
+            concurrency (int)
+            batch (bool)
+
+        Returns:
+            (tuple) - body (str), headers (dict) and decode (function)
+        """
+
+        if version >= 2:
+            message = {}
+            message['version'] = 2
+            message['jobs'] = [self.__prepare_job(job) for job in jobs]
+            if concurrency is not None:
+                message['concurrency'] = concurrency
+
+            # ensure_ascii keeps the body plain ASCII, whatever the engine decodes with
+            return json.dumps(message), {'Content-Type': 'application/json'}, \
+                    lambda answer: [self.__decode_result(res) for res in answer['results']]
+
+        form_headers = {'Content-Type': 'application/x-www-form-urlencoded'}
+
+        if batch:
+            inputs = {}
+            inputs['jobs'] = json.dumps([self.__prepare_inputs(job) for job in jobs])
+            inputs['jobs'] = base64.b64encode(bytes(inputs['jobs'], 'utf-8')).decode('utf-8')
+            if concurrency is not None:
+                inputs['concurrency'] = concurrency
+            return urlencode(inputs), form_headers, \
+                    lambda answer: [self.__decode_output(res) for res in answer]
+
+        return urlencode(self.__prepare_inputs(jobs[0])), form_headers, \
+                lambda answer: [self.__decode_output(answer)]
+
+    def __prepare_job(self, job):
+        """
+        (Private) One render job as protocol version 2 sends it.
+
+        Args:
+            job (dict)
+
+        Returns:
+            (dict)
+        """
+
+        prepared = {}
+
+        prepared['method'] = job['method']
+        prepared['url'] = job['url']
+
+        if job.get('body'):
+            prepared['body'] = job['body']
+
+        headers = job.get('headers')
+        if headers or job['method'] == 'POST':
+            prepared['headers'] = dict(headers) if headers else {}
+            if job['method'] == 'POST':
+                prepared['headers']['Content-Type'] = 'application/x-www-form-urlencoded'
+
+        if job.get('cookies'):
+            prepared['cookies'] = job['cookies']
+
+        prepared['provokePageEvents'] = True
+
+        if job.get('outputs') is not None:
+            prepared['outputs'] = list(job['outputs'])
+
+        if job.get('resourcePolicy') is not None:
+            prepared['resourcePolicy'] = job['resourcePolicy']
+
+        prepared['deadlineMs'] = self.deadline_ms
+        prepared['settleMs'] = self.settle_ms
+
+        return prepared
+
+    def __decode_result(self, res):
+        """
+        (Private) One protocol version 2 render result as a rendered page output.
+
+        Args:
+            res (obj)
 
         Returns:
             (obj)
+        """
+
+        if 'error' in res:
+            raise RuntimeError('Render job failed: ' + str(res['error']))
+
+        fields = [
+            ('html', 'page_html'),
+            ('errors', 'page_errors'),
+            ('consoleMessages', 'page_console_messages'),
+            ('alerts', 'page_alerts'),
+            ('confirms', 'page_confirms'),
+            ('prompts', 'page_prompts'),
+            ('timedOut', 'page_timed_out')
+            ]
+
+        # Only the outputs the job asked for are there
+        output = {}
+        for field, key in fields:
+            if field in res:
+                output[key] = res[field]
+
+        return output
+
+    def __prepare_inputs(self, job):
+        """
+        (Private) Encode one render job as the form fields protocol version 1 expects.
+
+        Args:
+            job (dict)
 
-            {
-                'page_html' : string of page's rendered html
-                'page_errors' : list of strings of javascript error()
-                'page_console_message' : list of strings of javascript console.log()
-                'page_confirms' : list of strings of javascript confirm()
-                'page_prompts' : list of strings of javascript prompt()
-            }
+        Returns:
+            (dict)
         """
 
+        method = job['method']
+        url = job['url']
+        body = job.get('body')
+        headers = job.get('headers')
+        cookies = job.get('cookies')
+
         u = 'utf-8'
 
         inputs = {}
 
         inputs['method'] = method
-        inputs['url'] = base64.b64encode(bytes(url, u))
+        inputs['url'] = base64.b64encode(bytes(url, u)).decode(u)
 
         if body and body != '':
-            inputs['body'] = base64.b64encode(bytes(body, u))
+            inputs['body'] = base64.b64encode(bytes(body, u)).decode(u)
 
         if headers or method == 'POST':
             if not headers:
                 inputs['headers'] = {}
             else:
-                inputs['headers'] = headers
+                inputs['headers'] = dict(headers)
             if method == 'POST':
                 inputs['headers']['Content-Type'] = 'application/x-www-form-urlencoded'
-            inputs['headers'] = base64.b64encode(bytes(json.dumps(inputs['headers']), u))
+            inputs['headers'] = base64.b64encode(bytes(json.dumps(inputs['headers']), u)).decode(u)
 
         if cookies:
-            inputs['cookies'] = base64.b64encode(bytes(json.dumps(cookies), u))
+            inputs['cookies'] = base64.b64encode(bytes(json.dumps(cookies), u)).decode(u)
 
         inputs['provokePageEvents'] = True
 
-        if '127.0.0.1' in PHANTOM_ADDRESS or 'localhost' in PHANTOM_ADDRESS:
-            PageRenderAPI.ensure_local_service_is_up('PhantomJS rendering engine', PHANTOM_ADDRESS)
+        if job.get('resourcePolicy') is not None:
+            resource_policy = json.dumps(job['resourcePolicy'])
+            inputs['resourcePolicy'] = base64.b64encode(bytes(resource_policy, u)).decode(u)
 
-        r = requests.post(PHANTOM_ADDRESS, data=inputs)
-        r.connection.close()
+        inputs['deadlineMs'] = self.deadline_ms
+        inputs['settleMs'] = self.settle_ms
 
-        rendered_page_output = r.json()
+        return inputs
+
+    def __decode_output(self, rendered_page_output):
+        """
+        (Private) Decode the protocol version 1 response for one job.
+
+        Args:
+            rendered_page_output (obj)
+
+        Returns:
+            (obj)
+        """
+
+        u = 'utf-8'
+
+        if 'error' in rendered_page_output:
+            error = base64.b64decode(rendered_page_output['error']).decode(u)
+            raise RuntimeError('Render job failed: ' + error)
 
         output = {}
 
@@ -136,4 +609,160 @@ class PageRenderAPI(object):
         page_prompts = json.loads(page_prompts)
         output['page_prompts'] = page_prompts
 
+        # Engines from before render deadlines do not say
+        output['page_timed_out'] = rendered_page_output.get('timedOut', False)
+
         return output
+
+    def render_page(self, method, url, body, headers, cookies, pageEvents=False, outputs=None,
+                    resourcePolicy=None):
+        """
+        Send request parameters to PhantomJS engine and get rendered page output.
+        See RenderBackend.render_page.
+        """
+
+        job = {}
+        job['method'] = method
+        job['url'] = url
+        job['body'] = body
+        job['headers'] = headers
+        job['cookies'] = cookies
+        job['pageEvents'] = pageEvents
+        job['outputs'] = outputs
+        job['resourcePolicy'] = resourcePolicy
+
+        return self.__render_jobs([job], None, False)[0]
+
+    def render_batch(self, jobs, concurrency=None):
+        """
+        Send several render jobs to one PhantomJS engine in a single request. The engine
+        renders up to concurrency of them at once.
+
+        Args:
+            jobs (list) - dicts with 'method', 'url', 'body', 'headers', 'cookies' and
+                          optionally 'pageEvents', 'outputs' and 'resourcePolicy', same
+                          as render_page arguments
+            concurrency (int) - pages the engine renders at once, None for its default
+
+        Returns:
+            (list) - one render_page style output per job, in job order
+        """
+
+        if not jobs:
+            return []
+
+        return self.__render_jobs(jobs, concurrency, True)
+
+    async def render_page_async(self, method, url, body, headers, cookies, pageEvents=False,
+                                outputs=None, resourcePolicy=None):
+        """
+        Same as render_page, over the non-blocking connection pool.
+        """
+
+        job = {}
+        job['method'] = method
+        job['url'] = url
+        job['body'] = body
+        job['headers'] = headers
+        job['cookies'] = cookies
+        job['pageEvents'] = pageEvents
+        job['outputs'] = outputs
+        job['resourcePolicy'] = resourcePolicy
+
+        return (await self.__render_jobs_async([job], None, False))[0]
+
+    async def render_batch_async(self, jobs, concurrency=None):
+        """
+        Same as render_batch, over the non-blocking connection pool.
+        """
+
+        if not jobs:
+            return []
+
+        return await self.__render_jobs_async(jobs, concurrency, True)
+
+class PageRenderAPI(object):
+    """
+    Handles requests to XssMap's various Javascript engines,
+    returning rendered page data for analysis.
+    """
+
+    @staticmethod
+    def ensure_local_service_is_up(name, address):
+        """
+        Checks if a local rendering service is up, error out if not.
+
+        Args:
+            name (str) - name of service
+            address (str) - where to check for service
+        """
+
+        service_port = int(''.join(c for c in address.split(':')[-1] if c.isdigit()))
+        service_up = False
+
+        test_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+
+        try:
+            test_socket.bind(('127.0.0.1', service_port))
+            test_socket.close()
+        except socket.error:
+            # Could not bind to port, assume service is up there
+            service_up = True
+
+        if not service_up:
+            msg = name + ' does not seem to be running at ' + address
+            raise RuntimeError(msg)
+
+    backends = {
+        'phantom' : PhantomRenderClient,
+        'static' : StaticRenderBackend
+        }
+
+    shared_clients = {}
+
+    @staticmethod
+    def get_shared_client(backend='phantom', addresses=None):
+        """
+        Returns the process-wide render backend of the given kind, creating it on
+        first use. For phantom, engine addresses (as from RenderFarm) get a client of
+        their own, otherwise PHANTOM_ADDRESSES are used.
+
+        Args:
+            backend (str) - a name in PageRenderAPI.backends
+            addresses (list) - rendering engines, phantom only
+
+        Returns:
+            (RenderBackend)
+        """
+
+        if backend not in PageRenderAPI.backends:
+            raise RuntimeError('Unrecognized render backend: ' + str(backend))
+
+        if not addresses:
+            key = backend
+        elif backend == 'phantom':
+            key = backend + ' ' + ' '.join(addresses)
+        else:
+            raise RuntimeError('Render addresses only apply to the phantom backend.')
+
+        if key not in PageRenderAPI.shared_clients:
+            if addresses:
+                PageRenderAPI.shared_clients[key] = PhantomRenderClient(addresses)
+            else:
+                PageRenderAPI.shared_clients[key] = PageRenderAPI.backends[backend]()
+
+        return PageRenderAPI.shared_clients[key]
+
+    @staticmethod
+    def render_page_with_phantom(method, url, body, headers, cookies, pageEvents=False,
+                                 outputs=None, resourcePolicy=None):
+        """
+        Send request parameters to PhantomJS engine and get rendered page output,
+        through the shared PhantomRenderClient.
+
+        Returns:
+            (obj) - see PhantomRenderClient.render_page
+        """
+
+        return PageRenderAPI.get_shared_client().render_page(method, url, body, headers, \
+                cookies, pageEvents, outputs, resourcePolicy)
@@ -0,0 +1,251 @@
+##
+## Application Security Threat Attack Modeling (ASTAM)
+##
+## Copyright (C) 2017 Applied Visions - http://securedecisions.com
+##
+## Written by Aspect Security - http://aspectsecurity.com
+##
+## Licensed under the Apache License, Version 2.0 (the "License");
+## you may not use this file except in compliance with the License.
+## You may obtain a copy of the License at
+##
+##     http://www.apache.org/licenses/LICENSE-2.0
+##
+## Unless required by applicable law or agreed to in writing, software
+## distributed under the License is distributed on an "AS IS" BASIS,
+## WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+## See the License for the specific language governing permissions and
+## limitations under the License.
+##
+
+"""
+PayloadCorpus.py
+"""
+
+from array import array
+import json
+import mmap
+import os
+import threading
+
+from .PayloadRegistry import GENERAL_CONTEXT
+from .XssMapPayloads import JAVASCRIPT_PLACEHOLDER, TRIGGER_VALUE_PLACEHOLDER, VERIFY_SCRIPTS
+
+# Bump when the layout of the index file changes
+PAYLOAD_INDEX_VERSION = 1
+
+class PayloadCorpus(object):
+    """
+    Payload corpus kept in an external JSONL file, one payload per line with 'contexts'
+    and 'string' (and optionally 'id', else its line's offset), written like the ones
+    in XssMapPayloads. The file is memory-mapped and payloads are read as planning
+    reaches them, never all loaded, so processes using the same corpus share it
+    through the page cache. An index of line offsets by context, kept next to the
+    file as <file>.idx and rebuilt when the file changes, lets planning read only
+    the payloads for the contexts a parameter reflects in. Usable anywhere a
+    PayloadRegistry is.
+    """
+
+    shared_corpora = {}
+    shared_lock = threading.Lock()
+
+    def __init__(self, path, write_index=True):
+        """
+        Args:
+            path (str) - JSONL corpus file
+            write_index (bool) - save a freshly built index next to the file
+        """
+
+        self.path = path
+        self.file = open(path, 'rb')
+
+        self.map = None
+        if os.fstat(self.file.fileno()).st_size > 0:
+            self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        self.offsets = array('q')
+        self.offsets_by_context = {}
+        self.__load_index(write_index)
+
+    @staticmethod
+    def get_shared(path):
+        """
+        The process-wide corpus for a file, opened on first use.
+
+        Args:
+            path (str)
+
+        Returns:
+            (PayloadCorpus)
+        """
+
+        path = os.path.abspath(path)
+
+        with PayloadCorpus.shared_lock:
+            if path not in PayloadCorpus.shared_corpora:
+                PayloadCorpus.shared_corpora[path] = PayloadCorpus(path)
+
+            return PayloadCorpus.shared_corpora[path]
+
+    def close(self):
+        """
+        Unmap and close the corpus file.
+        """
+
+        if self.map is not None:
+            self.map.close()
+        self.file.close()
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __index_path(self):
+        """
+        (Private) Where the index of this corpus is kept.
+
+        Returns:
+            (str)
+        """
+
+        return self.path + '.idx'
+
+    def __source_stamp(self):
+        """
+        (Private) Size and modification time of the corpus file, to tell whether an
+        index still matches it.
+
+        Returns:
+            (list)
+        """
+
+        stat = os.fstat(self.file.fileno())
+
+        return [stat.st_size, stat.st_mtime]
+
+    def __load_index(self, write_index):
+        """
+        (Private) Read the saved index if it matches the corpus file, otherwise build it
+        and, if asked, save it.
+
+        Args:
+            write_index (bool)
+        """
+
+        try:
+            with open(self.__index_path()) as index_file:
+                index = json.load(index_file)
+            if index['version'] == PAYLOAD_INDEX_VERSION and \
+                    index['source'] == self.__source_stamp():
+                self.offsets = array('q', index['offsets'])
+                for context, offsets in index['contexts'].items():
+                    self.offsets_by_context[context] = array('q', offsets)
+                return
+        except (IOError, ValueError, KeyError, TypeError):
+            pass
+
+        self.__build_index()
+
+        if write_index:
+            index = {}
+            index['version'] = PAYLOAD_INDEX_VERSION
+            index['source'] = self.__source_stamp()
+            index['offsets'] = self.offsets.tolist()
+            index['contexts'] = dict((context, offsets.tolist()) \
+                    for context, offsets in self.offsets_by_context.items())
+            try:
+                with open(self.__index_path(), 'w') as index_file:
+                    json.dump(index, index_file)
+            except IOError:
+                # A read-only corpus directory just means indexing again next time
+                pass
+
+    def __build_index(self):
+        """
+        (Private) Index the corpus in one pass over the file, a line at a time.
+        """
+
+        self.file.seek(0)
+        offset = 0
+
+        for line_number, line in enumerate(self.file, 1):
+            if line.strip():
+                try:
+                    payload = json.loads(line.decode('utf-8'))
+                    valid = isinstance(payload['contexts'], list) and \
+                            isinstance(payload['string'], str)
+                except (ValueError, KeyError, TypeError):
+                    valid = False
+
+                if not valid:
+                    raise RuntimeError('Bad payload on line ' + str(line_number) + ' of ' + \
+                            self.path)
+
+                self.offsets.append(offset)
+                for context in payload['contexts']:
+                    self.offsets_by_context.setdefault(context, array('q')).append(offset)
+
+            offset += len(line)
+
+    def __read(self, offset):
+        """
+        (Private) The payload on the line starting at offset.
+
+        Args:
+            offset (int)
+
+        Returns:
+            (dict)
+        """
+
+        end = self.map.find(b'\n', offset)
+        if end < 0:
+            end = len(self.map)
+
+        payload = json.loads(self.map[offset:end].decode('utf-8'))
+        if 'id' not in payload:
+            payload['id'] = offset
+
+        # Same as the built-in payloads
+        payload['template'] = payload['string']
+        payload['string'] = payload['string'].replace(JAVASCRIPT_PLACEHOLDER, VERIFY_SCRIPTS[0])
+
+        return payload
+
+    def payloads_for(self, contexts):
+        """
+        Payloads applying to any of the given contexts, each once, in the order
+        PayloadRegistry.payloads_for gives them.
+
+        Args:
+            contexts (list)
+
+        Yields:
+            (dict)
+        """
+
+        seen = set()
+
+        for context in contexts:
+            if context == GENERAL_CONTEXT:
+                offsets = self.offsets
+            else:
+                offsets = self.offsets_by_context.get(context, ())
+
+            for offset in offsets:
+                if offset not in seen:
+                    seen.add(offset)
+                    yield self.__read(offset)
+
+    def make_attack(self, payload, trigger):
+        """
+        A payload's attack string with the given trigger in place.
+
+        Args:
+            payload (dict)
+            trigger (str)
+
+        Returns:
+            (str)
+        """
+
+        return payload['string'].replace(TRIGGER_VALUE_PLACEHOLDER, trigger)
@@ -0,0 +1,207 @@
+##
+## Application Security Threat Attack Modeling (ASTAM)
+##
+## Copyright (C) 2017 Applied Visions - http://securedecisions.com
+##
+## Written by Aspect Security - http://aspectsecurity.com
+##
+## Licensed under the Apache License, Version 2.0 (the "License");
+## you may not use this file except in compliance with the License.
+## You may obtain a copy of the License at
+##
+##     http://www.apache.org/licenses/LICENSE-2.0
+##
+## Unless required by applicable law or agreed to in writing, software
+## distributed under the License is distributed on an "AS IS" BASIS,
+## WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+## See the License for the specific language governing permissions and
+## limitations under the License.
+##
+
+"""
+PayloadExpander.py
+"""
+
+import hashlib
+import re
+from urllib.parse import quote, unquote_plus
+
+from .PayloadCorpus import PayloadCorpus
+from .PayloadRegistry import PayloadRegistry
+from .XssMapPayloads import JAVASCRIPT_PLACEHOLDER, TRIGGER_VALUE_PLACEHOLDER, VERIFY_SCRIPTS
+from .XssMapSettings import PAYLOAD_EXPANSION_ENCODINGS
+
+# Ways to encode a payload
+#   none - as written
+#   url - percent-encoded. Parameter values are decoded once before sending, so this
+#         only differs from 'none' for payloads holding a raw '+' or '%'
+#   url_double - percent-encoded twice, for applications decoding input again
+#   html_entity - markup characters as numeric entities, for attributes the browser
+#                 decodes before running them as script. The entities are themselves
+#                 percent-encoded, "&", "#" and ";" would not survive the query string
+#   case - alternating case in the markup around the script
+#   whitespace - "/" for spaces between tag name and attributes
+PAYLOAD_ENCODINGS = ['none', 'url', 'url_double', 'html_entity', 'case', 'whitespace']
+
+HTML_ENTITY_CHARS = '<>"\'&'
+
+# A space with markup on both sides, as between a tag name and an attribute
+INNER_SPACE_PATTERN = re.compile(r'(?<=\S) (?=\S)')
+
+def make_payload_source(payloads=None, expand_payloads=False):
+    """
+    What to plan attacks from, given a target's payload options.
+
+    Args:
+        payloads (PayloadRegistry, PayloadCorpus or str) - None for the built-in ones,
+                                                           a str is a corpus file
+        expand_payloads (bool or list) - True to expand in every encoding, a list to
+                                         expand in those
+
+    Returns:
+        (PayloadRegistry, PayloadCorpus or PayloadExpander)
+    """
+
+    if payloads is None:
+        payloads = PayloadRegistry.get_shared()
+    elif isinstance(payloads, str):
+        payloads = PayloadCorpus.get_shared(payloads)
+
+    if expand_payloads is True:
+        payloads = PayloadExpander(payloads)
+    elif expand_payloads:
+        payloads = PayloadExpander(payloads, expand_payloads)
+
+    return payloads
+
+class PayloadExpander(object):
+    """
+    Expands the payloads of a PayloadRegistry or PayloadCorpus on demand, each template
+    with every verify script (see XssMapPayloads) in every encoding. Variants are made
+    one at a time as planning asks for them, and one whose canonical form - what the
+    application sees after decoding the request - was already given for the parameter
+    is dropped, so no render goes to an attack identical to an earlier one once
+    decoded. Usable anywhere a PayloadRegistry is.
+    """
+
+    def __init__(self, payloads, encodings=PAYLOAD_EXPANSION_ENCODINGS,
+                 verify_scripts=VERIFY_SCRIPTS):
+        """
+        Args:
+            payloads (PayloadRegistry or PayloadCorpus)
+            encodings (list) - names from PAYLOAD_ENCODINGS
+            verify_scripts (list)
+        """
+
+        for encoding in encodings:
+            if encoding not in PAYLOAD_ENCODINGS:
+                raise RuntimeError('Unrecognized payload encoding: ' + str(encoding))
+
+        self.payloads = payloads
+        self.encodings = list(encodings)
+        self.verify_scripts = list(verify_scripts)
+
+    def payloads_for(self, contexts):
+        """
+        Variants of the payloads for the given contexts, payload by payload in the
+        source's order, then script by script, then encoding by encoding.
+
+        Args:
+            contexts (list)
+
+        Yields:
+            (dict) - with 'id' made of the source payload's id, the script's position
+                     and the encoding, 'contexts' and 'string'
+        """
+
+        seen = set()
+
+        for payload in self.payloads.payloads_for(contexts):
+            template = payload.get('template', payload['string'])
+
+            for script_idx, script in enumerate(self.verify_scripts):
+                for encoding in self.encodings:
+                    string = self.__encode(template, script, encoding)
+
+                    # A short digest per variant keeps the seen set small
+                    canonical = unquote_plus(string).encode('utf-8', 'replace')
+                    digest = hashlib.blake2b(canonical, digest_size=8).digest()
+                    if digest in seen:
+                        continue
+                    seen.add(digest)
+
+                    variant = {}
+                    variant['id'] = str(payload['id']) + ':' + str(script_idx) + ':' + encoding
+                    variant['contexts'] = payload['contexts']
+                    variant['string'] = string
+                    yield variant
+
+    def make_attack(self, payload, trigger):
+        """
+        A variant's attack string with the given trigger in place.
+
+        Args:
+            payload (dict)
+            trigger (str)
+
+        Returns:
+            (str)
+        """
+
+        return payload['string'].replace(TRIGGER_VALUE_PLACEHOLDER, trigger)
+
+    def __encode(self, template, script, encoding):
+        """
+        (Private) A template with a script in place, in the given encoding. The trigger
+        placeholder itself is never encoded.
+
+        Args:
+            template (str)
+            script (str)
+            encoding (str)
+
+        Returns:
+            (str)
+        """
+
+        markup = template.split(JAVASCRIPT_PLACEHOLDER)
+
+        if encoding == 'case':
+            markup = [self.__alternate_case(part) for part in markup]
+        elif encoding == 'whitespace':
+            markup = [INNER_SPACE_PATTERN.sub('/', part) for part in markup]
+
+        parts = script.join(markup).split(TRIGGER_VALUE_PLACEHOLDER)
+
+        if encoding == 'url':
+            parts = [quote(part, safe='') for part in parts]
+        elif encoding == 'url_double':
+            parts = [quote(quote(part, safe=''), safe='') for part in parts]
+        elif encoding == 'html_entity':
+            parts = [''.join(quote('&#x%x;' % ord(c), safe='') if c in HTML_ENTITY_CHARS \
+                    else c for c in part) for part in parts]
+
+        return TRIGGER_VALUE_PLACEHOLDER.join(parts)
+
+    def __alternate_case(self, markup):
+        """
+        (Private) Markup with its letters alternately upper and lower case.
+
+        Args:
+            markup (str)
+
+        Returns:
+            (str)
+        """
+
+        letters = 0
+        cased = []
+
+        for c in markup:
+            if c.isalpha():
+                cased.append(c.upper() if letters % 2 == 0 else c.lower())
+                letters += 1
+            else:
+                cased.append(c)
+
+        return ''.join(cased)
@@ -0,0 +1,146 @@
+##
+## Application Security Threat Attack Modeling (ASTAM)
+##
+## Copyright (C) 2017 Applied Visions - http://securedecisions.com
+##
+## Written by Aspect Security - http://aspectsecurity.com
+##
+## Licensed under the Apache License, Version 2.0 (the "License");
+## you may not use this file except in compliance with the License.
+## You may obtain a copy of the License at
+##
+##     http://www.apache.org/licenses/LICENSE-2.0
+##
+## Unless required by applicable law or agreed to in writing, software
+## distributed under the License is distributed on an "AS IS" BASIS,
+## WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+## See the License for the specific language governing permissions and
+## limitations under the License.
+##
+
+"""
+PayloadRegistry.py
+"""
+
+import threading
+
+from .XssMapPayloads import TRIGGER_VALUE_PLACEHOLDER, XSSMAP_PAYLOADS
+
+# Reflection context every payload applies to, see ReflectionClassifier
+GENERAL_CONTEXT = 'general'
+
+class PayloadRegistry(object):
+    """
+    XSS payloads compiled for attack planning. Keeps an index from reflection context
+    to the payloads for it, and each payload string pre-split around its trigger
+    placeholder, so planning a parameter's attacks touches only the payloads that
+    apply and making an attack is one join.
+    """
+
+    shared_registry = None
+    shared_lock = threading.Lock()
+
+    def __init__(self, payloads=XSSMAP_PAYLOADS):
+        """
+        Args:
+            payloads (list) - dicts with 'id', 'contexts' and 'string', as in
+                              XssMapPayloads
+        """
+
+        self.payloads = {}
+        self.ids = []
+        self.ids_by_context = {}
+        self.string_parts = {}
+
+        for payload in payloads:
+            self.add(payload)
+
+    @staticmethod
+    def get_shared():
+        """
+        The process-wide registry of the built-in payloads, compiled on first use.
+
+        Returns:
+            (PayloadRegistry)
+        """
+
+        with PayloadRegistry.shared_lock:
+            if PayloadRegistry.shared_registry is None:
+                PayloadRegistry.shared_registry = PayloadRegistry()
+
+        return PayloadRegistry.shared_registry
+
+    def __len__(self):
+        return len(self.ids)
+
+    def add(self, payload):
+        """
+        Add a payload, after those already there.
+
+        Args:
+            payload (dict)
+        """
+
+        payload_id = payload['id']
+        if payload_id in self.payloads:
+            raise RuntimeError('Duplicate payload id: ' + str(payload_id))
+
+        self.payloads[payload_id] = payload
+        self.ids.append(payload_id)
+        self.string_parts[payload_id] = payload['string'].split(TRIGGER_VALUE_PLACEHOLDER)
+
+        for context in payload['contexts']:
+            self.ids_by_context.setdefault(context, []).append(payload_id)
+
+    def get(self, payload_id):
+        """
+        A payload by id.
+
+        Args:
+            payload_id (obj)
+
+        Returns:
+            (dict)
+        """
+
+        return self.payloads[payload_id]
+
+    def payloads_for(self, contexts):
+        """
+        Payloads applying to any of the given contexts, each once - those for the first
+        context in registry order, then those new for the second, and so on. The
+        'general' context takes every payload.
+
+        Args:
+            contexts (list)
+
+        Yields:
+            (dict)
+        """
+
+        seen = set()
+
+        for context in contexts:
+            if context == GENERAL_CONTEXT:
+                ids = self.ids
+            else:
+                ids = self.ids_by_context.get(context, [])
+
+            for payload_id in ids:
+                if payload_id not in seen:
+                    seen.add(payload_id)
+                    yield self.payloads[payload_id]
+
+    def make_attack(self, payload, trigger):
+        """
+        A payload's attack string with the given trigger in place.
+
+        Args:
+            payload (dict)
+            trigger (str)
+
+        Returns:
+            (str)
+        """
+
+        return trigger.join(self.string_parts[payload['id']])
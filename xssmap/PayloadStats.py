@@ -0,0 +1,281 @@
+##
+## Application Security Threat Attack Modeling (ASTAM)
+##
+## Copyright (C) 2017 Applied Visions - http://securedecisions.com
+##
+## Written by Aspect Security - http://aspectsecurity.com
+##
+## Licensed under the Apache License, Version 2.0 (the "License");
+## you may not use this file except in compliance with the License.
+## You may obtain a copy of the License at
+##
+##     http://www.apache.org/licenses/LICENSE-2.0
+##
+## Unless required by applicable law or agreed to in writing, software
+## distributed under the License is distributed on an "AS IS" BASIS,
+## WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+## See the License for the specific language governing permissions and
+## limitations under the License.
+##
+
+"""
+PayloadStats.py
+"""
+
+import heapq
+import json
+import os
+import random
+import sqlite3
+import threading
+from urllib.parse import urlsplit
+
+from .XssMapSettings import PAYLOAD_STATS_ORDERING, PAYLOAD_STATS_PATH, \
+        PAYLOAD_STATS_TOP_K
+
+# How candidate payloads are ordered from their history
+#   thompson - by a draw from each payload's Beta posterior of success, so payloads with
+#              little history still get tried early now and then. Unless seeded the
+#              order differs from run to run, so repeated scans render different
+#              requests and miss the render cache
+#   success_rate - by posterior mean success rate, deterministic
+PAYLOAD_STATS_ORDERINGS = ['thompson', 'success_rate']
+
+def make_payload_stats(payload_stats=None):
+    """
+    The PayloadStats a target's payload_stats option asks for.
+
+    Args:
+        payload_stats (PayloadStats, bool or dict) - True for the default settings, a
+                                                    dict of settings to override them
+
+    Returns:
+        (PayloadStats) - None if not asked for
+    """
+
+    if payload_stats is None or payload_stats is False:
+        return None
+    elif isinstance(payload_stats, PayloadStats):
+        return payload_stats
+
+    return PayloadStats.get_shared(**(payload_stats if isinstance(payload_stats, dict) else {}))
+
+class PayloadStats(object):
+    """
+    Persistent record of how often each payload was tried in each reflection context,
+    and how often it found XSS, kept in an SQLite database. XssScanner uses it to try
+    the payloads likeliest to succeed first, so with a stop policy (see StopPolicy) a
+    finding takes fewer renders. With per_target, history is also kept apart per target
+    origin, and ordering a target's payloads uses that target's history only.
+
+    Every operation uses its own short connection, so one object is safe to share
+    between threads, and scans in several processes may share the file.
+    """
+
+    shared_stats = {}
+    shared_lock = threading.Lock()
+
+    def __init__(self, path=PAYLOAD_STATS_PATH, ordering=PAYLOAD_STATS_ORDERING,
+                 per_target=False, seed=None, top_k=PAYLOAD_STATS_TOP_K):
+        """
+        Args:
+            path (str) - database file, created if missing
+            ordering (str) - one of PAYLOAD_STATS_ORDERINGS
+            per_target (bool)
+            seed (obj) - for repeatable Thompson sampling
+            top_k (int) - payloads moved to the front by their history, see order
+        """
+
+        if ordering not in PAYLOAD_STATS_ORDERINGS:
+            raise RuntimeError('Unrecognized payload ordering: ' + str(ordering))
+
+        if top_k < 1:
+            raise RuntimeError('Payload stats top_k must be at least 1.')
+
+        self.path = path
+        self.ordering = ordering
+        self.per_target = per_target
+        self.top_k = top_k
+
+        self.random = random.Random(seed)
+        self.random_lock = threading.Lock()
+
+        directory = os.path.dirname(os.path.abspath(path))
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        connection = self.__connect()
+        try:
+            connection.execute('CREATE TABLE IF NOT EXISTS payload_stats (' \
+                    'fingerprint TEXT NOT NULL, ' \
+                    'context TEXT NOT NULL, ' \
+                    'payload_id TEXT NOT NULL, ' \
+                    'attempts INTEGER NOT NULL DEFAULT 0, ' \
+                    'wins INTEGER NOT NULL DEFAULT 0, ' \
+                    'PRIMARY KEY (fingerprint, context, payload_id))')
+        finally:
+            connection.close()
+
+    @staticmethod
+    def get_shared(**settings):
+        """
+        The process-wide PayloadStats for some settings, opened on first use.
+
+        Args:
+            settings (dict) - keyword arguments for PayloadStats
+
+        Returns:
+            (PayloadStats)
+        """
+
+        settings_id = json.dumps(settings, sort_keys=True)
+
+        with PayloadStats.shared_lock:
+            if settings_id not in PayloadStats.shared_stats:
+                PayloadStats.shared_stats[settings_id] = PayloadStats(**settings)
+
+            return PayloadStats.shared_stats[settings_id]
+
+    def __connect(self):
+        """
+        (Private) Open a connection in autocommit mode, transactions begun explicitly.
+
+        Returns:
+            (sqlite3.Connection)
+        """
+
+        return sqlite3.connect(self.path, timeout=30, isolation_level=None)
+
+    def __fingerprint(self, target_url):
+        """
+        (Private) What history is kept apart by - the target's origin with per_target,
+        otherwise nothing.
+
+        Args:
+            target_url (str)
+
+        Returns:
+            (str)
+        """
+
+        if not self.per_target:
+            return ''
+
+        url_parts = urlsplit(target_url)
+
+        return url_parts.scheme + '://' + url_parts.netloc
+
+    def counts(self, target_url, contexts):
+        """
+        Attempts and wins of every payload with history in any of the given contexts,
+        summed over them.
+
+        Args:
+            target_url (str)
+            contexts (list)
+
+        Returns:
+            (dict) - [attempts, wins] by payload id, as str
+        """
+
+        contexts = list(set(contexts))
+        if not contexts:
+            return {}
+
+        connection = self.__connect()
+        try:
+            rows = connection.execute('SELECT payload_id, SUM(attempts), SUM(wins) ' \
+                    'FROM payload_stats WHERE fingerprint = ? AND context IN (' + \
+                    ', '.join(['?'] * len(contexts)) + ') GROUP BY payload_id', \
+                    [self.__fingerprint(target_url)] + contexts).fetchall()
+        finally:
+            connection.close()
+
+        counts = {}
+        for payload_id, attempts, wins in rows:
+            counts[payload_id] = [attempts, wins]
+
+        return counts
+
+    def order(self, target_url, contexts, payloads):
+        """
+        Payloads for a reflection in the given contexts, likeliest to find XSS first -
+        the top_k best scoring, then the rest in their given order. The source is read
+        through twice instead of held, so a big corpus never becomes a list. Payloads
+        scoring the same keep their given order, so with no history at all (and
+        success_rate ordering) nothing moves.
+
+        Args:
+            target_url (str)
+            contexts (list) - of the reflection
+            payloads (PayloadRegistry, PayloadCorpus or PayloadExpander)
+
+        Yields:
+            (dict)
+        """
+
+        counts = self.counts(target_url, contexts)
+
+        # Min-heap of the best so far as (score, -position, payload), so of two payloads
+        # scoring the same the later one is dropped first
+        best = []
+
+        for position, payload in enumerate(payloads.payloads_for(contexts)):
+            attempts, wins = counts.get(str(payload['id']), [0, 0])
+
+            # Beta(1, 1) prior, so a payload never tried scores as even odds
+            if self.ordering == 'thompson':
+                with self.random_lock:
+                    score = self.random.betavariate(1 + wins, 1 + attempts - wins)
+            else:
+                score = (1.0 + wins) / (2.0 + attempts)
+
+            if len(best) < self.top_k:
+                heapq.heappush(best, (score, -position, payload))
+            elif (score, -position) > best[0][:2]:
+                heapq.heapreplace(best, (score, -position, payload))
+
+        best.sort(key=lambda entry: (-entry[0], -entry[1]))
+        for entry in best:
+            yield entry[2]
+
+        best_positions = set(-entry[1] for entry in best)
+        for position, payload in enumerate(payloads.payloads_for(contexts)):
+            if position not in best_positions:
+                yield payload
+
+    def record(self, target_url, outcomes):
+        """
+        Add the outcomes of attacks on a target to the history, in one transaction.
+
+        Args:
+            target_url (str)
+            outcomes (list) - (contexts, payload id, whether it found XSS for certain)
+                              per attack rendered
+        """
+
+        fingerprint = self.__fingerprint(target_url)
+
+        rows = []
+        for contexts, payload_id, won in outcomes:
+            for context in set(contexts):
+                rows.append((fingerprint, context, str(payload_id), 1 if won else 0))
+
+        if not rows:
+            return
+
+        connection = self.__connect()
+        try:
+            connection.execute('BEGIN IMMEDIATE')
+            try:
+                connection.executemany('INSERT INTO payload_stats ' \
+                        '(fingerprint, context, payload_id, attempts, wins) ' \
+                        'VALUES (?, ?, ?, 1, ?) ' \
+                        'ON CONFLICT (fingerprint, context, payload_id) DO UPDATE SET ' \
+                        'attempts = attempts + 1, wins = wins + excluded.wins', rows)
+            except Exception:
+                connection.execute('ROLLBACK')
+                raise
+            connection.execute('COMMIT')
+        finally:
+            connection.close()
@@ -22,16 +22,14 @@
 ReflectionChecker.py
 """
 
+import asyncio
 import base64
 import json
 import random
-import re
 import string
 
-from lxml import html
-import requests
-
 from .PageRenderAPI import PageRenderAPI
+from .ReflectionClassifier import ReflectionClassifier
 
 class ReflectionChecker(object):
     """
@@ -39,14 +37,28 @@ class ReflectionChecker(object):
     rendered web page.
     """
 
-    def __init__(self, information_from_probe):
+    def __init__(self, information_from_probe, renderer=None, trigger_seed=None, prefilter=None):
         """
-        ReflectionChecker is initialized by output from RequestVariableProbe.
+        ReflectionChecker is initialized by output from RequestVariableProbe. Renders go
+        through the given render client, or the shared one if none is given. A trigger
+        seed makes the generated triggers repeatable, so identical checks render
+        identical requests (see RenderCache). With a prefilter, the triggers are first
+        looked for in the raw HTTP response and the render is skipped if none can
+        reflect.
 
         Args:
             information_from_probe (XssMapObject)
+            renderer (RenderBackend)
+            trigger_seed (str)
+            prefilter (ReflectionPrefilter)
         """
 
+        if renderer is None:
+            renderer = PageRenderAPI.get_shared_client()
+        self.renderer = renderer
+        self.trigger_random = random.Random(trigger_seed)
+        self.prefilter = prefilter
+
         self.data = None
         self.searches = []
         self.request_url = ''
@@ -187,7 +199,7 @@ class ReflectionChecker(object):
             (str)
         """
 
-        return ''.join(random.choice(string.ascii_lowercase) for i in range(9))
+        return ''.join(self.trigger_random.choice(string.ascii_lowercase) for i in range(9))
 
     def __get_and_prepare_request_inputs(self):
         """
@@ -213,7 +225,56 @@ class ReflectionChecker(object):
 
         return inputs
 
-    def __analyze_rendered_page_output(self, rendered_page_output):
+    def find_candidate_params(self):
+        """
+        Run only the raw-HTTP prefilter, no render: returns the parameters whose trigger
+        may reflect. Without a prefilter that is all of them.
+
+        Returns:
+            (list) - entries of params_other
+        """
+
+        if self.prefilter is None:
+            return list(self.data.params_other)
+
+        candidates = self.__find_candidate_searches()
+
+        return [param for param in self.data.params_other \
+                if param['reflect_trigger'] in candidates]
+
+    async def find_candidate_params_async(self):
+        """
+        Coroutine counterpart of find_candidate_params. The prefilter's plain HTTP
+        requests block, so they run in the event loop's default executor.
+
+        Returns:
+            (list) - entries of params_other
+        """
+
+        if self.prefilter is None:
+            return list(self.data.params_other)
+
+        candidates = await asyncio.get_running_loop().run_in_executor(None, \
+                self.__find_candidate_searches)
+
+        return [param for param in self.data.params_other \
+                if param['reflect_trigger'] in candidates]
+
+    def __find_candidate_searches(self):
+        """
+        (Private) The triggers the prefilter cannot rule out, all of them without one.
+
+        Returns:
+            (list)
+        """
+
+        if self.prefilter is None:
+            return self.searches
+
+        return self.prefilter.find_candidates(self.data.request_type, self.request_url, \
+                self.request_body, self.headers, self.cookies, self.searches)
+
+    def __analyze_rendered_page_output(self, rendered_page_output, searches):
         """
         (Private) Check for indicators of reflection in a rendered page
         output object and return results.
@@ -229,325 +290,67 @@ class ReflectionChecker(object):
                 'page_prompts' : list of strings of javascript prompt()
             }
 
+            searches (list) - triggers to look for
+
         Returns:
             (list)
         """
 
-        page_html_tree = html.fromstring(rendered_page_output['page_html'])
+        return ReflectionClassifier(searches).classify(rendered_page_output)
+
+    def run(self):
+        """
+        Run main functionality.
+
+        Returns:
+            (XssMapObject)
+        """
+
+        searches = self.__find_candidate_searches()
 
         results = []
+        if searches:
+            rendered_page_output = self.renderer.render_page(self.data.request_type, \
+                        self.request_url, self.request_body, self.headers, self.cookies)
 
-        for search in self.searches:
-            result = {}
-            result['payload'] = search
-            result['contexts'] = []
-
-            # node with search string
-            nn_xpath = '//' + search
-            nn = page_html_tree.xpath(nn_xpath)
-            nn_count = len(nn)
-
-            if nn_count:
-                context = {}
-                context['type'] = 'nodename'
-                context['count'] = nn_count
-                result['contexts'].append(context)
-
-            # attribute name //*[ . = "val"]
-            an_xpath = '//*[@' + search + ']'
-            an = page_html_tree.xpath(an_xpath)
-            an_count = len(an)
-
-            if an_count:
-                context = {}
-                context['type'] = 'attributename'
-                context['count'] = an_count
-                result['contexts'].append(context)
-
-            # attribute value
-            av_xpath = '//*[@*[contains(.,\'' + search + '\')]]'
-            av = page_html_tree.xpath(av_xpath)
-            av_count = len(av)
-
-            if av_count:
-                context = {}
-                context['type'] = 'attributevalue'
-                context['count'] = av_count
-                result['contexts'].append(context)
-
-            # text value
-            tv_xpath = '//*[contains(text(),\'' + search + '\')]'
-            tv = page_html_tree.xpath(tv_xpath)
-            tv_count = len(tv)
-
-            if tv_count:
-                context = {}
-                context['type'] = 'text'
-                context['count'] = tv_count
-                result['contexts'].append(context)
-
-            # html comment
-            com_xpath = '//*[comment()[contains(.,\'' + search + '\')]]'
-            com = page_html_tree.xpath(com_xpath)
-            com_count = len(com)
-
-            if com_count:
-                context = {}
-                context['type'] = 'comment'
-                context['count'] = com_count
-                result['contexts'].append(context)
-
-            # ** Special instances of the above... **
-
-            # <style>
-            style_xpath = '//style[contains(text(),\'' + search + '\')]'
-            style = page_html_tree.xpath(style_xpath)
-            style_count = len(style)
-
-            if style_count:
-                context = {}
-                context['type'] = 'style'
-                context['count'] = style_count
-                result['contexts'].append(context)
-
-            # inside id attribute value
-            idattrib_xpath = '//*[@id[contains(.,\'' + search + '\')]]'
-            idattrib = page_html_tree.xpath(idattrib_xpath)
-            idattrib_count = len(idattrib)
-
-            if idattrib_count:
-                context = {}
-                context['type'] = 'idattrib'
-                context['count'] = idattrib_count
-                result['contexts'].append(context)
-
-            # inside class attribute value
-            clazz_xpath = '//*[@class[contains(.,\'' + search + '\')]]'
-            clazz = page_html_tree.xpath(clazz_xpath)
-            clazz_count = len(clazz)
-
-            if clazz_count:
-                context = {}
-                context['type'] = 'classattrib'
-                context['count'] = clazz_count
-                result['contexts'].append(context)
-
-            # inside style attribute value
-            styleattrib_xpath = '//*[@style[contains(.,\'' + search + '\')]]'
-            styleattrib = page_html_tree.xpath(styleattrib_xpath)
-            styleattrib_count = len(styleattrib)
-
-            if styleattrib_count:
-                context = {}
-                context['type'] = 'styleattrib'
-                context['count'] = styleattrib_count
-                result['contexts'].append(context)
-
-            # ** Harder ones... Javascript **
-
-            # inside <script> header
-            jsnode_xpath = '//script[contains(text(),\'' + search + '\')]'
-            jsnode = page_html_tree.xpath(jsnode_xpath)
-            jsnode_count = len(jsnode)
-
-            if jsnode_count:
-                context = {}
-                context['type'] = 'jsnode'
-                context['count'] = jsnode_count
-                result['contexts'].append(context)
-
-            # each instance of <script> comes out differently, parse each for content
-
-            jssqcount = 0
-            jsdqcount = 0
-            js_xpath = '//script[contains(text(),\'' + search + '\')]'
-            js = page_html_tree.xpath(js_xpath)
-
-            for js_finding in js:
-                js_string = js_finding.text
-
-                # TODO below line is a mix of Javascript and Python, implement for some rare cases...
-                #escaped_search = search.replace(/[.*+?^${}()|[\]\\]/g, '\\$&')
-
-                sqre = re.compile('\'(?:[^\'\\\\]|\\\\.)*' + search + '(?:[^\'\\\\]|\\\\.)*\'')
-                #sqre = re.compile('\'(?:[^\'\\\\]|\\\\.)*' + escaped_search + '(?:[^\'\\\\]|\\\\.)*\'')
-                dqre = re.compile('"(?:[^"\\\\]|\\\\.)*' + search + '(?:[^"\\\\]|\\\\.)*"')
-                #dqre = re.compile('(?:[^"\\\\]|\\\\.)*' + escaped_search + '(?:[^"\\\\]|\\\\.)*"')
-
-                sq = sqre.findall(js_string)
-                dq = dqre.findall(js_string)
-
-                jssqcount += len(sq)
-                jsdqcount += len(dq)
-
-            if jssqcount:
-                context = {}
-                context['type'] = 'jssinglequote'
-                context['count'] = jssqcount
-                result['contexts'].append(context)
-
-            if jsdqcount:
-                context = {}
-                context['type'] = 'jsdoublequote'
-                context['count'] = jsdqcount
-                result['contexts'].append(context)
-
-            # inside any onXXXX() attribute
-            onattrib_xpath = '//*[@onerror[contains(.,\'' + search \
-                    + '\')] or @onload[contains(.,\'' + search \
-                    + '\')] or @onclick[contains(.,\'' + search \
-                    + '\')] or @oncontextmenu[contains(.,\'' + search \
-                    + '\')] or @ondblclick[contains(.,\'' + search \
-                    + '\')] or @onmousedown[contains(.,\'' + search \
-                    + '\')] or @onmouseenter[contains(.,\'' + search \
-                    + '\')] or @onmouseleave[contains(.,\'' + search \
-                    + '\')] or @onmousemove[contains(.,\'' + search \
-                    + '\')] or @onmouseover[contains(.,\'' + search \
-                    + '\')] or @onmouseout[contains(.,\'' + search \
-                    + '\')] or @onmouseup[contains(.,\'' + search \
-                    + '\')] or @onkeydown[contains(.,\'' + search \
-                    + '\')] or @onkeypress[contains(.,\'' + search \
-                    + '\')] or @onkeyup[contains(.,\'' + search \
-                    + '\')] or @onabort[contains(.,\'' + search \
-                    + '\')] or @onbeforeunload[contains(.,\'' + search \
-                    + '\')] or @onhashchange[contains(.,\'' + search \
-                    + '\')] or @onpageshow[contains(.,\'' + search \
-                    + '\')] or @onpagehide[contains(.,\'' + search \
-                    + '\')] or @onresize[contains(.,\'' + search \
-                    + '\')] or @onscroll[contains(.,\'' + search \
-                    + '\')] or @onunload[contains(.,\'' + search \
-                    + '\')] or @onblur[contains(.,\'' + search \
-                    + '\')] or @onchange[contains(.,\'' + search \
-                    + '\')] or @onfocus[contains(.,\'' + search \
-                    + '\')] or @onfocusin[contains(.,\'' + search \
-                    + '\')] or @onfocusout[contains(.,\'' + search \
-                    + '\')] or @oninput[contains(.,\'' + search \
-                    + '\')] or @oninvalid[contains(.,\'' + search \
-                    + '\')] or @onreset[contains(.,\'' + search \
-                    + '\')] or @onsearch[contains(.,\'' + search \
-                    + '\')] or @onselect[contains(.,\'' + search \
-                    + '\')] or @ondrag[contains(.,\'' + search \
-                    + '\')] or @ondragend[contains(.,\'' + search \
-                    + '\')] or @ondragenter[contains(.,\'' + search \
-                    + '\')] or @ondragleave[contains(.,\'' + search \
-                    + '\')] or @ondragover[contains(.,\'' + search \
-                    + '\')] or @ondragstart[contains(.,\'' + search \
-                    + '\')] or @ondrop[contains(.,\'' + search \
-                    + '\')] or @oncopy[contains(.,\'' + search \
-                    + '\')] or @oncut[contains(.,\'' + search \
-                    + '\')] or @onpaste[contains(.,\'' + search \
-                    + '\')] or @onafterprint[contains(.,\'' + search \
-                    + '\')] or @onbeforeprint[contains(.,\'' + search \
-                    + '\')] or @onabort[contains(.,\'' + search \
-                    + '\')] or @oncanplay[contains(.,\'' + search \
-                    + '\')] or @oncanplaythrough[contains(.,\'' + search \
-                    + '\')] or @ondurationchange[contains(.,\'' + search \
-                    + '\')] or @onemptied[contains(.,\'' + search \
-                    + '\')] or @onended[contains(.,\'' + search \
-                    + '\')] or @onloadeddata[contains(.,\'' + search \
-                    + '\')] or @onloadedmetadata[contains(.,\'' + search \
-                    + '\')] or @onloadstart[contains(.,\'' + search \
-                    + '\')] or @onpause[contains(.,\'' + search \
-                    + '\')] or @onplay[contains(.,\'' + search \
-                    + '\')] or @onplaying[contains(.,\'' + search \
-                    + '\')] or @onprogress[contains(.,\'' + search \
-                    + '\')] or @onratechange[contains(.,\'' + search \
-                    + '\')] or @onseeked[contains(.,\'' + search \
-                    + '\')] or @onseeking[contains(.,\'' + search \
-                    + '\')] or @onstalled[contains(.,\'' + search \
-                    + '\')] or @onsuspend[contains(.,\'' + search \
-                    + '\')] or @ontimeupdate[contains(.,\'' + search \
-                    + '\')] or @onvolumechange[contains(.,\'' + search \
-                    + '\')] or @onwaiting[contains(.,\'' + search \
-                    + '\')] or @onopen[contains(.,\'' + search \
-                    + '\')] or @onmessage[contains(.,\'' + search \
-                    + '\')] or @onmousewheel[contains(.,\'' + search \
-                    + '\')] or @ononline[contains(.,\'' + search \
-                    + '\')] or @onoffline[contains(.,\'' + search \
-                    + '\')] or @onpopstate[contains(.,\'' + search \
-                    + '\')] or @onshow[contains(.,\'' + search \
-                    + '\')] or @onstorage[contains(.,\'' + search \
-                    + '\')] or @ontoggle[contains(.,\'' + search \
-                    + '\')] or @onwheel[contains(.,\'' + search \
-                    + '\')] or @ontouchcancel[contains(.,\'' + search \
-                    + '\')] or @ontouchend[contains(.,\'' + search \
-                    + '\')] or @ontouchmove[contains(.,\'' + search \
-                    + '\')] or @ontouchstart[contains(.,\'' + search \
-                    + '\')] or @onsubmit[contains(.,\'' + search + '\')]]'
-            onattrib = page_html_tree.xpath(onattrib_xpath)
-            onattrib_count = len(onattrib)
-
-            if onattrib_count:
-                context = {}
-                context['type'] = 'onattrib'
-                context['count'] = onattrib_count
-                result['contexts'].append(context)
-
-            # JS errors
-            error_count = 0
-            for error_popup in rendered_page_output['page_errors']:
-                if search in error_popup:
-                    error_count += 1
-
-            if error_count:
-                context = {}
-                context['type'] = 'js_error'
-                context['count'] = error_count
-                result['contexts'].append(context)
-
-            # JS console messages
-            console_msg_count = 0
-            for console_msg in rendered_page_output['page_console_messages']:
-                if search in console_msg:
-                    console_msg_count += 1
-
-            if console_msg_count:
-                context = {}
-                context['type'] = 'js_console'
-                context['count'] = console_msg_count
-                result['contexts'].append(context)
-
-            # prompt() popups
-            prompt_popup_count = 0
-            for prompt_popup in rendered_page_output['page_prompts']:
-                if search in prompt_popup:
-                    prompt_popup_count += 1
-
-            if prompt_popup_count:
-                context = {}
-                context['type'] = 'js_prompt'
-                context['count'] = prompt_popup_count
-                result['contexts'].append(context)
-
-            # confirm() popups
-            confirm_popup_count = 0
-            for confirm_popup in rendered_page_output['page_confirms']:
-                if search in confirm_popup:
-                    confirm_popup_count += 1
-
-            if confirm_popup_count:
-                context = {}
-                context['type'] = 'js_confirm'
-                context['count'] = confirm_popup_count
-                result['contexts'].append(context)
-
-            if result['contexts']:
-                results.append(result)
-
-        return results
+            results = self.__analyze_rendered_page_output(rendered_page_output, searches)
 
-    def run(self):
+        return self.__mark_reflected_params(results)
+
+    async def run_async(self):
         """
-        Run main functionality.
+        Coroutine counterpart of run.
 
         Returns:
             (XssMapObject)
         """
 
-        rendered_page_output = PageRenderAPI.render_page_with_phantom(self.data.request_type, \
-                    self.request_url, self.request_body, self.headers, self.cookies)
+        searches = self.searches
+        if self.prefilter is not None:
+            searches = await asyncio.get_running_loop().run_in_executor(None, \
+                    self.__find_candidate_searches)
+
+        results = []
+        if searches:
+            rendered_page_output = await self.renderer.render_page_async( \
+                    self.data.request_type, self.request_url, self.request_body, \
+                    self.headers, self.cookies)
+
+            results = self.__analyze_rendered_page_output(rendered_page_output, searches)
+
+        return self.__mark_reflected_params(results)
+
+    def __mark_reflected_params(self, results):
+        """
+        (Private) Move the parameters found reflecting into 'params_reflected', with the
+        contexts they reflect in.
+
+        Args:
+            results (list) - from ReflectionClassifier
 
-        results = self.__analyze_rendered_page_output(rendered_page_output)
+        Returns:
+            (XssMapObject)
+        """
 
         self.data.params_reflected = []
 
@@ -0,0 +1,264 @@
+##
+## Application Security Threat Attack Modeling (ASTAM)
+##
+## Copyright (C) 2017 Applied Visions - http://securedecisions.com
+##
+## Written by Aspect Security - http://aspectsecurity.com
+##
+## Licensed under the Apache License, Version 2.0 (the "License");
+## you may not use this file except in compliance with the License.
+## You may obtain a copy of the License at
+##
+##     http://www.apache.org/licenses/LICENSE-2.0
+##
+## Unless required by applicable law or agreed to in writing, software
+## distributed under the License is distributed on an "AS IS" BASIS,
+## WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+## See the License for the specific language governing permissions and
+## limitations under the License.
+##
+
+"""
+ReflectionClassifier.py
+"""
+
+import re
+
+from lxml import etree, html
+
+# Event handler attributes that count toward the 'onattrib' context
+ON_ATTRIBUTES = frozenset([
+    'onerror', 'onload', 'onclick', 'oncontextmenu', 'ondblclick', 'onmousedown',
+    'onmouseenter', 'onmouseleave', 'onmousemove', 'onmouseover', 'onmouseout',
+    'onmouseup', 'onkeydown', 'onkeypress', 'onkeyup', 'onabort', 'onbeforeunload',
+    'onhashchange', 'onpageshow', 'onpagehide', 'onresize', 'onscroll', 'onunload',
+    'onblur', 'onchange', 'onfocus', 'onfocusin', 'onfocusout', 'oninput', 'oninvalid',
+    'onreset', 'onsearch', 'onselect', 'ondrag', 'ondragend', 'ondragenter',
+    'ondragleave', 'ondragover', 'ondragstart', 'ondrop', 'oncopy', 'oncut', 'onpaste',
+    'onafterprint', 'onbeforeprint', 'oncanplay', 'oncanplaythrough',
+    'ondurationchange', 'onemptied', 'onended', 'onloadeddata', 'onloadedmetadata',
+    'onloadstart', 'onpause', 'onplay', 'onplaying', 'onprogress', 'onratechange',
+    'onseeked', 'onseeking', 'onstalled', 'onsuspend', 'ontimeupdate', 'onvolumechange',
+    'onwaiting', 'onopen', 'onmessage', 'onmousewheel', 'ononline', 'onoffline',
+    'onpopstate', 'onshow', 'onstorage', 'ontoggle', 'onwheel', 'ontouchcancel',
+    'ontouchend', 'ontouchmove', 'ontouchstart', 'onsubmit'
+    ])
+
+# Order in which contexts are reported for each trigger
+CONTEXT_TYPES = [
+    'nodename', 'attributename', 'attributevalue', 'text', 'comment', 'style',
+    'idattrib', 'classattrib', 'styleattrib', 'jsnode', 'jssinglequote', 'jsdoublequote',
+    'onattrib', 'js_error', 'js_console', 'js_prompt', 'js_confirm'
+    ]
+
+class ReflectionClassifier(object):
+    """
+    Finds every trigger string in a rendered page in one walk of its tree and sorts
+    each occurrence into reflection contexts.
+    """
+
+    def __init__(self, searches):
+        """
+        Args:
+            searches (list) - trigger strings to look for
+        """
+
+        self.searches = list(searches)
+        self.search_set = frozenset(self.searches)
+
+        self.search_pattern = None
+        if self.searches:
+            # Lookahead so overlapping occurrences are all seen; longest first so a
+            # trigger that starts another one does not hide it
+            alternation = '|'.join(re.escape(s) for s in \
+                    sorted(self.search_set, key=len, reverse=True))
+            self.search_pattern = re.compile('(?=(' + alternation + '))')
+
+        # Shorter triggers found inside a longer one that matched
+        self.contained_searches = {}
+        for search in self.search_set:
+            self.contained_searches[search] = [s for s in self.search_set \
+                    if s != search and s in search]
+
+        self.js_string_patterns = {}
+        for search in self.search_set:
+            escaped_search = re.escape(search)
+            sqre = re.compile('\'(?:[^\'\\\\]|\\\\.)*' + escaped_search + '(?:[^\'\\\\]|\\\\.)*\'')
+            dqre = re.compile('"(?:[^"\\\\]|\\\\.)*' + escaped_search + '(?:[^"\\\\]|\\\\.)*"')
+            self.js_string_patterns[search] = (sqre, dqre)
+
+    def find_triggers(self, text):
+        """
+        Returns the set of triggers contained in the given text.
+
+        Args:
+            text (str)
+
+        Returns:
+            (set)
+        """
+
+        found = set()
+
+        if not text or self.search_pattern is None:
+            return found
+
+        for match in self.search_pattern.finditer(text):
+            search = match.group(1)
+            if search not in found:
+                found.add(search)
+                found.update(self.contained_searches[search])
+
+        return found
+
+    def __first_text(self, element):
+        """
+        (Private) The first text node under an element, which is what XPath's
+        contains(text(), ...) looks at.
+
+        Args:
+            element (lxml.html.HtmlElement)
+
+        Returns:
+            (str)
+        """
+
+        if element.text:
+            return element.text
+
+        for child in element:
+            if child.tail:
+                return child.tail
+
+        return ''
+
+    def __count(self, counts, found, context_type, amount=1):
+        """
+        (Private) Add to the count of a context for every trigger in found.
+
+        Args:
+            counts (dict)
+            found (iterable)
+            context_type (str)
+            amount (int)
+        """
+
+        for search in found:
+            search_counts = counts[search]
+            search_counts[context_type] = search_counts.get(context_type, 0) + amount
+
+    def classify(self, rendered_page_output):
+        """
+        Check for indicators of reflection in a rendered page output object and return
+        results, one per trigger found, in the order triggers were given.
+
+        Args:
+            rendered_page_output (obj) - see RenderBackend
+
+        Returns:
+            (list)
+
+            [
+                {
+                    'payload' : trigger string,
+                    'contexts' : [ { 'type' : 'text', 'count' : 1 }, ... ]
+                }
+            ]
+        """
+
+        counts = dict((search, {}) for search in self.search_set)
+
+        page_html_tree = html.fromstring(rendered_page_output['page_html'])
+
+        for element in page_html_tree.getroottree().getroot().iter():
+            tag = element.tag
+
+            # Comments and processing instructions are handled via their parent
+            if not isinstance(tag, str):
+                continue
+
+            if tag in self.search_set:
+                self.__count(counts, [tag], 'nodename')
+
+            attribute_names = set()
+            in_attribute_value = set()
+            in_id = set()
+            in_class = set()
+            in_style = set()
+            in_on = set()
+
+            for name, value in element.attrib.items():
+                if name in self.search_set:
+                    attribute_names.add(name)
+
+                found = self.find_triggers(value)
+                if not found:
+                    continue
+
+                in_attribute_value |= found
+                if name == 'id':
+                    in_id |= found
+                elif name == 'class':
+                    in_class |= found
+                elif name == 'style':
+                    in_style |= found
+                if name in ON_ATTRIBUTES:
+                    in_on |= found
+
+            in_comment = set()
+            for child in element:
+                if child.tag is etree.Comment:
+                    in_comment |= self.find_triggers(child.text)
+
+            in_text = self.find_triggers(self.__first_text(element))
+
+            self.__count(counts, attribute_names, 'attributename')
+            self.__count(counts, in_attribute_value, 'attributevalue')
+            self.__count(counts, in_text, 'text')
+            self.__count(counts, in_comment, 'comment')
+            self.__count(counts, in_id, 'idattrib')
+            self.__count(counts, in_class, 'classattrib')
+            self.__count(counts, in_style, 'styleattrib')
+            self.__count(counts, in_on, 'onattrib')
+
+            if tag == 'style':
+                self.__count(counts, in_text, 'style')
+            elif tag == 'script' and in_text:
+                self.__count(counts, in_text, 'jsnode')
+
+                js_string = element.text or ''
+                for search in in_text:
+                    sqre, dqre = self.js_string_patterns[search]
+                    self.__count(counts, [search], 'jssinglequote', len(sqre.findall(js_string)))
+                    self.__count(counts, [search], 'jsdoublequote', len(dqre.findall(js_string)))
+
+        event_sources = [
+            ('js_error', rendered_page_output['page_errors']),
+            ('js_console', rendered_page_output['page_console_messages']),
+            ('js_prompt', rendered_page_output['page_prompts']),
+            ('js_confirm', rendered_page_output['page_confirms'])
+            ]
+
+        for context_type, messages in event_sources:
+            for message in messages:
+                self.__count(counts, self.find_triggers(message), context_type)
+
+        results = []
+
+        for search in self.searches:
+            result = {}
+            result['payload'] = search
+            result['contexts'] = []
+
+            search_counts = counts[search]
+            for context_type in CONTEXT_TYPES:
+                if search_counts.get(context_type):
+                    context = {}
+                    context['type'] = context_type
+                    context['count'] = search_counts[context_type]
+                    result['contexts'].append(context)
+
+            if result['contexts']:
+                results.append(result)
+
+        return results
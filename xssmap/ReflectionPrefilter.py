@@ -0,0 +1,261 @@
+##
+## Application Security Threat Attack Modeling (ASTAM)
+##
+## Copyright (C) 2017 Applied Visions - http://securedecisions.com
+##
+## Written by Aspect Security - http://aspectsecurity.com
+##
+## Licensed under the Apache License, Version 2.0 (the "License");
+## you may not use this file except in compliance with the License.
+## You may obtain a copy of the License at
+##
+##     http://www.apache.org/licenses/LICENSE-2.0
+##
+## Unless required by applicable law or agreed to in writing, software
+## distributed under the License is distributed on an "AS IS" BASIS,
+## WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+## See the License for the specific language governing permissions and
+## limitations under the License.
+##
+
+"""
+ReflectionPrefilter.py
+"""
+
+import html
+import re
+import threading
+from urllib.parse import unquote_plus, urljoin
+
+from lxml import etree
+from lxml import html as lxml_html
+
+from .PageRenderAPI import PageRenderAPI
+from .XssMapSettings import PREFILTER_FETCH_SCRIPTS
+
+# Script sources that can carry a parameter into the page without it ever being in
+# the raw response
+DOM_SOURCE_PATTERN = re.compile(r'\b(?:location|document\s*\.\s*(?:URL|documentURI|baseURI|' \
+        r'referrer|cookie)|window\s*\.\s*name|URLSearchParams)\b')
+
+# Characters payloads depend on that applications commonly filter or encode, checked by
+# the character probe (see ReflectionPrefilter.find_surviving_characters)
+PROBE_CHARACTERS = '<>\'"/;=-'
+
+# How far past a trigger, in multiples of the probe's length, its characters are looked
+# for - room for the encodings of those that do not survive
+PROBE_WINDOW_FACTOR = 8
+
+def make_character_probe(trigger):
+    """
+    A probe value - the trigger, then each probe character followed by a marker of its
+    position, so a character counts as surviving only if it is there as itself right
+    before its own marker.
+
+    Args:
+        trigger (str)
+
+    Returns:
+        (str)
+    """
+
+    probe = trigger
+    for idx, c in enumerate(PROBE_CHARACTERS):
+        probe += c + 'x' + str(idx)
+
+    return probe
+
+def characters_needed(attack):
+    """
+    The probe characters an attack value needs to reach the application intact, as the
+    application sees it once the request is decoded.
+
+    Args:
+        attack (str)
+
+    Returns:
+        (set)
+    """
+
+    return set(unquote_plus(attack)) & set(PROBE_CHARACTERS)
+
+class ReflectionPrefilter(object):
+    """
+    Cheap stage before browser rendering: makes the trigger request over plain HTTP and
+    searches the raw response for each trigger. Triggers that never show up cannot
+    reflect, unless the page's scripts read the URL or similar DOM sources - then every
+    trigger is kept.
+    """
+
+    def __init__(self, fetcher=None, fetch_scripts=PREFILTER_FETCH_SCRIPTS):
+        """
+        Args:
+            fetcher (StaticRenderBackend) - makes the raw requests, the shared one if None
+            fetch_scripts (bool) - whether to fetch external scripts to look for DOM
+                                   sources in them, otherwise any external script
+                                   counts as one
+        """
+
+        if fetcher is None:
+            fetcher = PageRenderAPI.get_shared_client('static')
+        self.fetcher = fetcher
+        self.fetch_scripts = fetch_scripts
+
+        # Script URL -> whether it reads a DOM source, shared by every target
+        self.script_verdicts = {}
+        self.lock = threading.Lock()
+
+    def find_candidates(self, method, url, body, headers, cookies, triggers):
+        """
+        Make the request and return the triggers that may reflect. When the request
+        fails, or the page has a DOM-only path, all of them may.
+
+        Args:
+            method (str)
+            url (str)
+            body (str)
+            headers (dict)
+            cookies (list)
+            triggers (list)
+
+        Returns:
+            (list) - in the order given
+        """
+
+        try:
+            r = self.fetcher.fetch(method, url, body, headers, cookies)
+        except Exception:
+            return list(triggers)
+
+        if self.__has_dom_source(r.url, r.text, headers, cookies):
+            return list(triggers)
+
+        # Character references decode to the trigger in the browser, so count those too
+        raw = html.unescape(r.text).lower()
+
+        return [trigger for trigger in triggers if trigger.lower() in raw]
+
+    def find_surviving_characters(self, method, url, body, headers, cookies, trigger):
+        """
+        Make a request carrying a character probe (see make_character_probe) and return
+        which probe characters come back unencoded at each place the trigger shows up
+        in the raw response. Returns None when that cannot be told - the request fails,
+        the trigger never shows up, or the page's scripts read DOM sources and may put
+        the value in the page some other way.
+
+        Args:
+            method (str)
+            url (str) - with the probe in place
+            body (str) - with the probe in place
+            headers (dict)
+            cookies (list)
+            trigger (str) - the probe's trigger
+
+        Returns:
+            (list) - str of surviving characters per reflection point, in page order
+        """
+
+        try:
+            r = self.fetcher.fetch(method, url, body, headers, cookies)
+        except Exception:
+            return None
+
+        text = r.text
+
+        positions = [m.start() for m in re.finditer(re.escape(trigger), text)]
+        if not positions:
+            return None
+
+        if self.__has_dom_source(r.url, text, headers, cookies):
+            return None
+
+        window = len(make_character_probe(trigger)) * PROBE_WINDOW_FACTOR
+        surviving = []
+
+        for idx, position in enumerate(positions):
+            end = position + window
+            if idx + 1 < len(positions):
+                end = min(end, positions[idx + 1])
+            segment = text[position:end]
+
+            surviving.append(''.join(c for char_idx, c in enumerate(PROBE_CHARACTERS) \
+                    if c + 'x' + str(char_idx) in segment))
+
+        return surviving
+
+    def __has_dom_source(self, page_url, page_text, headers, cookies):
+        """
+        (Private) Whether any inline script, event handler, javascript: URL or external
+        script on the page reads a DOM source.
+
+        Args:
+            page_url (str) - final URL, after redirects
+            page_text (str)
+            headers (dict)
+            cookies (list)
+
+        Returns:
+            (bool)
+        """
+
+        if not page_text.strip():
+            return False
+
+        try:
+            tree = lxml_html.fromstring(page_text)
+        except (etree.ParserError, ValueError):
+            # Could not tell, so assume there is one
+            return True
+
+        for element in tree.iter():
+            if not isinstance(element.tag, str):
+                continue
+
+            if element.tag == 'script':
+                src = element.get('src')
+                if src:
+                    if self.__script_has_dom_source(urljoin(page_url, src), headers, cookies):
+                        return True
+                elif element.text and DOM_SOURCE_PATTERN.search(element.text):
+                    return True
+
+            for name, value in element.attrib.items():
+                if name.lower().startswith('on') and DOM_SOURCE_PATTERN.search(value):
+                    return True
+                if value.strip().lower().startswith('javascript:') \
+                        and DOM_SOURCE_PATTERN.search(value):
+                    return True
+
+        return False
+
+    def __script_has_dom_source(self, script_url, headers, cookies):
+        """
+        (Private) Whether an external script reads a DOM source, fetching it the first
+        time it is seen.
+
+        Args:
+            script_url (str)
+            headers (dict)
+            cookies (list)
+
+        Returns:
+            (bool)
+        """
+
+        if not self.fetch_scripts:
+            return True
+
+        with self.lock:
+            if script_url in self.script_verdicts:
+                return self.script_verdicts[script_url]
+
+        try:
+            r = self.fetcher.fetch('GET', script_url, None, headers, cookies)
+            verdict = DOM_SOURCE_PATTERN.search(r.text) is not None
+        except Exception:
+            verdict = True
+
+        with self.lock:
+            self.script_verdicts[script_url] = verdict
+
+        return verdict
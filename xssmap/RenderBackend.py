@@ -0,0 +1,196 @@
+##
+## Application Security Threat Attack Modeling (ASTAM)
+##
+## Copyright (C) 2017 Applied Visions - http://securedecisions.com
+##
+## Written by Aspect Security - http://aspectsecurity.com
+##
+## Licensed under the Apache License, Version 2.0 (the "License");
+## you may not use this file except in compliance with the License.
+## You may obtain a copy of the License at
+##
+##     http://www.apache.org/licenses/LICENSE-2.0
+##
+## Unless required by applicable law or agreed to in writing, software
+## distributed under the License is distributed on an "AS IS" BASIS,
+## WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+## See the License for the specific language governing permissions and
+## limitations under the License.
+##
+
+"""
+RenderBackend.py
+"""
+
+import asyncio
+from functools import partial
+
+# What a render can return - the page's html and the Javascript events (errors, console
+# messages, alerts, confirms and prompts)
+RENDER_OUTPUTS = ['html', 'events']
+DEFAULT_RENDER_OUTPUTS = ['html', 'events']
+
+# Rendered page output keys making up 'events'
+EVENT_OUTPUT_KEYS = ['page_errors', 'page_console_messages', 'page_alerts', 'page_confirms',
+                     'page_prompts']
+
+class RenderBackend(object):
+    """
+    Interface ReflectionChecker and XssScanner render pages through. Implementations
+    are PhantomRenderClient (full browser) and StaticRenderBackend (raw HTML, no
+    Javascript); wrappers such as CachedRenderClient implement it too.
+
+    Every render returns a rendered page output object:
+
+        {
+            'page_html' : string of page's rendered html
+            'page_errors' : list of strings of javascript error()
+            'page_console_messages' : list of strings of javascript console.log()
+            'page_alerts' : list of strings of javascript alert()
+            'page_confirms' : list of strings of javascript confirm()
+            'page_prompts' : list of strings of javascript prompt()
+        }
+
+    A render asked for only some outputs (see RENDER_OUTPUTS) has only their keys -
+    'page_html' for 'html', the rest for 'events'.
+    Backends with render deadlines add 'page_timed_out', true when the output is
+    whatever had rendered by the deadline.
+
+    Each render method has a coroutine counterpart for use from an event loop. Unless a
+    backend has its own non-blocking transport, these run the blocking render in the
+    loop's default executor.
+    """
+
+    @staticmethod
+    def select_outputs(rendered_page_output, outputs):
+        """
+        Cut a full rendered page output down to the requested outputs. For backends that
+        cannot leave outputs out at the source.
+
+        Args:
+            rendered_page_output (obj)
+            outputs (list) - names from RENDER_OUTPUTS, None for DEFAULT_RENDER_OUTPUTS
+
+        Returns:
+            (obj)
+        """
+
+        if outputs is None:
+            outputs = DEFAULT_RENDER_OUTPUTS
+
+        selected = {}
+
+        if 'html' in outputs and 'page_html' in rendered_page_output:
+            selected['page_html'] = rendered_page_output['page_html']
+
+        if 'events' in outputs:
+            for key in EVENT_OUTPUT_KEYS:
+                if key in rendered_page_output:
+                    selected[key] = rendered_page_output[key]
+
+        if 'page_timed_out' in rendered_page_output:
+            selected['page_timed_out'] = rendered_page_output['page_timed_out']
+
+        return selected
+
+    def render_page(self, method, url, body, headers, cookies, pageEvents=False, outputs=None,
+                    resourcePolicy=None):
+        """
+        Render one request.
+
+        Args:
+            method (str) - 'GET' or 'POST'
+            url (str)
+            body (str) - form-encoded, for POST
+            headers (dict)
+            cookies (list)
+            pageEvents (bool) - whether to provoke page event handlers
+            outputs (list) - names from RENDER_OUTPUTS, None for DEFAULT_RENDER_OUTPUTS
+            resourcePolicy (dict) - subresources to skip, see ResourcePolicy.to_job_field
+
+        Returns:
+            (obj) - rendered page output
+        """
+
+        raise NotImplementedError()
+
+    def render_batch(self, jobs, concurrency=None):
+        """
+        Render several requests. Backends without a batch protocol render them one by
+        one.
+
+        Args:
+            jobs (list) - dicts with 'method', 'url', 'body', 'headers', 'cookies' and
+                          optionally 'pageEvents', 'outputs' and 'resourcePolicy', same
+                          as render_page arguments
+            concurrency (int) - renders to run at once, None for the backend's default
+
+        Returns:
+            (list) - one rendered page output per job, in job order
+        """
+
+        outputs = []
+
+        for job in jobs:
+            outputs.append(self.render_page(job['method'], job['url'], job.get('body'), \
+                    job.get('headers'), job.get('cookies'), job.get('pageEvents', False), \
+                    job.get('outputs'), job.get('resourcePolicy')))
+
+        return outputs
+
+    async def render_page_async(self, method, url, body, headers, cookies, pageEvents=False,
+                                outputs=None, resourcePolicy=None):
+        """
+        Coroutine counterpart of render_page.
+
+        Returns:
+            (obj) - rendered page output
+        """
+
+        return await asyncio.get_running_loop().run_in_executor(None, partial( \
+                self.render_page, method, url, body, headers, cookies, pageEvents, outputs, \
+                resourcePolicy))
+
+    async def render_batch_async(self, jobs, concurrency=None):
+        """
+        Coroutine counterpart of render_batch.
+
+        Returns:
+            (list) - one rendered page output per job, in job order
+        """
+
+        return await asyncio.get_running_loop().run_in_executor(None, partial( \
+                self.render_batch, jobs, concurrency))
+
+    def render_identity(self):
+        """
+        What tells this backend's renders apart from another's of the same request - its
+        kind, and any settings shaping the output. Renders of different identities are
+        cached apart (see CachedRenderClient).
+
+        Returns:
+            (dict)
+        """
+
+        identity = {}
+        identity['backend'] = type(self).__name__
+
+        return identity
+
+    def runs_javascript(self):
+        """
+        Whether renders run the page's Javascript, without which no XSS attack can be
+        seen to execute.
+
+        Returns:
+            (bool)
+        """
+
+        return True
+
+    def close(self):
+        """
+        Release anything held open, such as pooled connections.
+        """
+
+        pass
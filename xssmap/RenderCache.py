@@ -0,0 +1,483 @@
+##
+## Application Security Threat Attack Modeling (ASTAM)
+##
+## Copyright (C) 2017 Applied Visions - http://securedecisions.com
+##
+## Written by Aspect Security - http://aspectsecurity.com
+##
+## Licensed under the Apache License, Version 2.0 (the "License");
+## you may not use this file except in compliance with the License.
+## You may obtain a copy of the License at
+##
+##     http://www.apache.org/licenses/LICENSE-2.0
+##
+## Unless required by applicable law or agreed to in writing, software
+## distributed under the License is distributed on an "AS IS" BASIS,
+## WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+## See the License for the specific language governing permissions and
+## limitations under the License.
+##
+
+"""
+RenderCache.py
+"""
+
+from collections import OrderedDict
+import hashlib
+import json
+import os
+import threading
+import time
+
+from .RenderBackend import RenderBackend
+from .XssMapSettings import RENDER_CACHE_DISK_MAX_BYTES, RENDER_CACHE_MAX_AGE, \
+        RENDER_CACHE_MEMORY_ENTRIES
+
+class RenderCache(object):
+    """
+    Content-addressed store of rendered page outputs, keyed by a hash of the
+    normalized render request. Has an in-memory LRU tier and an optional on-disk
+    tier evicted oldest first once over its size budget. Every entry carries the time
+    it was written, and one older than max_age is not served from either tier.
+    """
+
+    def __init__(self, memory_entries=RENDER_CACHE_MEMORY_ENTRIES, disk_dir=None,
+                 disk_max_bytes=RENDER_CACHE_DISK_MAX_BYTES, max_age=RENDER_CACHE_MAX_AGE):
+        """
+        Args:
+            memory_entries (int) - max outputs held in memory
+            disk_dir (str) - directory for the on-disk tier, None for memory only
+            disk_max_bytes (int) - size budget of the on-disk tier
+            max_age (float) - seconds an output is served for after it was written, None
+                              for no limit
+        """
+
+        self.max_age = max_age
+
+        self.memory_entries = memory_entries
+        self.memory = OrderedDict()
+
+        self.disk_dir = disk_dir
+        self.disk_max_bytes = disk_max_bytes
+        self.disk_bytes = 0
+
+        self.lock = threading.Lock()
+
+        if self.disk_dir is not None:
+            if not os.path.isdir(self.disk_dir):
+                os.makedirs(self.disk_dir)
+            for path in self.__disk_entries():
+                self.disk_bytes += os.path.getsize(path)
+
+    @staticmethod
+    def make_key(method, url, body, headers, cookies, options=None):
+        """
+        Hash a render request into a cache key. Header and cookie order does not matter.
+
+        Args:
+            method (str)
+            url (str)
+            body (str)
+            headers (dict)
+            cookies (list or dict)
+            options (dict) - anything else that changes the render output
+
+        Returns:
+            (str)
+        """
+
+        if isinstance(cookies, dict):
+            cookies = list(cookies.items())
+
+        normalized = {}
+        normalized['method'] = method.upper()
+        normalized['url'] = url
+        normalized['body'] = body or ''
+        normalized['headers'] = sorted([str(k).lower(), v] for k, v in (headers or {}).items())
+        normalized['cookies'] = sorted(json.dumps(c, sort_keys=True) for c in (cookies or []))
+        normalized['options'] = options or {}
+
+        normalized_str = json.dumps(normalized, sort_keys=True)
+
+        return hashlib.sha256(normalized_str.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        """
+        Look up an output, memory first, then disk.
+
+        Args:
+            key (str)
+
+        Returns:
+            (tuple) - (output or None, name of tier it came from or None)
+        """
+
+        with self.lock:
+            if key in self.memory:
+                written, output = self.memory[key]
+                if self.__is_fresh(written):
+                    self.memory.move_to_end(key)
+                    return output, 'memory'
+                del self.memory[key]
+
+        if self.disk_dir is None:
+            return None, None
+
+        path = self.__disk_path(key)
+
+        try:
+            with open(path, 'r') as cache_file:
+                entry = json.load(cache_file)
+            written = entry['written']
+            output = entry['output']
+        except (IOError, OSError, ValueError, KeyError, TypeError):
+            return None, None
+
+        if not self.__is_fresh(written):
+            return None, None
+
+        # Touch so disk eviction sees it as recently used - the write time is in the entry
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+
+        self.__put_memory(key, written, output)
+
+        return output, 'disk'
+
+    def put(self, key, output):
+        """
+        Store an output in every tier.
+
+        Args:
+            key (str)
+            output (obj)
+        """
+
+        written = time.time()
+
+        self.__put_memory(key, written, output)
+
+        if self.disk_dir is None:
+            return
+
+        path = self.__disk_path(key)
+        directory = os.path.dirname(path)
+        if not os.path.isdir(directory):
+            os.makedirs(directory, exist_ok=True)
+
+        entry = {}
+        entry['written'] = written
+        entry['output'] = output
+
+        data = json.dumps(entry)
+
+        with self.lock:
+            old_size = os.path.getsize(path) if os.path.exists(path) else 0
+
+            # Write then rename, so readers never see half an entry
+            tmp_path = path + '.' + str(threading.get_ident()) + '.tmp'
+            with open(tmp_path, 'w') as cache_file:
+                cache_file.write(data)
+            os.replace(tmp_path, path)
+
+            self.disk_bytes += os.path.getsize(path) - old_size
+
+            if self.disk_bytes > self.disk_max_bytes:
+                self.__evict_disk()
+
+    def __is_fresh(self, written):
+        """
+        (Private) Whether an entry written at the given time may still be served.
+
+        Args:
+            written (float) - seconds since the epoch
+
+        Returns:
+            (bool)
+        """
+
+        return self.max_age is None or time.time() - written <= self.max_age
+
+    def __put_memory(self, key, written, output):
+        """
+        (Private) Store an output in the memory tier, dropping the least recently used.
+
+        Args:
+            key (str)
+            written (float) - when the output was first stored, seconds since the epoch
+            output (obj)
+        """
+
+        if self.memory_entries <= 0:
+            return
+
+        with self.lock:
+            self.memory[key] = (written, output)
+            self.memory.move_to_end(key)
+            while len(self.memory) > self.memory_entries:
+                self.memory.popitem(last=False)
+
+    def __disk_path(self, key):
+        """
+        (Private) Where an entry lives on disk, fanned out by key prefix.
+
+        Args:
+            key (str)
+
+        Returns:
+            (str)
+        """
+
+        return os.path.join(self.disk_dir, key[:2], key + '.json')
+
+    def __disk_entries(self):
+        """
+        (Private) Paths of every entry in the on-disk tier.
+
+        Returns:
+            (list)
+        """
+
+        paths = []
+
+        for root, dirs, files in os.walk(self.disk_dir):
+            for name in files:
+                if name.endswith('.json'):
+                    paths.append(os.path.join(root, name))
+
+        return paths
+
+    def __evict_disk(self):
+        """
+        (Private) Remove least recently used disk entries until under budget, with
+        some headroom so eviction does not run on every put. Caller holds the lock.
+        """
+
+        target_bytes = int(self.disk_max_bytes * 0.9)
+
+        entries = []
+        for path in self.__disk_entries():
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+        entries.sort()
+
+        self.disk_bytes = sum(entry[1] for entry in entries)
+
+        for mtime, size, path in entries:
+            if self.disk_bytes <= target_bytes:
+                break
+            try:
+                os.remove(path)
+                self.disk_bytes -= size
+            except OSError:
+                pass
+
+class CachedRenderClient(RenderBackend):
+    """
+    Puts a RenderCache in front of a render client. Counts its own hits and misses,
+    so one wrapper per scan gives per-scan numbers even when the cache is shared.
+    """
+
+    def __init__(self, renderer, cache):
+        """
+        Args:
+            renderer (RenderBackend)
+            cache (RenderCache)
+        """
+
+        self.renderer = renderer
+        self.cache = cache
+
+        # Cache keys carry the backend, so a shared or on-disk cache never serves one
+        # backend's render to another
+        self.renderer_identity = renderer.render_identity()
+
+        self.lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def stats(self):
+        """
+        Hit and miss counters for this client.
+
+        Returns:
+            (dict)
+        """
+
+        with self.lock:
+            stats = {}
+            stats['hits'] = self.memory_hits + self.disk_hits
+            stats['memory_hits'] = self.memory_hits
+            stats['disk_hits'] = self.disk_hits
+            stats['misses'] = self.misses
+
+        return stats
+
+    def render_identity(self):
+        """
+        That of the wrapped client, see RenderBackend.render_identity.
+        """
+
+        return self.renderer_identity
+
+    def runs_javascript(self):
+        """
+        That of the wrapped client, see RenderBackend.runs_javascript.
+        """
+
+        return self.renderer.runs_javascript()
+
+    def __lookup(self, key):
+        """
+        (Private) Look up a key and count the outcome.
+
+        Args:
+            key (str)
+
+        Returns:
+            (obj) - output, or None on a miss
+        """
+
+        output, tier = self.cache.get(key)
+
+        with self.lock:
+            if tier == 'memory':
+                self.memory_hits += 1
+            elif tier == 'disk':
+                self.disk_hits += 1
+            else:
+                self.misses += 1
+
+        return output
+
+    def __make_key(self, method, url, body, headers, cookies, pageEvents, outputs,
+                   resourcePolicy):
+        """
+        (Private) Cache key for a render. Renders by different backends (see
+        RenderBackend.render_identity), asking for different outputs, or under different
+        resource policies, are cached apart.
+
+        Returns:
+            (str)
+        """
+
+        options = {}
+        options['renderer'] = self.renderer_identity
+        options['pageEvents'] = pageEvents
+        if outputs is not None:
+            options['outputs'] = sorted(outputs)
+        if resourcePolicy is not None:
+            options['resourcePolicy'] = resourcePolicy
+
+        return RenderCache.make_key(method, url, body, headers, cookies, options)
+
+    def render_page(self, method, url, body, headers, cookies, pageEvents=False, outputs=None,
+                    resourcePolicy=None):
+        """
+        Same as RenderBackend.render_page, served from cache where possible.
+        """
+
+        key = self.__make_key(method, url, body, headers, cookies, pageEvents, outputs, \
+                resourcePolicy)
+
+        output = self.__lookup(key)
+        if output is None:
+            output = self.renderer.render_page(method, url, body, headers, cookies, \
+                    pageEvents, outputs, resourcePolicy)
+            self.__store(key, output)
+
+        return output
+
+    async def render_page_async(self, method, url, body, headers, cookies, pageEvents=False,
+                                outputs=None, resourcePolicy=None):
+        """
+        Same as RenderBackend.render_page_async, served from cache where possible.
+        """
+
+        key = self.__make_key(method, url, body, headers, cookies, pageEvents, outputs, \
+                resourcePolicy)
+
+        output = self.__lookup(key)
+        if output is None:
+            output = await self.renderer.render_page_async(method, url, body, headers, \
+                    cookies, pageEvents, outputs, resourcePolicy)
+            self.__store(key, output)
+
+        return output
+
+    def __store(self, key, output):
+        """
+        (Private) Cache a fresh render, unless its deadline cut it short - it might
+        finish next time.
+
+        Args:
+            key (str)
+            output (obj)
+        """
+
+        if not output.get('page_timed_out'):
+            self.cache.put(key, output)
+
+    def __lookup_batch(self, jobs):
+        """
+        (Private) Look up every job of a batch.
+
+        Args:
+            jobs (list)
+
+        Returns:
+            (tuple) - outputs (None for misses), keys and indexes of the missed jobs
+        """
+
+        outputs = [None] * len(jobs)
+        keys = []
+        missed = []
+
+        for idx, job in enumerate(jobs):
+            key = self.__make_key(job['method'], job['url'], job.get('body'), \
+                    job.get('headers'), job.get('cookies'), job.get('pageEvents', False), \
+                    job.get('outputs'), job.get('resourcePolicy'))
+            keys.append(key)
+            outputs[idx] = self.__lookup(key)
+            if outputs[idx] is None:
+                missed.append(idx)
+
+        return outputs, keys, missed
+
+    def render_batch(self, jobs, concurrency=None):
+        """
+        Same as RenderBackend.render_batch, only sending the jobs not in cache.
+        """
+
+        outputs, keys, missed = self.__lookup_batch(jobs)
+
+        if missed:
+            rendered = self.renderer.render_batch([jobs[idx] for idx in missed], concurrency)
+            for idx, output in zip(missed, rendered):
+                outputs[idx] = output
+                self.__store(keys[idx], output)
+
+        return outputs
+
+    async def render_batch_async(self, jobs, concurrency=None):
+        """
+        Same as RenderBackend.render_batch_async, only sending the jobs not in cache.
+        """
+
+        outputs, keys, missed = self.__lookup_batch(jobs)
+
+        if missed:
+            rendered = await self.renderer.render_batch_async([jobs[idx] for idx in missed], \
+                    concurrency)
+            for idx, output in zip(missed, rendered):
+                outputs[idx] = output
+                self.__store(keys[idx], output)
+
+        return outputs
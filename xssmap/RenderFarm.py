@@ -0,0 +1,183 @@
+##
+## Application Security Threat Attack Modeling (ASTAM)
+##
+## Copyright (C) 2017 Applied Visions - http://securedecisions.com
+##
+## Written by Aspect Security - http://aspectsecurity.com
+##
+## Licensed under the Apache License, Version 2.0 (the "License");
+## you may not use this file except in compliance with the License.
+## You may obtain a copy of the License at
+##
+##     http://www.apache.org/licenses/LICENSE-2.0
+##
+## Unless required by applicable law or agreed to in writing, software
+## distributed under the License is distributed on an "AS IS" BASIS,
+## WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+## See the License for the specific language governing permissions and
+## limitations under the License.
+##
+
+"""
+RenderFarm.py
+
+Launches several PhantomJS rendering engines on a port range, so renders can be
+spread across cores by PhantomRenderClient.
+
+    python -m xssmap.RenderFarm [worker_count] [first_port] [--verbose]
+"""
+
+import multiprocessing
+import socket
+import subprocess
+import sys
+import time
+
+from .XssMapSettings import PHANTOM_BINARY, PHANTOM_PAGE_MAX_REUSE, PHANTOM_PAGE_POOL_SIZE, \
+        PHANTOM_PORT, PHANTOM_SCRIPT, PHANTOM_SERVER, PHANTOM_VERBOSE
+
+class RenderFarm(object):
+    """
+    Starts and stops a set of PhantomJS rendering engine processes, one per port.
+    """
+
+    def __init__(self, worker_count=None, first_port=PHANTOM_PORT, binary=PHANTOM_BINARY,
+                 script=PHANTOM_SCRIPT, verbose=PHANTOM_VERBOSE,
+                 page_pool_size=PHANTOM_PAGE_POOL_SIZE, page_max_reuse=PHANTOM_PAGE_MAX_REUSE):
+        """
+        Args:
+            worker_count (int) - defaults to number of CPU cores
+            first_port (int) - workers listen on first_port, first_port + 1, ...
+            binary (str) - PhantomJS executable
+            script (str) - path to phantom-render.js
+            verbose (bool) - have workers log debug output, rendered pages included,
+                             to this process's stdout
+            page_pool_size (int) - idle pages each worker keeps warm
+            page_max_reuse (int) - renders per page before a worker replaces it
+        """
+
+        if worker_count is None:
+            worker_count = multiprocessing.cpu_count()
+
+        self.worker_count = worker_count
+        self.first_port = first_port
+        self.binary = binary
+        self.script = script
+        self.verbose = verbose
+        self.page_pool_size = page_pool_size
+        self.page_max_reuse = page_max_reuse
+        self.processes = []
+
+    @property
+    def addresses(self):
+        """
+        Addresses of all workers in this farm, for PhantomRenderClient.
+
+        Returns:
+            (list)
+        """
+
+        return ['http://' + PHANTOM_SERVER + ':' + str(self.first_port + i) \
+                for i in range(self.worker_count)]
+
+    def start(self, startup_timeout=10.0):
+        """
+        Launch every worker and wait for each to accept connections.
+
+        Args:
+            startup_timeout (float) - seconds to wait for each worker
+        """
+
+        for i in range(self.worker_count):
+            port = self.first_port + i
+            command = [self.binary, self.script, str(port), \
+                    '--pool-size=' + str(self.page_pool_size), \
+                    '--max-reuse=' + str(self.page_max_reuse)]
+            if self.verbose:
+                process = subprocess.Popen(command + ['--verbose'])
+            else:
+                process = subprocess.Popen(command, stdout=subprocess.DEVNULL, \
+                        stderr=subprocess.DEVNULL)
+            self.processes.append(process)
+
+        for i in range(self.worker_count):
+            port = self.first_port + i
+            if not self.__wait_for_port(port, startup_timeout):
+                self.stop()
+                raise RuntimeError('PhantomJS worker did not come up on port ' + str(port))
+
+    def stop(self):
+        """
+        Terminate every worker.
+        """
+
+        for process in self.processes:
+            if process.poll() is None:
+                process.terminate()
+
+        for process in self.processes:
+            try:
+                process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+        self.processes = []
+
+    def __wait_for_port(self, port, timeout):
+        """
+        (Private) Poll until something accepts connections on the given port.
+
+        Args:
+            port (int)
+            timeout (float)
+
+        Returns:
+            (bool)
+        """
+
+        deadline = time.time() + timeout
+
+        while time.time() < deadline:
+            try:
+                socket.create_connection((PHANTOM_SERVER, port), timeout=0.5).close()
+                return True
+            except socket.error:
+                time.sleep(0.1)
+
+        return False
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+def main():
+    worker_count = None
+    first_port = PHANTOM_PORT
+
+    args = [arg for arg in sys.argv[1:] if arg != '--verbose']
+    verbose = len(args) < len(sys.argv) - 1
+
+    if len(args) > 0:
+        worker_count = int(args[0])
+    if len(args) > 1:
+        first_port = int(args[1])
+
+    farm = RenderFarm(worker_count, first_port, verbose=verbose)
+    farm.start()
+
+    print('Render farm up at:')
+    for address in farm.addresses:
+        print('    ' + address)
+
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        farm.stop()
+
+# Run from command line
+if __name__ == '__main__':
+    main()
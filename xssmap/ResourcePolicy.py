@@ -0,0 +1,188 @@
+##
+## Application Security Threat Attack Modeling (ASTAM)
+##
+## Copyright (C) 2017 Applied Visions - http://securedecisions.com
+##
+## Written by Aspect Security - http://aspectsecurity.com
+##
+## Licensed under the Apache License, Version 2.0 (the "License");
+## you may not use this file except in compliance with the License.
+## You may obtain a copy of the License at
+##
+##     http://www.apache.org/licenses/LICENSE-2.0
+##
+## Unless required by applicable law or agreed to in writing, software
+## distributed under the License is distributed on an "AS IS" BASIS,
+## WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+## See the License for the specific language governing permissions and
+## limitations under the License.
+##
+
+"""
+ResourcePolicy.py
+"""
+
+import re
+
+from .RenderBackend import RenderBackend
+
+# Keys of a resource policy, as given in XssMap's JSON input
+RESOURCE_POLICY_FIELDS = ['block_images', 'block_stylesheets', 'block_fonts', 'allowed_origins',
+                          'blocked_url_patterns']
+
+class ResourcePolicy(object):
+    """
+    Which subresources the renderer skips while loading a page - images, stylesheets,
+    fonts, anything off a list of allowed origins (the target's own origin is always
+    allowed), or any URL matching a pattern. The page itself is always loaded.
+    """
+
+    def __init__(self, block_images=False, block_stylesheets=False, block_fonts=False,
+                 allowed_origins=None, blocked_url_patterns=None):
+        """
+        Args:
+            block_images (bool)
+            block_stylesheets (bool)
+            block_fonts (bool)
+            allowed_origins (list) - like 'https://example.com', None or empty to allow all
+            blocked_url_patterns (list) - regular expressions searched for in each URL,
+                                          run as Javascript RegExp by the renderer
+        """
+
+        self.block_images = bool(block_images)
+        self.block_stylesheets = bool(block_stylesheets)
+        self.block_fonts = bool(block_fonts)
+        self.allowed_origins = [o.rstrip('/').lower() for o in (allowed_origins or [])]
+        self.blocked_url_patterns = list(blocked_url_patterns or [])
+
+        for pattern in self.blocked_url_patterns:
+            try:
+                re.compile(pattern)
+            except re.error as e:
+                raise RuntimeError('Invalid blocked URL pattern "' + pattern + '": ' + str(e))
+
+    @staticmethod
+    def from_dict(d):
+        """
+        Build a policy from its JSON input form.
+
+        Args:
+            d (dict) - keys from RESOURCE_POLICY_FIELDS
+
+        Returns:
+            (ResourcePolicy)
+        """
+
+        for key in d:
+            if key not in RESOURCE_POLICY_FIELDS:
+                raise RuntimeError('Unrecognized resource policy field: ' + str(key))
+
+        return ResourcePolicy(**d)
+
+    def to_job_field(self):
+        """
+        The policy as the rendering engine takes it in a render job.
+
+        Returns:
+            (dict)
+        """
+
+        field = {}
+        field['blockImages'] = self.block_images
+        field['blockStylesheets'] = self.block_stylesheets
+        field['blockFonts'] = self.block_fonts
+        field['allowedOrigins'] = self.allowed_origins
+        field['blockedUrlPatterns'] = self.blocked_url_patterns
+
+        return field
+
+class ResourcePolicyRenderClient(RenderBackend):
+    """
+    Puts a resource policy on every render going through a render client.
+    """
+
+    def __init__(self, renderer, policy):
+        """
+        Args:
+            renderer (RenderBackend)
+            policy (ResourcePolicy)
+        """
+
+        self.renderer = renderer
+        self.policy = policy
+
+    def render_identity(self):
+        """
+        That of the wrapped client, see RenderBackend.render_identity. The policy travels
+        with each render instead.
+        """
+
+        return self.renderer.render_identity()
+
+    def runs_javascript(self):
+        """
+        That of the wrapped client, see RenderBackend.runs_javascript.
+        """
+
+        return self.renderer.runs_javascript()
+
+    def render_page(self, method, url, body, headers, cookies, pageEvents=False, outputs=None,
+                    resourcePolicy=None):
+        """
+        Same as RenderBackend.render_page, under this client's policy unless given one.
+        """
+
+        if resourcePolicy is None:
+            resourcePolicy = self.policy.to_job_field()
+
+        return self.renderer.render_page(method, url, body, headers, cookies, pageEvents, \
+                outputs, resourcePolicy)
+
+    def render_batch(self, jobs, concurrency=None):
+        """
+        Same as RenderBackend.render_batch, under this client's policy unless a job has
+        its own.
+        """
+
+        return self.renderer.render_batch(self.__apply_policy(jobs), concurrency)
+
+    async def render_page_async(self, method, url, body, headers, cookies, pageEvents=False,
+                                outputs=None, resourcePolicy=None):
+        """
+        Same as RenderBackend.render_page_async, under this client's policy unless given
+        one.
+        """
+
+        if resourcePolicy is None:
+            resourcePolicy = self.policy.to_job_field()
+
+        return await self.renderer.render_page_async(method, url, body, headers, cookies, \
+                pageEvents, outputs, resourcePolicy)
+
+    async def render_batch_async(self, jobs, concurrency=None):
+        """
+        Same as RenderBackend.render_batch_async, under this client's policy unless a job
+        has its own.
+        """
+
+        return await self.renderer.render_batch_async(self.__apply_policy(jobs), concurrency)
+
+    def __apply_policy(self, jobs):
+        """
+        (Private) Copies of the jobs, with this client's policy on those without one.
+
+        Args:
+            jobs (list)
+
+        Returns:
+            (list)
+        """
+
+        policy_jobs = []
+        for job in jobs:
+            job = dict(job)
+            if job.get('resourcePolicy') is None:
+                job['resourcePolicy'] = self.policy.to_job_field()
+            policy_jobs.append(job)
+
+        return policy_jobs
@@ -0,0 +1,468 @@
+##
+## Application Security Threat Attack Modeling (ASTAM)
+##
+## Copyright (C) 2017 Applied Visions - http://securedecisions.com
+##
+## Written by Aspect Security - http://aspectsecurity.com
+##
+## Licensed under the Apache License, Version 2.0 (the "License");
+## you may not use this file except in compliance with the License.
+## You may obtain a copy of the License at
+##
+##     http://www.apache.org/licenses/LICENSE-2.0
+##
+## Unless required by applicable law or agreed to in writing, software
+## distributed under the License is distributed on an "AS IS" BASIS,
+## WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+## See the License for the specific language governing permissions and
+## limitations under the License.
+##
+
+"""
+ScanCoordinator.py
+
+Breaks assessments into work units, hands them to ScanWorkers through a broker and
+puts their results back together into normal XssMap outputs.
+
+    python -m xssmap.ScanCoordinator broker.sqlite inputs.jsonl|- [outputs.jsonl|-]
+"""
+
+import json
+import sys
+import time
+import uuid
+
+from .CommandLineUtils import parse_input_object
+from .PageRenderAPI import PageRenderAPI
+from .PayloadExpander import make_payload_source
+from .PayloadStats import make_payload_stats
+from .ReflectionPrefilter import ReflectionPrefilter
+from .SqliteWorkBroker import SqliteWorkBroker
+from .StopPolicy import StopPolicy
+from .XssMap import JSON_VERSION, XSS_SKIPPED_NO_JAVASCRIPT
+from .XssMapObject import XssMapObject
+from .XssMapSettings import WORK_ATTACK_WINDOW, WORK_POLL_INTERVAL
+from .XssScanner import XssScanner
+
+class DistributedAssessment(object):
+    """
+    One assessment in flight on a ScanCoordinator. Starts with a 'probe' unit, then,
+    with reflection checking, a 'reflect' unit, then one 'attack' unit per planned
+    XSS attack. Attacks are planned as units finish, up to WORK_ATTACK_WINDOW of them
+    submitted at once, so a big payload source is never planned all at once. Each
+    finished unit moves it along; attacks the stop policy makes pointless are
+    withdrawn, or never planned.
+    """
+
+    def __init__(self, input_object):
+        """
+        Args:
+            input_object (dict) - following json/xss-tool-input.schema.json
+        """
+
+        request_type, request_url, request_body, do_reflect, do_xss, \
+                headers, cookies, scan_options = parse_input_object(JSON_VERSION, input_object)
+
+        self.target = {}
+        self.target['request_type'] = request_type
+        self.target['request_url'] = request_url
+        self.target['request_body'] = request_body
+
+        self.do_reflect = do_reflect
+        self.do_xss = do_xss
+
+        # What a worker needs to run units as this target asked
+        self.options = {}
+        self.options['do_reflect'] = do_reflect
+        self.options['prefilter'] = scan_options.get('prefilter') is True
+        self.options['renderer'] = scan_options.get('renderer')
+        self.options['resource_policy'] = scan_options.get('resource_policy')
+
+        self.stop_policy = StopPolicy(scan_options.get('stop_policy', 'none'), \
+                scan_options.get('stop_after', 1))
+
+        # Attacks are planned here, so only the coordinator reads the payload corpus
+        self.payloads = make_payload_source(scan_options.get('payloads'), \
+                scan_options.get('expand_payloads', False))
+        self.payload_stats = make_payload_stats(scan_options.get('payload_stats'))
+
+        # The character probe is part of planning, so it is sent from here as well
+        self.char_probe = None
+        if scan_options.get('char_probe') is True:
+            self.char_probe = ReflectionPrefilter()
+
+        self.output = {}
+        self.output['results'] = {}
+
+        # As in XssMap, no attack can be seen to execute on a backend running no
+        # Javascript
+        self.xss_skipped = do_xss and self.options['renderer'] is not None and \
+                not PageRenderAPI.get_shared_client(self.options['renderer']).runs_javascript()
+        if self.xss_skipped:
+            self.output['results']['xss_scan_skipped'] = XSS_SKIPPED_NO_JAVASCRIPT
+
+        self.stage = None
+        self.xss_scanner = None
+        self.scan_parameters = None
+        self.attack_plan = None
+        self.plan_exhausted = False
+        self.drawn_attacks = []
+        self.outstanding_attacks = {}
+        self.skipped_unit_ids = []
+        self.attacks_run = []
+        self.results_by_attack = {}
+
+    @property
+    def finished(self):
+        """
+        Whether the output is complete.
+
+        Returns:
+            (bool)
+        """
+
+        return self.stage == 'finished'
+
+    def start(self):
+        """
+        The first units to run.
+
+        Returns:
+            (list) - payloads
+        """
+
+        self.stage = 'probe'
+
+        payload = {}
+        payload['kind'] = 'probe'
+        payload['target'] = self.target
+        payload['options'] = self.options
+
+        return [payload]
+
+    def advance(self, unit):
+        """
+        Take in a finished unit.
+
+        Args:
+            unit (dict) - as from WorkBroker.collect_finished
+
+        Returns:
+            (list) - payloads of the units to run next, for attacks to be tied to their
+                     unit ids through track_attacks
+        """
+
+        if unit['status'] != 'done':
+            raise RuntimeError(unit['error'])
+
+        if self.stage == 'probe':
+            return self.__after_probe(XssMapObject.from_dict(unit['result']))
+        elif self.stage == 'reflect':
+            return self.__after_reflect(XssMapObject.from_dict(unit['result']))
+        elif self.stage == 'attack':
+            if unit['id'] in self.outstanding_attacks:
+                planned_attack = self.outstanding_attacks.pop(unit['id'])
+                self.results_by_attack[planned_attack['index']] = unit['result']['results']
+                self.attacks_run.append(planned_attack)
+                self.stop_policy.record(planned_attack, unit['result']['results'])
+            return self.__draw_attacks()
+
+        return []
+
+    def __after_probe(self, information_from_probe):
+        """
+        (Private) Next units once the target is probed.
+
+        Args:
+            information_from_probe (XssMapObject)
+
+        Returns:
+            (list)
+        """
+
+        if self.do_xss and not self.do_reflect:
+            if self.xss_skipped:
+                self.stage = 'finished'
+                return []
+            return self.__plan(XssMapObject.scan_all_params(information_from_probe, \
+                    information_from_probe.params_other))
+
+        self.stage = 'reflect'
+
+        payload = {}
+        payload['kind'] = 'reflect'
+        payload['scan_parameters'] = information_from_probe.to_dict()
+        payload['options'] = self.options
+
+        return [payload]
+
+    def __after_reflect(self, reflect_check_res):
+        """
+        (Private) Record reflection results, then plan attacks if there is anything to
+        attack.
+
+        Args:
+            reflect_check_res (XssMapObject)
+
+        Returns:
+            (list)
+        """
+
+        self.output['request_url_root'] = reflect_check_res.request_url_root
+        self.output['request_type'] = reflect_check_res.request_type
+
+        self.output['results']['reflection_check'] = {}
+        self.output['results']['reflection_check']['params_reflected'] = \
+                reflect_check_res.params_reflected
+        self.output['results']['reflection_check']['params_other'] = \
+                reflect_check_res.params_other
+
+        if reflect_check_res.params_reflected and self.do_xss and not self.xss_skipped:
+            return self.__plan(reflect_check_res)
+
+        self.stage = 'finished'
+
+        return []
+
+    def __plan(self, scan_parameters):
+        """
+        (Private) One 'attack' unit per planned attack on the given scan parameters.
+
+        Args:
+            scan_parameters (XssMapObject)
+
+        Returns:
+            (list)
+        """
+
+        self.stage = 'attack'
+        self.xss_scanner = XssScanner(scan_parameters, payloads=self.payloads, \
+                payload_stats=self.payload_stats, char_probe=self.char_probe)
+        self.scan_parameters = scan_parameters.to_dict()
+        self.attack_plan = self.xss_scanner.plan_attacks(self.stop_policy)
+
+        return self.__draw_attacks()
+
+    def __draw_attacks(self):
+        """
+        (Private) Withdraw the outstanding attacks the stop policy made pointless, then
+        plan attacks until WORK_ATTACK_WINDOW are outstanding or the plan runs out.
+
+        Returns:
+            (list) - payloads of the 'attack' units to run next
+        """
+
+        self.__drop_skippable()
+
+        payloads = []
+
+        while not self.plan_exhausted and \
+                len(self.outstanding_attacks) + len(self.drawn_attacks) < WORK_ATTACK_WINDOW:
+            planned_attack = next(self.attack_plan, None)
+            if planned_attack is None:
+                self.plan_exhausted = True
+                break
+
+            attack = {}
+            attack['index'] = planned_attack['index']
+            attack['param'] = planned_attack['param']['name']
+            attack['trigger'] = planned_attack['trigger']
+            attack['attack'] = planned_attack['attack']
+
+            payload = {}
+            payload['kind'] = 'attack'
+            payload['scan_parameters'] = self.scan_parameters
+            payload['attack'] = attack
+            payload['options'] = self.options
+            payloads.append(payload)
+
+            self.drawn_attacks.append(planned_attack)
+
+        return payloads
+
+    def track_attacks(self, unit_ids):
+        """
+        Tie the units just submitted for planned attacks to them, in the order they were
+        planned.
+
+        Args:
+            unit_ids (list)
+        """
+
+        if self.stage != 'attack':
+            return
+
+        for unit_id, planned_attack in zip(unit_ids, self.drawn_attacks):
+            self.outstanding_attacks[unit_id] = planned_attack
+        self.drawn_attacks = []
+
+        self.__finish_if_attacked()
+
+    def __drop_skippable(self):
+        """
+        (Private) Stop waiting on outstanding attack units the stop policy says need not
+        run, keeping their ids for skippable_units.
+        """
+
+        skippable = [unit_id for unit_id, planned_attack in self.outstanding_attacks.items() \
+                if self.stop_policy.should_skip(planned_attack)]
+
+        for unit_id in skippable:
+            del self.outstanding_attacks[unit_id]
+
+        self.skipped_unit_ids.extend(skippable)
+
+    def skippable_units(self):
+        """
+        Outstanding attack units the stop policy says need not run, no longer waited on.
+
+        Returns:
+            (list) - unit ids
+        """
+
+        self.__drop_skippable()
+
+        skippable = self.skipped_unit_ids
+        self.skipped_unit_ids = []
+
+        self.__finish_if_attacked()
+
+        return skippable
+
+    def __finish_if_attacked(self):
+        """
+        (Private) Once the plan is run out and no attack is outstanding, put the findings
+        in the output.
+        """
+
+        if self.stage != 'attack' or not self.plan_exhausted or self.outstanding_attacks:
+            return
+
+        self.attacks_run.sort(key=lambda planned_attack: planned_attack['index'])
+        self.xss_scanner.record_outcomes(self.attacks_run, self.results_by_attack)
+
+        self.output['results']['xss_scan'] = self.stop_policy.select(self.attacks_run, \
+                self.results_by_attack)
+        self.stage = 'finished'
+
+class ScanCoordinator(object):
+    """
+    Runs assessments on ScanWorkers through a WorkBroker, all at once, so scans are
+    bound by the number of workers rather than one renderer host. Outputs match what
+    XssMap gives for the same inputs; the options that shape how one process renders
+    (concurrency, batch, cache) do not apply, as every attack is its own
+    unit, and neither do render addresses, as each worker renders on its own engines.
+    """
+
+    def __init__(self, broker, poll_interval=WORK_POLL_INTERVAL):
+        """
+        Args:
+            broker (WorkBroker)
+            poll_interval (float) - seconds between checks for finished units
+        """
+
+        self.broker = broker
+        self.poll_interval = poll_interval
+        self.coordinator_id = uuid.uuid4().hex
+
+    def assess_all(self, input_lines):
+        """
+        Assess every JSON input, one per line, skipping blank lines. As in run_bulk, an
+        input that fails, including one that isn't valid JSON, gets an output with an
+        "error" field and its line number.
+
+        Args:
+            input_lines (iterable) - lines following json/xss-tool-input.schema.json
+
+        Returns:
+            (list) - outputs, in input order
+        """
+
+        numbered_lines = [(line_number, line.strip()) \
+                for line_number, line in enumerate(input_lines, 1) if line.strip()]
+        outputs = [None] * len(numbered_lines)
+        assessments = {}
+
+        for idx, (line_number, line) in enumerate(numbered_lines):
+            scan_id = self.coordinator_id + '-' + str(idx)
+            try:
+                assessment = DistributedAssessment(json.loads(line))
+                self.broker.submit(self.coordinator_id, scan_id, assessment.start())
+                assessments[scan_id] = (idx, assessment)
+            except Exception as e:
+                outputs[idx] = self.__error_output(line_number, e)
+
+        while assessments:
+            finished_units = self.broker.collect_finished(self.coordinator_id)
+            if not finished_units:
+                time.sleep(self.poll_interval)
+                continue
+
+            for unit in finished_units:
+                if unit['scan_id'] not in assessments:
+                    continue
+                idx, assessment = assessments[unit['scan_id']]
+
+                try:
+                    payloads = assessment.advance(unit)
+                    unit_ids = []
+                    if payloads:
+                        unit_ids = self.broker.submit(self.coordinator_id, unit['scan_id'], \
+                                payloads)
+                    # Called even with no units, a scan with nothing to attack is done
+                    assessment.track_attacks(unit_ids)
+                    self.broker.cancel(assessment.skippable_units())
+                except Exception as e:
+                    outputs[idx] = self.__error_output(numbered_lines[idx][0], e)
+                else:
+                    if not assessment.finished:
+                        continue
+                    outputs[idx] = assessment.output
+
+                del assessments[unit['scan_id']]
+                self.broker.purge(unit['scan_id'])
+
+        return outputs
+
+    def __error_output(self, line_number, error):
+        """
+        (Private) Output for an input that failed.
+
+        Args:
+            line_number (int) - the input's line, counting from 1
+            error (Exception)
+
+        Returns:
+            (obj)
+        """
+
+        output_data = {}
+        output_data['line'] = line_number
+        output_data['error'] = str(error)
+
+        return output_data
+
+def main():
+    if len(sys.argv) < 3 or len(sys.argv) > 4:
+        print('usage : python -m xssmap.ScanCoordinator broker.sqlite ' \
+                'inputs.jsonl|- [outputs.jsonl|-]')
+        return
+
+    input_stream = sys.stdin if sys.argv[2] == '-' else open(sys.argv[2])
+    output_stream = sys.stdout
+    if len(sys.argv) == 4 and sys.argv[3] != '-':
+        output_stream = open(sys.argv[3], 'w')
+
+    try:
+        outputs = ScanCoordinator(SqliteWorkBroker(sys.argv[1])).assess_all(input_stream)
+        for output_data in outputs:
+            output_stream.write(json.dumps(output_data) + '\n')
+    finally:
+        if input_stream is not sys.stdin:
+            input_stream.close()
+        if output_stream is not sys.stdout:
+            output_stream.close()
+
+# Run from command line
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,366 @@
+##
+## Application Security Threat Attack Modeling (ASTAM)
+##
+## Copyright (C) 2017 Applied Visions - http://securedecisions.com
+##
+## Written by Aspect Security - http://aspectsecurity.com
+##
+## Licensed under the Apache License, Version 2.0 (the "License");
+## you may not use this file except in compliance with the License.
+## You may obtain a copy of the License at
+##
+##     http://www.apache.org/licenses/LICENSE-2.0
+##
+## Unless required by applicable law or agreed to in writing, software
+## distributed under the License is distributed on an "AS IS" BASIS,
+## WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+## See the License for the specific language governing permissions and
+## limitations under the License.
+##
+
+"""
+ScanService.py
+
+Resident scan service - a local HTTP/JSON API that queues scan jobs and runs them on a
+pool of scan threads, so scans skip process startup and share one warm render client.
+
+    POST /jobs        body is one input object (json/xss-tool-input.schema.json),
+                      answers 202 with {"id", "status"}
+    GET  /jobs/<id>   {"id", "status"}, plus "output" (json/xss-tool-output.schema.json)
+                      once "done" or "error" once "failed"
+    GET  /jobs        {"jobs"} - id and status of every job kept
+    DELETE /jobs/<id> forget a finished job
+
+Status goes "queued", "running", then "done" or "failed".
+"""
+
+from collections import deque
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import json
+import queue
+import re
+from socketserver import ThreadingMixIn
+import threading
+import uuid
+
+from .XssMapSettings import SCAN_SERVICE_HOST, SCAN_SERVICE_MAX_FINISHED_JOBS, \
+        SCAN_SERVICE_PORT, SCAN_SERVICE_WORKERS
+
+JOB_PATH_PATTERN = re.compile(r'^/jobs/([0-9a-f]+)/?$')
+
+class ScanServiceHandler(BaseHTTPRequestHandler):
+    """
+    HTTP front end of a ScanService.
+    """
+
+    protocol_version = 'HTTP/1.1'
+
+    def __respond(self, status, response):
+        """
+        (Private) Send a JSON response.
+
+        Args:
+            status (int)
+            response (obj)
+        """
+
+        body = json.dumps(response).encode('utf-8')
+
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def __respond_error(self, status, message):
+        """
+        (Private) Send a JSON error response.
+
+        Args:
+            status (int)
+            message (str)
+        """
+
+        response = {}
+        response['error'] = message
+
+        self.__respond(status, response)
+
+    def do_GET(self):
+        service = self.server.service
+
+        if self.path.rstrip('/') == '/jobs':
+            response = {}
+            response['jobs'] = service.list_jobs()
+            self.__respond(200, response)
+            return
+
+        match = JOB_PATH_PATTERN.match(self.path)
+        job = service.get_job(match.group(1)) if match else None
+        if job is None:
+            self.__respond_error(404, 'No such job')
+            return
+
+        self.__respond(200, job)
+
+    def do_POST(self):
+        if self.path.rstrip('/') != '/jobs':
+            self.__respond_error(404, 'Jobs are submitted to /jobs')
+            return
+
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            if length < 0:
+                raise ValueError(length)
+        except ValueError:
+            # The body cannot be told from the next request, so drop the connection
+            self.close_connection = True
+            self.__respond_error(400, 'Invalid Content-Length header')
+            return
+
+        try:
+            job_input = json.loads(self.rfile.read(length).decode('utf-8'))
+            job_id = self.server.service.submit(job_input)
+        except (ValueError, RuntimeError, KeyError, TypeError) as e:
+            self.__respond_error(400, 'Invalid job input: ' + str(e))
+            return
+
+        self.__respond(202, self.server.service.get_job(job_id))
+
+    def do_DELETE(self):
+        match = JOB_PATH_PATTERN.match(self.path)
+        job = self.server.service.get_job(match.group(1)) if match else None
+        if job is None:
+            self.__respond_error(404, 'No such job')
+            return
+
+        if not self.server.service.forget_job(job['id']):
+            self.__respond_error(409, 'Job has not finished')
+            return
+
+        self.__respond(200, job)
+
+    def log_message(self, format, *args):
+        pass
+
+class ScanServiceServer(ThreadingMixIn, HTTPServer):
+    """
+    Threaded HTTP server holding the ScanService it fronts.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address, service):
+        HTTPServer.__init__(self, address, ScanServiceHandler)
+
+        self.service = service
+
+class ScanService(object):
+    """
+    Queue of scan jobs run by a fixed pool of scan threads, with an HTTP/JSON API to
+    submit jobs and poll for their results (see the module docstring). Jobs run in
+    the order submitted. Finished jobs are kept for polling until forgotten, or until
+    too many have finished since, oldest first.
+    """
+
+    def __init__(self, run_job, validate_job=None, host=SCAN_SERVICE_HOST,
+                 port=SCAN_SERVICE_PORT, workers=SCAN_SERVICE_WORKERS,
+                 max_finished_jobs=SCAN_SERVICE_MAX_FINISHED_JOBS):
+        """
+        Args:
+            run_job (function) - takes a job input, returns its output
+            validate_job (function) - takes a job input, raises on one not worth queueing
+            host (str)
+            port (int) - 0 picks a free port
+            workers (int) - jobs to run at once
+            max_finished_jobs (int) - finished jobs kept for polling
+        """
+
+        self.run_job = run_job
+        self.validate_job = validate_job
+        self.host = host
+        self.port = port
+        self.workers = max(1, workers)
+        self.max_finished_jobs = max_finished_jobs
+
+        self.jobs = {}
+        self.finished = deque()
+        self.pending = queue.Queue()
+        self.lock = threading.Lock()
+
+        self.server = None
+        self.threads = []
+        self.stopped = threading.Event()
+
+    @property
+    def address(self):
+        """
+        Base URL of the running service.
+
+        Returns:
+            (str)
+        """
+
+        return 'http://' + self.host + ':' + str(self.server.server_address[1])
+
+    def start(self):
+        """
+        Start the scan threads and the HTTP server, each in the background.
+        """
+
+        self.server = ScanServiceServer((self.host, self.port), self)
+
+        for _ in range(self.workers):
+            thread = threading.Thread(target=self.__work)
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.threads.append(thread)
+
+    def wait(self):
+        """
+        Block until the service is stopped.
+        """
+
+        # Waiting in short slices keeps the main thread responsive to KeyboardInterrupt
+        while not self.stopped.wait(1):
+            pass
+
+    def stop(self):
+        """
+        Stop taking requests and stop the scan threads once their current jobs are done.
+        Jobs still queued are left unrun.
+        """
+
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+
+        for _ in range(self.workers):
+            self.pending.put(None)
+
+        self.stopped.set()
+
+    def submit(self, job_input):
+        """
+        Queue a job.
+
+        Args:
+            job_input (obj)
+
+        Returns:
+            (str) - job id
+        """
+
+        if not isinstance(job_input, dict):
+            raise RuntimeError('A job input is a JSON object.')
+
+        if self.validate_job is not None:
+            self.validate_job(job_input)
+
+        job = {}
+        job['id'] = uuid.uuid4().hex
+        job['status'] = 'queued'
+
+        with self.lock:
+            self.jobs[job['id']] = job
+
+        self.pending.put((job['id'], job_input))
+
+        return job['id']
+
+    def get_job(self, job_id):
+        """
+        A job's status, and its output or error once finished.
+
+        Args:
+            job_id (str)
+
+        Returns:
+            (dict) - None for an unknown job
+        """
+
+        with self.lock:
+            job = self.jobs.get(job_id)
+            return dict(job) if job is not None else None
+
+    def list_jobs(self):
+        """
+        Id and status of every job kept.
+
+        Returns:
+            (list)
+        """
+
+        with self.lock:
+            return [{'id': job['id'], 'status': job['status']} for job in self.jobs.values()]
+
+    def forget_job(self, job_id):
+        """
+        Drop a finished job.
+
+        Args:
+            job_id (str)
+
+        Returns:
+            (bool) - False if the job is unknown or not finished
+        """
+
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is None or job['status'] not in ('done', 'failed'):
+                return False
+            del self.jobs[job_id]
+            self.finished.remove(job_id)
+
+        return True
+
+    def __work(self):
+        """
+        (Private) Scan thread - run queued jobs until handed the stop sentinel.
+        """
+
+        while True:
+            item = self.pending.get()
+            if item is None:
+                return
+
+            job_id, job_input = item
+
+            with self.lock:
+                if job_id not in self.jobs:
+                    continue
+                self.jobs[job_id]['status'] = 'running'
+
+            result = {}
+            try:
+                result['output'] = self.run_job(job_input)
+                result['status'] = 'done'
+            except Exception as e:
+                result['error'] = str(e)
+                result['status'] = 'failed'
+
+            self.__finish(job_id, result)
+
+    def __finish(self, job_id, result):
+        """
+        (Private) Record a job's result and drop the oldest finished jobs beyond the
+        number kept.
+
+        Args:
+            job_id (str)
+            result (dict) - 'status' and 'output' or 'error'
+        """
+
+        with self.lock:
+            if job_id not in self.jobs:
+                return
+            self.jobs[job_id].update(result)
+
+            self.finished.append(job_id)
+            while len(self.finished) > self.max_finished_jobs:
+                self.jobs.pop(self.finished.popleft(), None)
@@ -0,0 +1,284 @@
+##
+## Application Security Threat Attack Modeling (ASTAM)
+##
+## Copyright (C) 2017 Applied Visions - http://securedecisions.com
+##
+## Written by Aspect Security - http://aspectsecurity.com
+##
+## Licensed under the Apache License, Version 2.0 (the "License");
+## you may not use this file except in compliance with the License.
+## You may obtain a copy of the License at
+##
+##     http://www.apache.org/licenses/LICENSE-2.0
+##
+## Unless required by applicable law or agreed to in writing, software
+## distributed under the License is distributed on an "AS IS" BASIS,
+## WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+## See the License for the specific language governing permissions and
+## limitations under the License.
+##
+
+"""
+ScanWorker.py
+
+Pulls work units a ScanCoordinator put in a broker, runs them with a local render
+client and posts the results back. Start as many as there are rendering engines to
+keep busy, on any machine that reaches the broker.
+
+    python -m xssmap.ScanWorker broker.sqlite [engine_address ...]
+"""
+
+import socket
+import sys
+import threading
+import uuid
+
+from .PageRenderAPI import PageRenderAPI, PhantomRenderClient
+from .ReflectionChecker import ReflectionChecker
+from .ReflectionPrefilter import ReflectionPrefilter
+from .RequestVariableProbe import RequestVariableProbe
+from .ResourcePolicy import ResourcePolicy, ResourcePolicyRenderClient
+from .SqliteWorkBroker import SqliteWorkBroker
+from .XssMapObject import XssMapObject
+from .XssMapSettings import WORK_POLL_INTERVAL, WORK_UNIT_LEASE_SECONDS
+from .XssScanner import XssScanner
+
+class ScanWorker(object):
+    """
+    Runs work units from a WorkBroker, one at a time. Units are one of
+
+        'probe' - find a target's parameters, without reflection checking also
+                  prefiltering them when asked
+        'reflect' - check probed parameters for reflection
+        'attack' - render one planned XSS attack on one parameter
+
+    and their payloads carry everything needed to run them (see ScanCoordinator).
+    """
+
+    def __init__(self, broker, renderer=None, worker_id=None,
+                 lease_seconds=WORK_UNIT_LEASE_SECONDS, poll_interval=WORK_POLL_INTERVAL):
+        """
+        Args:
+            broker (WorkBroker)
+            renderer (RenderBackend) - the shared one if none is given
+            worker_id (str) - defaults to host name plus a random suffix
+            lease_seconds (float)
+            poll_interval (float) - seconds to wait when there is nothing to do
+        """
+
+        if renderer is None:
+            renderer = PageRenderAPI.get_shared_client()
+        if worker_id is None:
+            worker_id = socket.gethostname() + '-' + uuid.uuid4().hex[:8]
+
+        self.broker = broker
+        self.renderer = renderer
+        self.worker_id = worker_id
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+
+        self.prefilter = None
+        self.stopped = threading.Event()
+
+    def stop(self):
+        """
+        Have run_forever return once the unit at hand is done.
+        """
+
+        self.stopped.set()
+
+    def run_forever(self):
+        """
+        Run units until stopped, waiting when there are none.
+        """
+
+        while not self.stopped.is_set():
+            if not self.run_one():
+                self.stopped.wait(self.poll_interval)
+
+    def run_one(self):
+        """
+        Claim and run one unit, posting its result or error.
+
+        Returns:
+            (bool) - False if there was nothing to do
+        """
+
+        claimed = self.broker.claim(self.worker_id, self.lease_seconds)
+        if claimed is None:
+            return False
+
+        unit_id, payload = claimed
+
+        try:
+            result = self.execute_unit(payload)
+        except Exception as e:
+            self.broker.fail(unit_id, str(e))
+        else:
+            self.broker.complete(unit_id, result)
+
+        return True
+
+    def execute_unit(self, payload):
+        """
+        Run one unit.
+
+        Args:
+            payload (dict)
+
+        Returns:
+            (obj) - result to post
+        """
+
+        kind = payload['kind']
+
+        if kind == 'probe':
+            return self.__probe(payload)
+        elif kind == 'reflect':
+            return self.__reflect(payload)
+        elif kind == 'attack':
+            return self.__attack(payload)
+
+        raise RuntimeError('Unrecognized work unit kind: ' + str(kind))
+
+    def __renderer_for(self, options):
+        """
+        (Private) Render client a unit asks for - a named shared backend or this
+        worker's, under its resource policy if it has one.
+
+        Args:
+            options (dict)
+
+        Returns:
+            (RenderBackend)
+        """
+
+        renderer = self.renderer
+        if options.get('renderer') is not None:
+            renderer = PageRenderAPI.get_shared_client(options['renderer'])
+
+        if options.get('resource_policy') is not None:
+            policy = ResourcePolicy.from_dict(options['resource_policy'])
+            renderer = ResourcePolicyRenderClient(renderer, policy)
+
+        return renderer
+
+    def __prefilter_for(self, options):
+        """
+        (Private) The worker's ReflectionPrefilter if a unit asks for prefiltering,
+        created on first use.
+
+        Args:
+            options (dict)
+
+        Returns:
+            (ReflectionPrefilter)
+        """
+
+        if not options.get('prefilter'):
+            return None
+
+        if self.prefilter is None:
+            self.prefilter = ReflectionPrefilter()
+
+        return self.prefilter
+
+    def __probe(self, payload):
+        """
+        (Private) Run a 'probe' unit.
+
+        Args:
+            payload (dict) - 'target' with 'request_type', 'request_url' and
+                             'request_body', and 'options'
+
+        Returns:
+            (dict) - probed XssMapObject
+        """
+
+        target = payload['target']
+        options = payload['options']
+
+        if target['request_type'] == 'GET':
+            information_from_probe = RequestVariableProbe.probe_GET_request( \
+                    target['request_url'])
+        elif target['request_type'] == 'POST':
+            information_from_probe = RequestVariableProbe.probe_POST_request( \
+                    target['request_url'], target['request_body'])
+        else:
+            raise RuntimeError('Unsupported request type: ' + str(target['request_type']))
+
+        prefilter = self.__prefilter_for(options)
+        if prefilter is not None and not options.get('do_reflect', True):
+            checker = ReflectionChecker(information_from_probe, \
+                    self.__renderer_for(options), None, prefilter)
+            information_from_probe.params_other = checker.find_candidate_params()
+
+        return information_from_probe.to_dict()
+
+    def __reflect(self, payload):
+        """
+        (Private) Run a 'reflect' unit.
+
+        Args:
+            payload (dict) - 'scan_parameters', a probed XssMapObject, and 'options'
+
+        Returns:
+            (dict) - XssMapObject after reflection checking
+        """
+
+        options = payload['options']
+
+        checker = ReflectionChecker(XssMapObject.from_dict(payload['scan_parameters']), \
+                self.__renderer_for(options), None, self.__prefilter_for(options))
+
+        return checker.run().to_dict()
+
+    def __attack(self, payload):
+        """
+        (Private) Run an 'attack' unit.
+
+        Args:
+            payload (dict) - 'scan_parameters', 'attack' (a planned attack with the
+                             parameter's name under 'param') and 'options'
+
+        Returns:
+            (dict) - findings under 'results'
+        """
+
+        scanner = XssScanner(XssMapObject.from_dict(payload['scan_parameters']), \
+                self.__renderer_for(payload['options']))
+
+        planned_attack = dict(payload['attack'])
+        for param in scanner.params_reflected:
+            if param['name'] == planned_attack['param']:
+                planned_attack['param'] = param
+                break
+        else:
+            raise RuntimeError('Attacked parameter is not among the reflected ones.')
+
+        result = {}
+        result['results'] = scanner.run_attack(planned_attack)
+
+        return result
+
+def main():
+    if len(sys.argv) < 2:
+        print('usage : python -m xssmap.ScanWorker broker.sqlite [engine_address ...]')
+        return
+
+    renderer = None
+    if len(sys.argv) > 2:
+        renderer = PhantomRenderClient(sys.argv[2:])
+
+    worker = ScanWorker(SqliteWorkBroker(sys.argv[1]), renderer)
+
+    print('Scan worker ' + worker.worker_id + ' pulling from ' + sys.argv[1])
+
+    try:
+        worker.run_forever()
+    except KeyboardInterrupt:
+        worker.stop()
+
+# Run from command line
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,224 @@
+##
+## Application Security Threat Attack Modeling (ASTAM)
+##
+## Copyright (C) 2017 Applied Visions - http://securedecisions.com
+##
+## Written by Aspect Security - http://aspectsecurity.com
+##
+## Licensed under the Apache License, Version 2.0 (the "License");
+## you may not use this file except in compliance with the License.
+## You may obtain a copy of the License at
+##
+##     http://www.apache.org/licenses/LICENSE-2.0
+##
+## Unless required by applicable law or agreed to in writing, software
+## distributed under the License is distributed on an "AS IS" BASIS,
+## WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+## See the License for the specific language governing permissions and
+## limitations under the License.
+##
+
+"""
+SqliteWorkBroker.py
+"""
+
+import json
+import sqlite3
+import time
+
+from .WorkBroker import WorkBroker
+from .XssMapSettings import WORK_UNIT_MAX_ATTEMPTS
+
+# Enough to fit under SQLite's limit on query parameters
+SQLITE_MAX_IDS_PER_QUERY = 500
+
+class SqliteWorkBroker(WorkBroker):
+    """
+    WorkBroker keeping its units in one SQLite database file. Coordinators and workers
+    on one machine, or sharing a filesystem with working locks, each open the same
+    file. Every operation uses its own short transaction, so one broker object is safe
+    to share between threads.
+    """
+
+    def __init__(self, path, max_attempts=WORK_UNIT_MAX_ATTEMPTS):
+        """
+        Args:
+            path (str) - database file, created if missing
+            max_attempts (int) - claims of a unit before it fails
+        """
+
+        self.path = path
+        self.max_attempts = max_attempts
+
+        connection = self.__connect()
+        try:
+            connection.execute('CREATE TABLE IF NOT EXISTS work_units (' \
+                    'id INTEGER PRIMARY KEY AUTOINCREMENT, ' \
+                    'owner TEXT NOT NULL, ' \
+                    'scan_id TEXT NOT NULL, ' \
+                    'payload TEXT NOT NULL, ' \
+                    'status TEXT NOT NULL, ' \
+                    'worker_id TEXT, ' \
+                    'lease_until REAL, ' \
+                    'attempts INTEGER NOT NULL DEFAULT 0, ' \
+                    'result TEXT, ' \
+                    'error TEXT, ' \
+                    'collected INTEGER NOT NULL DEFAULT 0)')
+            connection.execute('CREATE INDEX IF NOT EXISTS work_units_status ' \
+                    'ON work_units (status, id)')
+            connection.execute('CREATE INDEX IF NOT EXISTS work_units_owner ' \
+                    'ON work_units (owner, collected)')
+        finally:
+            connection.close()
+
+    def __connect(self):
+        """
+        (Private) Open a connection in autocommit mode, transactions begun explicitly.
+
+        Returns:
+            (sqlite3.Connection)
+        """
+
+        return sqlite3.connect(self.path, timeout=30, isolation_level=None)
+
+    def __transaction(self, work):
+        """
+        (Private) Run work(connection) in a write transaction and return what it returns.
+
+        Args:
+            work (function)
+
+        Returns:
+            (obj)
+        """
+
+        connection = self.__connect()
+
+        try:
+            # Taking the write lock up front keeps two claims from picking the same unit
+            connection.execute('BEGIN IMMEDIATE')
+            try:
+                value = work(connection)
+            except Exception:
+                connection.execute('ROLLBACK')
+                raise
+            connection.execute('COMMIT')
+            return value
+        finally:
+            connection.close()
+
+    def submit(self, owner, scan_id, payloads):
+        """
+        See WorkBroker.submit.
+        """
+
+        def insert(connection):
+            unit_ids = []
+            for payload in payloads:
+                cursor = connection.execute('INSERT INTO work_units ' \
+                        '(owner, scan_id, payload, status) VALUES (?, ?, ?, ?)', \
+                        (owner, scan_id, json.dumps(payload), 'pending'))
+                unit_ids.append(cursor.lastrowid)
+            return unit_ids
+
+        return self.__transaction(insert)
+
+    def claim(self, worker_id, lease_seconds):
+        """
+        See WorkBroker.claim.
+        """
+
+        def take(connection):
+            now = time.time()
+            while True:
+                row = connection.execute('SELECT id, payload, attempts FROM work_units ' \
+                        'WHERE status = ? OR (status = ? AND lease_until < ?) ' \
+                        'ORDER BY id LIMIT 1', ('pending', 'claimed', now)).fetchone()
+                if row is None:
+                    return None
+
+                unit_id, payload, attempts = row
+
+                if attempts >= self.max_attempts:
+                    connection.execute('UPDATE work_units SET status = ?, error = ? ' \
+                            'WHERE id = ?', ('failed', 'Gave up after ' + str(attempts) + \
+                            ' attempts', unit_id))
+                    continue
+
+                connection.execute('UPDATE work_units SET status = ?, worker_id = ?, ' \
+                        'lease_until = ?, attempts = ? WHERE id = ?', ('claimed', worker_id, \
+                        now + lease_seconds, attempts + 1, unit_id))
+                return unit_id, json.loads(payload)
+
+        return self.__transaction(take)
+
+    def complete(self, unit_id, result):
+        """
+        See WorkBroker.complete. A result for a unit no longer claimed, say one
+        cancelled meanwhile, is dropped.
+        """
+
+        self.__transaction(lambda connection: connection.execute('UPDATE work_units ' \
+                'SET status = ?, result = ? WHERE id = ? AND status = ?', \
+                ('done', json.dumps(result), unit_id, 'claimed')))
+
+    def fail(self, unit_id, error):
+        """
+        See WorkBroker.fail.
+        """
+
+        self.__transaction(lambda connection: connection.execute('UPDATE work_units ' \
+                'SET status = ?, error = ? WHERE id = ? AND status = ?', \
+                ('failed', error, unit_id, 'claimed')))
+
+    def cancel(self, unit_ids):
+        """
+        See WorkBroker.cancel.
+        """
+
+        def withdraw(connection):
+            for start in range(0, len(unit_ids), SQLITE_MAX_IDS_PER_QUERY):
+                chunk = list(unit_ids[start:start + SQLITE_MAX_IDS_PER_QUERY])
+                placeholders = ', '.join('?' * len(chunk))
+                connection.execute('UPDATE work_units SET status = ? WHERE status = ? ' \
+                        'AND id IN (' + placeholders + ')', ['cancelled', 'pending'] + chunk)
+
+        if unit_ids:
+            self.__transaction(withdraw)
+
+    def collect_finished(self, owner):
+        """
+        See WorkBroker.collect_finished.
+        """
+
+        def collect(connection):
+            rows = connection.execute('SELECT id, scan_id, status, result, error ' \
+                    'FROM work_units WHERE owner = ? AND collected = 0 ' \
+                    'AND status IN (?, ?) ORDER BY id', (owner, 'done', 'failed')).fetchall()
+
+            finished = []
+            for unit_id, scan_id, status, result, error in rows:
+                unit = {}
+                unit['id'] = unit_id
+                unit['scan_id'] = scan_id
+                unit['status'] = status
+                if status == 'done':
+                    unit['result'] = json.loads(result)
+                else:
+                    unit['error'] = error
+                finished.append(unit)
+
+                connection.execute('UPDATE work_units SET collected = 1 WHERE id = ?', \
+                        (unit_id,))
+
+            return finished
+
+        return self.__transaction(collect)
+
+    def purge(self, scan_id):
+        """
+        See WorkBroker.purge.
+        """
+
+        self.__transaction(lambda connection: connection.execute('DELETE FROM work_units ' \
+                'WHERE scan_id = ?', (scan_id,)))
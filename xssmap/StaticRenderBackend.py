@@ -0,0 +1,115 @@
+##
+## Application Security Threat Attack Modeling (ASTAM)
+##
+## Copyright (C) 2017 Applied Visions - http://securedecisions.com
+##
+## Written by Aspect Security - http://aspectsecurity.com
+##
+## Licensed under the Apache License, Version 2.0 (the "License");
+## you may not use this file except in compliance with the License.
+## You may obtain a copy of the License at
+##
+##     http://www.apache.org/licenses/LICENSE-2.0
+##
+## Unless required by applicable law or agreed to in writing, software
+## distributed under the License is distributed on an "AS IS" BASIS,
+## WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+## See the License for the specific language governing permissions and
+## limitations under the License.
+##
+
+"""
+StaticRenderBackend.py
+"""
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from .RenderBackend import RenderBackend
+from .XssMapSettings import PHANTOM_POOL_MAXSIZE, STATIC_RENDER_TIMEOUT
+
+class StaticRenderBackend(RenderBackend):
+    """
+    Renders pages by fetching their raw HTML over plain HTTP, without running any
+    Javascript - so every event list comes back empty. Enough to find reflection
+    in server-rendered markup, in milliseconds and without a browser.
+    """
+
+    def __init__(self, pool_maxsize=PHANTOM_POOL_MAXSIZE, timeout=STATIC_RENDER_TIMEOUT,
+                 verify=True):
+        """
+        Args:
+            pool_maxsize (int) - max connections kept alive per target host
+            timeout (float) - seconds to wait on a target
+            verify (bool) - whether to verify target TLS certificates
+        """
+
+        self.timeout = timeout
+        self.verify = verify
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_maxsize=pool_maxsize)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def close(self):
+        """
+        Close all pooled connections.
+        """
+
+        self.session.close()
+
+    def runs_javascript(self):
+        """
+        See RenderBackend.runs_javascript - never.
+        """
+
+        return False
+
+    def fetch(self, method, url, body, headers, cookies):
+        """
+        Make the request as-is and return the raw response.
+
+        Returns:
+            (requests.Response)
+        """
+
+        request_headers = dict(headers or {})
+        if method == 'POST':
+            request_headers['Content-Type'] = 'application/x-www-form-urlencoded'
+
+        request_cookies = {}
+        if isinstance(cookies, dict):
+            request_cookies.update(cookies)
+        else:
+            for cookie in cookies or []:
+                if isinstance(cookie, dict):
+                    request_cookies[cookie['name']] = cookie['value']
+                else:
+                    request_cookies[cookie[0]] = cookie[1]
+
+        data = None
+        if method == 'POST':
+            data = (body or '').encode('utf-8')
+
+        return self.session.request(method, url, data=data, headers=request_headers, \
+                cookies=request_cookies, timeout=self.timeout, verify=self.verify)
+
+    def render_page(self, method, url, body, headers, cookies, pageEvents=False, outputs=None,
+                    resourcePolicy=None):
+        """
+        Fetch the page's raw HTML. See RenderBackend.render_page - no subresources are
+        loaded, so there is no resource policy to apply.
+        """
+
+        r = self.fetch(method, url, body, headers, cookies)
+
+        output = {}
+        output['page_html'] = r.text
+        output['page_errors'] = []
+        output['page_console_messages'] = []
+        output['page_alerts'] = []
+        output['page_confirms'] = []
+        output['page_prompts'] = []
+
+        return self.select_outputs(output, outputs)
@@ -0,0 +1,166 @@
+##
+## Application Security Threat Attack Modeling (ASTAM)
+##
+## Copyright (C) 2017 Applied Visions - http://securedecisions.com
+##
+## Written by Aspect Security - http://aspectsecurity.com
+##
+## Licensed under the Apache License, Version 2.0 (the "License");
+## you may not use this file except in compliance with the License.
+## You may obtain a copy of the License at
+##
+##     http://www.apache.org/licenses/LICENSE-2.0
+##
+## Unless required by applicable law or agreed to in writing, software
+## distributed under the License is distributed on an "AS IS" BASIS,
+## WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+## See the License for the specific language governing permissions and
+## limitations under the License.
+##
+
+"""
+StopPolicy.py
+"""
+
+import threading
+
+STOP_POLICIES = ['none', 'first_certain_per_param', 'first_n_per_param', 'first_per_target']
+
+class StopPolicy(object):
+    """
+    Decides when XssScanner has found enough on a parameter (or the whole target) to
+    stop attacking it. Tracks one scan's findings as attacks complete, in any order,
+    and answers both "can this attack be skipped" and "which findings count", the
+    latter always as if attacks had run one at a time in plan order.
+
+        'none' - run everything
+        'first_certain_per_param' - stop a parameter at its first CERTAIN finding
+        'first_n_per_param' - stop a parameter once it has stop_after findings
+        'first_per_target' - stop the whole target at its first finding
+    """
+
+    def __init__(self, policy='none', stop_after=1):
+        """
+        Args:
+            policy (str) - one of STOP_POLICIES
+            stop_after (int) - findings per parameter for 'first_n_per_param'
+        """
+
+        if policy not in STOP_POLICIES:
+            raise RuntimeError('Unrecognized stop policy: ' + str(policy))
+
+        self.policy = policy
+        self.threshold = stop_after if policy == 'first_n_per_param' else 1
+
+        self.lock = threading.Lock()
+        self.completed = {}
+        self.stop_index = {}
+
+    def __scope(self, planned_attack):
+        """
+        (Private) What a stop applies to - the attacked parameter, or the whole target.
+
+        Args:
+            planned_attack (dict)
+
+        Returns:
+            (obj)
+        """
+
+        if self.policy == 'first_per_target':
+            return 'target'
+
+        return id(planned_attack['param'])
+
+    def __count(self, results):
+        """
+        (Private) How many of an attack's findings count toward the threshold.
+
+        Args:
+            results (list)
+
+        Returns:
+            (int)
+        """
+
+        if self.policy == 'first_certain_per_param':
+            return len([r for r in results if r['certainty'] == 'CERTAIN'])
+
+        return len(results)
+
+    def should_skip(self, planned_attack):
+        """
+        Whether an attack no longer needs to run, because attacks planned before it in
+        the same scope already met the threshold.
+
+        Args:
+            planned_attack (dict) - with its plan position in 'index'
+
+        Returns:
+            (bool)
+        """
+
+        if self.policy == 'none':
+            return False
+
+        with self.lock:
+            stop_index = self.stop_index.get(self.__scope(planned_attack))
+
+        return stop_index is not None and planned_attack['index'] > stop_index
+
+    def record(self, planned_attack, results):
+        """
+        Record an attack's findings. Once the findings of completed attacks at or before
+        some plan position meet the threshold, everything later in that scope can be
+        skipped - findings still outstanding before it can only bring the stop earlier.
+
+        Args:
+            planned_attack (dict)
+            results (list)
+        """
+
+        if self.policy == 'none':
+            return
+
+        scope = self.__scope(planned_attack)
+
+        with self.lock:
+            completed = self.completed.setdefault(scope, {})
+            completed[planned_attack['index']] = self.__count(results)
+
+            found = 0
+            for index in sorted(completed):
+                found += completed[index]
+                if found >= self.threshold:
+                    if scope not in self.stop_index or index < self.stop_index[scope]:
+                        self.stop_index[scope] = index
+                    break
+
+    def select(self, planned_attacks, results_by_attack):
+        """
+        Keep the findings a strictly sequential scan would have reported.
+
+        Args:
+            planned_attacks (list) - in plan order
+            results_by_attack (dict) - findings by plan position, missing if skipped
+
+        Returns:
+            (list)
+        """
+
+        output = []
+        found = {}
+
+        for planned_attack in planned_attacks:
+            results = results_by_attack.get(planned_attack['index'])
+            if not results:
+                continue
+
+            scope = self.__scope(planned_attack)
+            if self.policy != 'none' and found.get(scope, 0) >= self.threshold:
+                continue
+
+            output.extend(results)
+            found[scope] = found.get(scope, 0) + self.__count(results)
+
+        return output
@@ -0,0 +1,119 @@
+##
+## Application Security Threat Attack Modeling (ASTAM)
+##
+## Copyright (C) 2017 Applied Visions - http://securedecisions.com
+##
+## Written by Aspect Security - http://aspectsecurity.com
+##
+## Licensed under the Apache License, Version 2.0 (the "License");
+## you may not use this file except in compliance with the License.
+## You may obtain a copy of the License at
+##
+##     http://www.apache.org/licenses/LICENSE-2.0
+##
+## Unless required by applicable law or agreed to in writing, software
+## distributed under the License is distributed on an "AS IS" BASIS,
+## WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+## See the License for the specific language governing permissions and
+## limitations under the License.
+##
+
+"""
+WorkBroker.py
+"""
+
+class WorkBroker(object):
+    """
+    Interface ScanCoordinator hands work units out through and ScanWorker takes them
+    from, see SqliteWorkBroker for the reference implementation. A work unit is a JSON
+    serializable payload belonging to one scan of one coordinator (its owner).
+
+    Units go 'pending', then 'claimed' by a worker for a lease, then 'done' with a
+    result or 'failed' with an error. A unit whose lease runs out is pending again,
+    until it has been claimed too many times and fails. Pending units can be
+    'cancelled' by their coordinator.
+    """
+
+    def submit(self, owner, scan_id, payloads):
+        """
+        Queue work units.
+
+        Args:
+            owner (str) - id of the submitting coordinator
+            scan_id (str)
+            payloads (list)
+
+        Returns:
+            (list) - unit ids, in payload order
+        """
+
+        raise NotImplementedError()
+
+    def claim(self, worker_id, lease_seconds):
+        """
+        Take the oldest unit available, if any.
+
+        Args:
+            worker_id (str)
+            lease_seconds (float) - how long the unit is the worker's alone
+
+        Returns:
+            (tuple) - unit id and payload, None if there is nothing to do
+        """
+
+        raise NotImplementedError()
+
+    def complete(self, unit_id, result):
+        """
+        Post the result of a claimed unit.
+
+        Args:
+            unit_id (int)
+            result (obj)
+        """
+
+        raise NotImplementedError()
+
+    def fail(self, unit_id, error):
+        """
+        Give up on a claimed unit.
+
+        Args:
+            unit_id (int)
+            error (str)
+        """
+
+        raise NotImplementedError()
+
+    def cancel(self, unit_ids):
+        """
+        Withdraw units nobody has claimed yet.
+
+        Args:
+            unit_ids (list)
+        """
+
+        raise NotImplementedError()
+
+    def collect_finished(self, owner):
+        """
+        Units of an owner that are done or failed and not collected before.
+
+        Args:
+            owner (str)
+
+        Returns:
+            (list) - dicts with 'id', 'scan_id', 'status' and 'result' or 'error'
+        """
+
+        raise NotImplementedError()
+
+    def purge(self, scan_id):
+        """
+        Drop every unit of a scan.
+
+        Args:
+            scan_id (str)
+        """
+
+        raise NotImplementedError()
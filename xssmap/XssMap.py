@@ -25,11 +25,22 @@ XssMap.py
 import json
 import re
 import sys
-
-from .CommandLineUtils import handle_input
+import threading
+
+from .CommandLineUtils import handle_bulk_input, handle_input, handle_serve_input, \
+        parse_input_object
+from .PageRenderAPI import PageRenderAPI
+from .PayloadExpander import make_payload_source
+from .PayloadStats import make_payload_stats
+from .ReflectionPrefilter import ReflectionPrefilter
+from .RenderCache import CachedRenderClient, RenderCache
+from .ResourcePolicy import ResourcePolicy, ResourcePolicyRenderClient
+from .ScanService import ScanService
+from .StopPolicy import STOP_POLICIES
 from .ReflectionChecker import ReflectionChecker
 from .RequestVariableProbe import RequestVariableProbe
 from .XssMapObject import XssMapObject
+from .XssMapSettings import SCAN_SERVICE_PORT, SCAN_SERVICE_WORKERS
 from .XssScanner import XssScanner
 
 __version__ = '0.2.0'
@@ -38,28 +49,122 @@ __version__ = '0.2.0'
 # increment minor as we add more data, do major if we break stuff
 JSON_VERSION = 1.00
 
+# Why an output has no XSS results although XSS scanning was asked for
+XSS_SKIPPED_NO_JAVASCRIPT = 'The render backend runs no Javascript, so XSS was not tested.'
+
+# Guards the objects assess_input_object shares across targets
+SHARED_OBJECTS_LOCK = threading.Lock()
+
 class XssMap(object):
     """
     XssMap tool - finds input parameter reflection in rendered webpages,
     can actively scan for XSS.
     """
 
-    def __init__(self, do_reflect=True, do_xss=True, cookies=[], headers=[]):
+    def __init__(self, do_reflect=True, do_xss=True, cookies=[], headers=[], renderer=None,
+                 concurrency=1, batch=False, cache=None, stop_policy='none', stop_after=1,
+                 prefilter=False, resource_policy=None, payloads=None, expand_payloads=False,
+                 payload_stats=None, char_probe=False, render_addresses=None):
         """
         Takes arguments for whether reflection checking should be performed,
         whether XSS scanning should be performed, plus cookies and headers
-        to add to outgoing HTTP requests.
+        to add to outgoing HTTP requests. One render client is shared by every
+        phase; pass one in to share it across XssMap instances too, or name a
+        shared backend ('phantom' or 'static', see PageRenderAPI). Concurrency
+        is how many XSS attack renders to keep in flight at once; batch sends all
+        attacks on a parameter to the renderer in one request. Cache, either a
+        RenderCache or a dict of its settings, serves repeated renders from a
+        RenderCache; triggers then become repeatable per target so reruns hit it. The stop policy and stop_after decide when XSS scanning
+        stops attacking a parameter or target, see StopPolicy. Prefilter, True or a
+        ReflectionPrefilter, first makes each trigger request over plain HTTP and
+        drops parameters that cannot reflect before anything is rendered. A resource
+        policy, a ResourcePolicy or a dict of its settings, has every render skip the
+        subresources it blocks. Payloads, a PayloadRegistry or PayloadCorpus or the
+        path of a corpus file, replace the built-in XSS payloads. Expand payloads, True
+        or a list of encodings, also tries every payload with each verify script in
+        each encoding, see PayloadExpander. Payload stats, True, a PayloadStats or a
+        dict of its settings, tries the payloads with the best history first and keeps
+        adding to that history. Char probe, True or a ReflectionPrefilter, sends each
+        reflected parameter one plain HTTP request carrying the characters payloads
+        depend on before XSS scanning, and skips payloads needing characters that do
+        not come back intact. Render addresses, as printed by RenderFarm, are the
+        engines a named phantom backend renders on. A backend that runs no Javascript,
+        such as 'static', cannot show an attack executing, so XSS scanning is then
+        skipped and the output says so.
 
         Args:
             do_reflect (bool)
             do_xss (bool)
             cookies (list)
             headers (list)
+            renderer (RenderBackend or str)
+            concurrency (int)
+            batch (bool)
+            cache (RenderCache or dict)
+            stop_policy (str)
+            stop_after (int)
+            prefilter (bool or ReflectionPrefilter)
+            resource_policy (ResourcePolicy or dict)
+            payloads (PayloadRegistry, PayloadCorpus or str)
+            expand_payloads (bool or list)
+            payload_stats (bool, PayloadStats or dict)
+            char_probe (bool or ReflectionPrefilter)
+            render_addresses (list)
         """
 
+        if renderer is None:
+            renderer = PageRenderAPI.get_shared_client('phantom', render_addresses)
+        elif isinstance(renderer, str):
+            renderer = PageRenderAPI.get_shared_client(renderer, render_addresses)
+        self.renderer = renderer
+
+        self.render_cache = None
+        self.cached_renderer = None
+        if cache is not None and cache is not False:
+            if not isinstance(cache, RenderCache):
+                cache = RenderCache(**(cache if isinstance(cache, dict) else {}))
+            self.render_cache = cache
+            self.cached_renderer = CachedRenderClient(self.renderer, self.render_cache)
+            self.renderer = self.cached_renderer
+
+        # Outside the cache, so cache keys see the policy
+        self.resource_policy = None
+        if resource_policy is not None:
+            if not isinstance(resource_policy, ResourcePolicy):
+                resource_policy = ResourcePolicy.from_dict(resource_policy)
+            self.resource_policy = resource_policy
+            self.renderer = ResourcePolicyRenderClient(self.renderer, self.resource_policy)
+
+        self.payloads = make_payload_source(payloads, expand_payloads)
+        self.payload_stats = make_payload_stats(payload_stats)
+
+        self.concurrency = concurrency
+        self.batch = batch
+
+        if stop_policy not in STOP_POLICIES:
+            raise RuntimeError('Unrecognized stop policy: ' + str(stop_policy))
+        self.stop_policy = stop_policy
+        self.stop_after = stop_after
+
+        self.prefilter = None
+        if prefilter is not None and prefilter is not False:
+            if not isinstance(prefilter, ReflectionPrefilter):
+                prefilter = ReflectionPrefilter()
+            self.prefilter = prefilter
+
+        self.char_probe = None
+        if char_probe is not None and char_probe is not False:
+            if not isinstance(char_probe, ReflectionPrefilter):
+                char_probe = self.prefilter or ReflectionPrefilter()
+            self.char_probe = char_probe
+
         self.do_reflection_checking = do_reflect
         self.do_xss_scanning = do_xss
 
+        self.xss_skipped_reason = None
+        if do_xss and not self.renderer.runs_javascript():
+            self.xss_skipped_reason = XSS_SKIPPED_NO_JAVASCRIPT
+
         self.reflection_checker = None
         self.xss_scanner = None
 
@@ -85,16 +190,24 @@ class XssMap(object):
             raise RuntimeError('The provided GET request is not valid: ' + target_url)
 
         if self.do_xss_scanning and not self.do_reflection_checking:
-            xss_scan_results = self.__xss_scan_all_GET_params(target_url)
-            output = self.__add_xss_results_to_output_obj(output, xss_scan_results)
+            if self.xss_skipped_reason is None:
+                xss_scan_results = self.__xss_scan_all_GET_params(target_url)
+                output = self.__add_xss_results_to_output_obj(output, xss_scan_results)
         else:
             information_from_reflect_check = self.__find_GET_reflected_params(target_url)
             output = self.__add_reflection_results_to_output_obj(output, information_from_reflect_check)
 
-            if len(information_from_reflect_check.params_reflected) > 0 and self.do_xss_scanning:
+            if len(information_from_reflect_check.params_reflected) > 0 and \
+                    self.do_xss_scanning and self.xss_skipped_reason is None:
                 xss_scan_results = self.__xss_scan(information_from_reflect_check)
                 output = self.__add_xss_results_to_output_obj(output, xss_scan_results)
 
+        if self.xss_skipped_reason is not None:
+            output['results']['xss_scan_skipped'] = self.xss_skipped_reason
+
+        if self.render_cache is not None:
+            output['render_cache'] = self.cached_renderer.stats()
+
         return output
 
     def assess_POST_request(self, target_url, target_body):
@@ -118,16 +231,109 @@ class XssMap(object):
             raise RuntimeError(err_msg)
 
         if self.do_xss_scanning and not self.do_reflection_checking:
-            xss_scan_results = self.__xss_scan_all_POST_params(target_url, target_body)
-            output = self.__add_xss_results_to_output_obj(output, xss_scan_results)
+            if self.xss_skipped_reason is None:
+                xss_scan_results = self.__xss_scan_all_POST_params(target_url, target_body)
+                output = self.__add_xss_results_to_output_obj(output, xss_scan_results)
         else:
             information_from_reflect_check = self.__find_POST_reflected_params(target_url, target_body)
             output = self.__add_reflection_results_to_output_obj(output, information_from_reflect_check)
 
-            if information_from_reflect_check.params_reflected and self.do_xss_scanning:
+            if information_from_reflect_check.params_reflected and self.do_xss_scanning and \
+                    self.xss_skipped_reason is None:
                 xss_scan_results = self.__xss_scan(information_from_reflect_check)
                 output = self.__add_xss_results_to_output_obj(output, xss_scan_results)
 
+        if self.xss_skipped_reason is not None:
+            output['results']['xss_scan_skipped'] = self.xss_skipped_reason
+
+        if self.render_cache is not None:
+            output['render_cache'] = self.cached_renderer.stats()
+
+        return output
+
+    async def assess_GET_request_async(self, target_url):
+        """
+        Coroutine counterpart of assess_GET_request. Renders are awaited rather than
+        blocked on, so one event loop can drive many assessments at once; share one
+        XssMap across them.
+
+        Args:
+            target_url (str)
+
+        Returns:
+            (obj)
+        """
+
+        output = {}
+        output['results'] = {}
+
+        if not self.__is_GET_request_valid(target_url):
+            raise RuntimeError('The provided GET request is not valid: ' + target_url)
+
+        information_from_probe = RequestVariableProbe.probe_GET_request(target_url)
+
+        return await self.__assess_probed_request_async(output, information_from_probe)
+
+    async def assess_POST_request_async(self, target_url, target_body):
+        """
+        Coroutine counterpart of assess_POST_request, see assess_GET_request_async.
+
+        Args:
+            target_url (str)
+            target_body (str)
+
+        Returns:
+            (obj)
+        """
+
+        output = {}
+        output['results'] = {}
+
+        if not self.__is_POST_request_valid(target_url, target_body):
+            err_msg = 'The provided POST request is not valid:\n\tURL: '
+            err_msg += target_url + '\n\tBody: ' + target_body
+            raise RuntimeError(err_msg)
+
+        information_from_probe = RequestVariableProbe.probe_POST_request(target_url, target_body)
+
+        return await self.__assess_probed_request_async(output, information_from_probe)
+
+    async def __assess_probed_request_async(self, output, information_from_probe):
+        """
+        (Private) Check a probed request for reflection and, if successful, scan it for
+        XSS, filling in the output object.
+
+        Args:
+            output (obj)
+            information_from_probe (XssMapObject)
+
+        Returns:
+            (obj)
+        """
+
+        if self.do_xss_scanning and not self.do_reflection_checking:
+            if self.xss_skipped_reason is None:
+                params = await self.__params_to_scan_async(information_from_probe)
+                xss_scan_results = await self.__xss_scan_async( \
+                        XssMapObject.scan_all_params(information_from_probe, params))
+                output = self.__add_xss_results_to_output_obj(output, xss_scan_results)
+        else:
+            self.reflection_checker = ReflectionChecker(information_from_probe, self.renderer, \
+                    self.__trigger_seed('reflect', information_from_probe), self.prefilter)
+            information_from_reflect_check = await self.reflection_checker.run_async()
+            output = self.__add_reflection_results_to_output_obj(output, information_from_reflect_check)
+
+            if information_from_reflect_check.params_reflected and self.do_xss_scanning and \
+                    self.xss_skipped_reason is None:
+                xss_scan_results = await self.__xss_scan_async(information_from_reflect_check)
+                output = self.__add_xss_results_to_output_obj(output, xss_scan_results)
+
+        if self.xss_skipped_reason is not None:
+            output['results']['xss_scan_skipped'] = self.xss_skipped_reason
+
+        if self.render_cache is not None:
+            output['render_cache'] = self.cached_renderer.stats()
+
         return output
 
     def __add_xss_results_to_output_obj(self, output, xss_scan_res):
@@ -224,6 +430,31 @@ class XssMap(object):
 
         return True
 
+    def __trigger_seed(self, phase, scan_parameters):
+        """
+        (Private) Seed for a phase's trigger generation - None (random triggers) unless
+        caching, otherwise derived from the target so a rerun repeats its requests.
+
+        Args:
+            phase (str)
+            scan_parameters (XssMapObject)
+
+        Returns:
+            (str)
+        """
+
+        if self.render_cache is None:
+            return None
+
+        params = []
+        for param in scan_parameters.params_reflected + scan_parameters.params_other:
+            params.append([param['name'], param['value'], param.get('delivery'), \
+                    param.get('reflect_contexts')])
+
+        seed = [phase, scan_parameters.request_type, scan_parameters.request_url_root, params]
+
+        return json.dumps(seed, sort_keys=True)
+
     def __find_GET_reflected_params(self, target_url):
         """
         (Private) Find reflected params in GET request.
@@ -237,7 +468,8 @@ class XssMap(object):
 
         information_from_probe = RequestVariableProbe.probe_GET_request(target_url)
 
-        self.reflection_checker = ReflectionChecker(information_from_probe)
+        self.reflection_checker = ReflectionChecker(information_from_probe, self.renderer, \
+                self.__trigger_seed('reflect', information_from_probe), self.prefilter)
         information_from_reflect_check = self.reflection_checker.run()
 
         return information_from_reflect_check
@@ -256,11 +488,51 @@ class XssMap(object):
 
         information_from_probe = RequestVariableProbe.probe_POST_request(target_url, target_body)
 
-        self.reflection_checker = ReflectionChecker(information_from_probe)
+        self.reflection_checker = ReflectionChecker(information_from_probe, self.renderer, \
+                self.__trigger_seed('reflect', information_from_probe), self.prefilter)
         information_from_reflect_check = self.reflection_checker.run()
 
         return information_from_reflect_check
 
+    def __params_to_scan(self, information_from_probe):
+        """
+        (Private) The probed params worth attacking without reflection checking - all of
+        them, or with a prefilter only those whose trigger shows up in the raw response.
+
+        Args:
+            information_from_probe (XssMapObject)
+
+        Returns:
+            (list)
+        """
+
+        if self.prefilter is None:
+            return information_from_probe.params_other
+
+        checker = ReflectionChecker(information_from_probe, self.renderer, \
+                self.__trigger_seed('prefilter', information_from_probe), self.prefilter)
+
+        return checker.find_candidate_params()
+
+    async def __params_to_scan_async(self, information_from_probe):
+        """
+        (Private) Coroutine counterpart of __params_to_scan.
+
+        Args:
+            information_from_probe (XssMapObject)
+
+        Returns:
+            (list)
+        """
+
+        if self.prefilter is None:
+            return information_from_probe.params_other
+
+        checker = ReflectionChecker(information_from_probe, self.renderer, \
+                self.__trigger_seed('prefilter', information_from_probe), self.prefilter)
+
+        return await checker.find_candidate_params_async()
+
     def __xss_scan_all_GET_params(self, target_url):
         """
         (Private) Perform XSS scanning on all params in GET request, skipping preliminary
@@ -275,19 +547,8 @@ class XssMap(object):
 
         information_from_probe = RequestVariableProbe.probe_GET_request(target_url)
 
-        these_scan_parameters = XssMapObject()
-
-        these_scan_parameters.request_url_root = information_from_probe.request_url_root
-        these_scan_parameters.request_type = 'GET'
-        these_scan_parameters.params_reflected = []
-        these_scan_parameters.params_other = []
-
-        for param in information_from_probe.params_other:
-            this_param = {}
-            this_param['name'] = param['name']
-            this_param['value'] = param['value']
-            this_param['reflect_contexts'] = ['general']  # Implemented as wildcard context
-            these_scan_parameters.params_reflected.append(this_param)
+        these_scan_parameters = XssMapObject.scan_all_params(information_from_probe, \
+                self.__params_to_scan(information_from_probe))
 
         return self.__xss_scan(these_scan_parameters)
 
@@ -306,20 +567,8 @@ class XssMap(object):
 
         information_from_probe = RequestVariableProbe.probe_POST_request(target_url, target_body)
 
-        these_scan_parameters = XssMapObject()
-
-        these_scan_parameters.request_url_root = information_from_probe.request_url_root
-        these_scan_parameters.request_type = 'POST'
-        these_scan_parameters.params_reflected = []
-        these_scan_parameters.params_other = []
-
-        for param in information_from_probe.params_other:
-            this_param = {}
-            this_param['name'] = param['name']
-            this_param['value'] = param['value']
-            this_param['delivery'] = param['delivery']
-            this_param['reflect_contexts'] = ['general']  # Implemented as wildcard context
-            these_scan_parameters.params_reflected.append(this_param)
+        these_scan_parameters = XssMapObject.scan_all_params(information_from_probe, \
+                self.__params_to_scan(information_from_probe))
 
         return self.__xss_scan(these_scan_parameters)
 
@@ -331,23 +580,206 @@ class XssMap(object):
             scan_parameters (XssMapObject)
         """
 
-        self.xss_scanner = XssScanner(scan_parameters)
+        self.xss_scanner = XssScanner(scan_parameters, self.renderer, self.concurrency, \
+                self.batch, self.__trigger_seed('xss', scan_parameters), self.stop_policy, \
+                self.stop_after, self.payloads, self.payload_stats, self.char_probe)
         scan_results = self.xss_scanner.run()
 
         return scan_results
 
-def main():
-    # Parse input parameters... if something goes awry, the method prints usage
-    request_type, request_url, request_body, do_reflect, do_xss, \
-            headers, cookies, output_filename = handle_input(JSON_VERSION, sys.argv)
+    async def __xss_scan_async(self, scan_parameters):
+        """
+        (Private) Coroutine counterpart of __xss_scan.
 
-    XSS_MAP = XssMap(do_reflect, do_xss, cookies, headers)
-    output_data = {}
+        Args:
+            scan_parameters (XssMapObject)
+        """
+
+        self.xss_scanner = XssScanner(scan_parameters, self.renderer, self.concurrency, \
+                self.batch, self.__trigger_seed('xss', scan_parameters), self.stop_policy, \
+                self.stop_after, self.payloads, self.payload_stats, self.char_probe)
+        scan_results = await self.xss_scanner.run_async()
+
+        return scan_results
+
+def assess(xss_map, request_type, request_url, request_body):
+    """
+    Run the assessment matching a request type.
+
+    Args:
+        xss_map (XssMap)
+        request_type (str)
+        request_url (str)
+        request_body (str)
+
+    Returns:
+        (obj)
+    """
 
     if request_type == 'GET':
-        output_data = XSS_MAP.assess_GET_request(request_url)
+        return xss_map.assess_GET_request(request_url)
     elif request_type == 'POST':
-        output_data = XSS_MAP.assess_POST_request(request_url, request_body)
+        return xss_map.assess_POST_request(request_url, request_body)
+
+    raise RuntimeError('Unsupported request type: ' + str(request_type))
+
+async def assess_async(xss_map, request_type, request_url, request_body):
+    """
+    Coroutine counterpart of assess.
+
+    Args:
+        xss_map (XssMap)
+        request_type (str)
+        request_url (str)
+        request_body (str)
+
+    Returns:
+        (obj)
+    """
+
+    if request_type == 'GET':
+        return await xss_map.assess_GET_request_async(request_url)
+    elif request_type == 'POST':
+        return await xss_map.assess_POST_request_async(request_url, request_body)
+
+    raise RuntimeError('Unsupported request type: ' + str(request_type))
+
+def assess_input_object(d, renderer, shared):
+    """
+    Assess one JSON input object. Targets naming a render backend or engine addresses
+    use that shared one, the rest the given render client. Objects worth sharing
+    across targets - one RenderCache per cache settings and one ReflectionPrefilter -
+    are kept in shared and created there on first use; it is safe to pass the same
+    dict from several threads.
+
+    Args:
+        d (dict) - following json/xss-tool-input.schema.json
+        renderer (RenderBackend)
+        shared (dict) - start with an empty one
+
+    Returns:
+        (obj) - following json/xss-tool-output.schema.json
+    """
+
+    request_type, request_url, request_body, do_reflect, do_xss, \
+            headers, cookies, scan_options = parse_input_object(JSON_VERSION, d)
+
+    if 'renderer' in scan_options or 'render_addresses' in scan_options:
+        renderer = PageRenderAPI.get_shared_client(scan_options.pop('renderer', 'phantom'), \
+                scan_options.pop('render_addresses', None))
+
+    with SHARED_OBJECTS_LOCK:
+        cache = scan_options.get('cache')
+        if cache is not None and cache is not False and not isinstance(cache, RenderCache):
+            cache_settings = cache if isinstance(cache, dict) else {}
+            cache_id = json.dumps(cache_settings, sort_keys=True)
+            caches = shared.setdefault('caches', {})
+            if cache_id not in caches:
+                caches[cache_id] = RenderCache(**cache_settings)
+            scan_options['cache'] = caches[cache_id]
+
+        if scan_options.get('prefilter') is True:
+            if 'prefilter' not in shared:
+                shared['prefilter'] = ReflectionPrefilter()
+            scan_options['prefilter'] = shared['prefilter']
+
+        if scan_options.get('char_probe') is True:
+            if 'prefilter' not in shared:
+                shared['prefilter'] = ReflectionPrefilter()
+            scan_options['char_probe'] = shared['prefilter']
+
+    xss_map = XssMap(do_reflect, do_xss, cookies, headers, renderer, **scan_options)
+
+    return assess(xss_map, request_type, request_url, request_body)
+
+def run_bulk(input_stream, output_stream, renderer=None):
+    """
+    Assess a stream of JSON inputs, one per line, writing one JSON output per line as
+    each finishes. All targets share one render client and one ReflectionPrefilter,
+    and targets asking for the same cache settings share one RenderCache. A target that
+    fails gets an output line with an "error" field instead of stopping the run.
+
+    Args:
+        input_stream (file) - lines following json/xss-tool-input.schema.json
+        output_stream (file)
+        renderer (RenderBackend)
+    """
+
+    if renderer is None:
+        renderer = PageRenderAPI.get_shared_client()
+
+    shared = {}
+
+    for line_number, line in enumerate(input_stream, 1):
+        line = line.strip()
+        if not line:
+            continue
+
+        try:
+            output_data = assess_input_object(json.loads(line), renderer, shared)
+        except Exception as e:
+            output_data = {}
+            output_data['line'] = line_number
+            output_data['error'] = str(e)
+
+        output_stream.write(json.dumps(output_data) + '\n')
+        output_stream.flush()
+
+def serve(port=SCAN_SERVICE_PORT, workers=SCAN_SERVICE_WORKERS, renderer=None):
+    """
+    Run a ScanService until interrupted. Its scan threads share one render client and,
+    as in run_bulk, one ReflectionPrefilter and one RenderCache per cache settings.
+
+    Args:
+        port (int)
+        workers (int) - jobs to scan at once
+        renderer (RenderBackend)
+    """
+
+    if renderer is None:
+        renderer = PageRenderAPI.get_shared_client()
+
+    shared = {}
+
+    service = ScanService(lambda d: assess_input_object(d, renderer, shared), \
+            lambda d: parse_input_object(JSON_VERSION, d), port=port, workers=workers)
+    service.start()
+
+    print('Scan service up at ' + service.address)
+
+    try:
+        service.wait()
+    except KeyboardInterrupt:
+        service.stop()
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1].lower() == '--serve':
+        port, workers = handle_serve_input(sys.argv)
+        serve(port, workers)
+        return
+
+    if len(sys.argv) > 1 and sys.argv[1].lower() == '--bulk':
+        input_name, output_name = handle_bulk_input(sys.argv)
+
+        input_stream = sys.stdin if input_name == '-' else open(input_name)
+        output_stream = sys.stdout if output_name == '-' else open(output_name, 'w')
+
+        try:
+            run_bulk(input_stream, output_stream)
+        finally:
+            if input_stream is not sys.stdin:
+                input_stream.close()
+            if output_stream is not sys.stdout:
+                output_stream.close()
+
+        return
+
+    # Parse input parameters... if something goes awry, the method prints usage
+    request_type, request_url, request_body, do_reflect, do_xss, \
+            headers, cookies, scan_options, output_filename = handle_input(JSON_VERSION, sys.argv)
+
+    XSS_MAP = XssMap(do_reflect, do_xss, cookies, headers, **scan_options)
+    output_data = assess(XSS_MAP, request_type, request_url, request_body)
 
     with open(output_filename, 'w') as outfile:
         json.dump(output_data, outfile)
@@ -84,3 +84,72 @@ class XssMapObject:
         self.request_body = None
         self.params_reflected = []
         self.params_other = []
+
+    def to_dict(self):
+        """
+        Plain dict of this object, for sending it elsewhere as JSON.
+
+        Returns:
+            (dict)
+        """
+
+        d = {}
+        d['request_type'] = self.request_type
+        d['request_url_root'] = self.request_url_root
+        d['request_body'] = self.request_body
+        d['params_reflected'] = self.params_reflected
+        d['params_other'] = self.params_other
+
+        return d
+
+    @staticmethod
+    def from_dict(d):
+        """
+        Rebuild an object from its to_dict form.
+
+        Args:
+            d (dict)
+
+        Returns:
+            (XssMapObject)
+        """
+
+        obj = XssMapObject()
+        obj.request_type = d.get('request_type')
+        obj.request_url_root = d.get('request_url_root')
+        obj.request_body = d.get('request_body')
+        obj.params_reflected = d.get('params_reflected', [])
+        obj.params_other = d.get('params_other', [])
+
+        return obj
+
+    @staticmethod
+    def scan_all_params(information_from_probe, params):
+        """
+        Scan parameters for XSS scanning without preliminary reflection checking - the
+        given probed params, each attacked in every context.
+
+        Args:
+            information_from_probe (XssMapObject)
+            params (list) - entries of its params_other
+
+        Returns:
+            (XssMapObject)
+        """
+
+        these_scan_parameters = XssMapObject()
+
+        these_scan_parameters.request_url_root = information_from_probe.request_url_root
+        these_scan_parameters.request_type = information_from_probe.request_type
+        these_scan_parameters.params_reflected = []
+        these_scan_parameters.params_other = []
+
+        for param in params:
+            this_param = {}
+            this_param['name'] = param['name']
+            this_param['value'] = param['value']
+            this_param['delivery'] = param['delivery']
+            this_param['reflect_contexts'] = ['general']  # Implemented as wildcard context
+            these_scan_parameters.params_reflected.append(this_param)
+
+        return these_scan_parameters
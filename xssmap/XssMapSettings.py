@@ -22,6 +22,94 @@
 XssMapSettings.py
 """
 
+import os
+
 PHANTOM_SERVER = '127.0.0.1'
 PHANTOM_PORT = 8888
 PHANTOM_ADDRESS = 'http://' + PHANTOM_SERVER + ':' + str(PHANTOM_PORT)
+
+# Render farm, see RenderFarm - workers listen on consecutive ports from PHANTOM_PORT
+PHANTOM_BINARY = 'phantomjs'
+PHANTOM_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'renderers', \
+        'phantom-render.js')
+PHANTOM_WORKER_COUNT = 1
+PHANTOM_ADDRESSES = ['http://' + PHANTOM_SERVER + ':' + str(PHANTOM_PORT + i) \
+        for i in range(PHANTOM_WORKER_COUNT)]
+
+# Connection pooling for the render client, see PhantomRenderClient
+PHANTOM_POOL_CONNECTIONS = 1
+PHANTOM_POOL_MAXSIZE = 10
+
+# Renderer wire protocol, see PhantomRenderClient - None negotiates the highest version
+# each engine speaks, waiting up to PHANTOM_NEGOTIATION_TIMEOUT seconds for its answer.
+# Version 1 engines never answer, so set 1 for them rather than wait on every request
+PHANTOM_PROTOCOL_VERSION = None
+PHANTOM_NEGOTIATION_TIMEOUT = 2
+
+# Render deadlines, see PhantomRenderClient - the engine sends back what it has, flagged
+# as timed out, once RENDER_DEADLINE_MS passes (0 for no deadline), and only counts a
+# page as done once its network has been idle for RENDER_SETTLE_MS after load
+RENDER_DEADLINE_MS = 30000
+RENDER_SETTLE_MS = 0
+
+# Client side, seconds to connect to an engine and seconds beyond the render deadline to
+# wait for its answer, then how many times to retry a failed render and the first pause
+# between tries (doubling each time)
+PHANTOM_CONNECT_TIMEOUT = 5
+PHANTOM_RESPONSE_MARGIN = 10
+PHANTOM_RETRIES = 2
+PHANTOM_RETRY_BACKOFF = 0.5
+
+# Whether RenderFarm starts engines with debug logging, every rendered page included
+PHANTOM_VERBOSE = False
+
+# Warm page pool in each engine - idle pages kept for reuse, and renders per page
+# before it is closed to contain leaks
+PHANTOM_PAGE_POOL_SIZE = 4
+PHANTOM_PAGE_MAX_REUSE = 50
+
+# Render result cache, see RenderCache - the outputs kept in memory, the size budget of
+# the on-disk tier, and the seconds an output is served for after it was rendered, None
+# for no limit. Targets change, so an old output may no longer be what the page renders
+RENDER_CACHE_MEMORY_ENTRIES = 256
+RENDER_CACHE_DISK_MAX_BYTES = 512 * 1024 * 1024
+RENDER_CACHE_MAX_AGE = 24 * 60 * 60
+
+# What XSS attack renders send back (see RenderBackend.RENDER_OUTPUTS) - the scanner only
+# reads the Javascript events
+XSS_ATTACK_RENDER_OUTPUTS = ['events']
+
+# Seconds the static (no Javascript) render backend waits on a target
+STATIC_RENDER_TIMEOUT = 30
+
+# Whether the raw-HTTP prefilter fetches external scripts to check them for DOM sources
+# (see ReflectionPrefilter), otherwise any external script keeps every parameter
+PREFILTER_FETCH_SCRIPTS = True
+
+# Resident scan service, see ScanService - where it listens, how many jobs it scans at
+# once, and how many finished jobs it keeps for polling before dropping the oldest
+SCAN_SERVICE_HOST = '127.0.0.1'
+SCAN_SERVICE_PORT = 8787
+SCAN_SERVICE_WORKERS = 4
+SCAN_SERVICE_MAX_FINISHED_JOBS = 1000
+
+# Distributed scanning, see ScanCoordinator and ScanWorker - seconds a worker holds a
+# claimed work unit before others may take it over, claims of a unit before giving up on
+# it, seconds between broker polls when there is nothing to do, and attack units one
+# assessment keeps submitted at once, more being planned as they finish
+WORK_UNIT_LEASE_SECONDS = 300
+WORK_UNIT_MAX_ATTEMPTS = 3
+WORK_POLL_INTERVAL = 0.5
+WORK_ATTACK_WINDOW = 64
+
+# Encodings PayloadExpander tries each payload in, see PAYLOAD_ENCODINGS there. 'url' is
+# left out, the built-in payloads hold no raw '+' or '%' so it would only repeat 'none'
+PAYLOAD_EXPANSION_ENCODINGS = ['none', 'url_double', 'html_entity', 'case', 'whitespace']
+
+# Payload success history, see PayloadStats - the database file, how candidate payloads
+# are ordered from it ('success_rate', or 'thompson', which orders differently on every
+# run), and how many of a parameter's payloads are moved to the front by it, the rest
+# keeping their order
+PAYLOAD_STATS_PATH = os.path.join(os.path.expanduser('~'), '.xssmap', 'payload-stats.db')
+PAYLOAD_STATS_ORDERING = 'success_rate'
+PAYLOAD_STATS_TOP_K = 100
@@ -22,29 +22,77 @@
 XssMapObject.py
 """
 
+import asyncio
 import base64
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import itertools
 import json
 import random
 
 import requests
 
 from .PageRenderAPI import PageRenderAPI
-from .XssMapPayloads import TRIGGER_VALUE_PLACEHOLDER, XSSMAP_PAYLOADS
+from .PayloadRegistry import PayloadRegistry
+from .ReflectionPrefilter import characters_needed, make_character_probe
+from .StopPolicy import StopPolicy
+from .XssMapSettings import XSS_ATTACK_RENDER_OUTPUTS
 
 class XssScanner(object):
     """
     Performs active scanning for cross-site scription.
     """
 
-    def __init__(self, scan_parameters):
+    def __init__(self, scan_parameters, renderer=None, concurrency=1, batch=False,
+                 trigger_seed=None, stop_policy='none', stop_after=1, payloads=None,
+                 payload_stats=None, char_probe=None):
         """
-        XssScanner is initialized by an XssMapObject, which can come from ReflectionChecker
-        or RequestVariableProbe.
+        XssScanner is initialized by an XssMapObject, which can come from
+        ReflectionChecker or RequestVariableProbe. Renders go through the given render
+        client, or the shared one if none is given. With concurrency above 1, that many
+        attack renders are kept in flight at once. With batch, all attacks on one
+        parameter go to the renderer in a single request. A trigger seed makes the
+        generated triggers repeatable, so identical scans render identical requests. The
+        stop policy (see StopPolicy) ends attacks on a parameter or target early once
+        enough is found. Payloads come from the given PayloadRegistry, or the shared one
+        of the built-in payloads. With payload stats, each parameter's payloads are tried
+        likeliest first going by PayloadStats history, and every run adds to it. With a
+        character probe, a ReflectionPrefilter, each reflected parameter first gets one
+        plain HTTP request carrying the probe characters, and payloads needing a character
+        that comes back filtered or encoded everywhere are not attacked.
 
         Args:
             scan_parameters (XssMapObject)
+            renderer (RenderBackend)
+            concurrency (int)
+            batch (bool)
+            trigger_seed (str)
+            stop_policy (str)
+            stop_after (int)
+            payloads (PayloadRegistry)
+            payload_stats (PayloadStats)
+            char_probe (ReflectionPrefilter)
         """
 
+        if renderer is None:
+            renderer = PageRenderAPI.get_shared_client()
+        self.renderer = renderer
+        self.concurrency = max(1, concurrency)
+        self.batch = batch
+        self.trigger_seed = trigger_seed
+        self.trigger_random = random.Random(trigger_seed)
+        self.stop_policy = stop_policy
+        self.stop_after = stop_after
+
+        if payloads is None:
+            payloads = PayloadRegistry.get_shared()
+        self.payloads = payloads
+        self.payload_stats = payload_stats
+        self.char_probe = char_probe
+
+        # Surviving characters per reflection point of each reflected parameter, None
+        # where unknown, once probed
+        self.surviving_characters = None
+
         self.load_new_parameters(scan_parameters)
 
         self.headers = {}
@@ -99,25 +147,45 @@ class XssScanner(object):
             (obj)
         """
 
+        u = self.build_GET_request({param_under_test['name'] : attack}, request_url_root, \
+                params_reflected, params_other)
+
+        rendered_page_output = self.renderer.render_page('GET', u, None, \
+                    self.headers, self.cookies, pageEvents=True, outputs=XSS_ATTACK_RENDER_OUTPUTS)
+
+        return rendered_page_output
+
+    def build_GET_request(self, attacks, request_url_root, params_reflected, params_other):
+        """
+        Build the URL of a GET attack.
+
+        Params:
+            attacks (dict) - attack string by name of parameter it goes in
+            request_url_root (str)
+            params_reflected (list)
+            params_other (list)
+
+        Returns:
+            (str)
+        """
+
         all_params_to_add = params_reflected + params_other
 
         u = request_url_root + '?'
 
         for param_to_add in all_params_to_add:
-            if param_to_add['name'] == param_under_test['name']:
+            if param_to_add['name'] in attacks:
                 u = u + param_to_add['name'] + '='
-                u = u + attack
+                u = u + attacks[param_to_add['name']]
             else:
                 u = u + param_to_add['name'] + '=' + param_to_add['value']
+            u = u + '&'
 
         # If we ended up with trailing ampersand on URL, remove
         if u[-1] == '&':
             u = u[:-1]
 
-        rendered_page_output = PageRenderAPI.render_page_with_phantom('GET', u, None, \
-                    self.headers, self.cookies, pageEvents=True)
-
-        return rendered_page_output
+        return u
 
     def render_POST_page(self, attack, request_url_root, param_under_test,\
             params_reflected, params_other):
@@ -135,6 +203,30 @@ class XssScanner(object):
             (obj)
         """
 
+        attack_url, attack_body = self.build_POST_request({param_under_test['name'] : attack}, \
+                request_url_root, params_reflected, params_other)
+
+        self.headers['Content-Type'] = 'application/x-www-form-urlencoded'
+
+        rendered_page_output = self.renderer.render_page('POST', attack_url, attack_body, \
+            self.headers, self.cookies, pageEvents=True, outputs=XSS_ATTACK_RENDER_OUTPUTS)
+
+        return rendered_page_output
+
+    def build_POST_request(self, attacks, request_url_root, params_reflected, params_other):
+        """
+        Build the URL and body of a POST attack.
+
+        Params:
+            attacks (dict) - attack string by name of parameter it goes in
+            request_root (str)
+            params_reflected (list)
+            params_other (list)
+
+        Returns:
+            (str, str)
+        """
+
         attack_url = request_url_root
         attack_body = ''
 
@@ -154,43 +246,46 @@ class XssScanner(object):
             if added_question_mark_to_url is False:
                 attack_url += '?'
                 added_question_mark_to_url = True
-            if param['name'] == param_under_test['name']:
+            if param['name'] in attacks:
                 attack_url += param['name'] + '='
-                attack_url += attack
+                attack_url += attacks[param['name']]
             else:
                 attack_url += param['name'] + '=' + param['value']
+            attack_url += '&'
 
         # If we ended up with trailing ampersand on URL, remove
         if attack_url[-1] == '&':
             attack_url = attack_url[:-1]
 
         for param in body_params_to_add:
-            if param['name'] == param_under_test['name']:
+            if param['name'] in attacks:
                 attack_body += param['name'] +'='
-                attack_body += attack
+                attack_body += attacks[param['name']]
             else:
                 attack_body += param['name'] + '=' + param['value']
+            attack_body += '&'
 
         # If we ended up with trailing ampersand in body, remove
         if attack_body and attack_body[-1] == '&':
             attack_body = attack_body[:-1]
 
-        self.headers['Content-Type'] = 'application/x-www-form-urlencoded'
-
-        rendered_page_output = PageRenderAPI.render_page_with_phantom('POST', attack_url, attack_body, \
-            self.headers, self.cookies, pageEvents=True)
-
-        return rendered_page_output
+        return attack_url, attack_body
 
-    def make_trigger(self):
+    def make_trigger(self, trigger_random=None):
         """
         Makes an XSS scan trigger string - 9 digit number.
 
+        Args:
+            trigger_random (random.Random) - the scanner's own if None
+
         Returns:
             (str)
         """
 
-        return str(random.randrange(100000000, 999999999))
+        if trigger_random is None:
+            trigger_random = self.trigger_random
+
+        return str(trigger_random.randrange(100000000, 999999999))
 
     def __analyze_rendered_page_output(self, rendered_page_output, search=None):
         """
@@ -244,44 +339,675 @@ class XssScanner(object):
 
         return results
 
+    def plan_attacks(self, stop_policy=None):
+        """
+        Lay out the attacks run would make, in the order it would start them, for
+        running them elsewhere (see ScanCoordinator). Attacks are made as they are drawn,
+        so a big payload source never becomes a big list, and a parameter's attacks stop
+        being drawn once the stop policy says they can be skipped. Each planned attack
+        has its plan position in 'index' - the position of its parameter, then its own
+        among that parameter's attacks - the reflected parameter it goes in under
+        'param', its 'trigger', 'attack' and the 'payload_id' it was made from.
+
+        Args:
+            stop_policy (StopPolicy) - the one attack findings are recorded in, if any
+
+        Returns:
+            (iterator)
+        """
+
+        if stop_policy is None:
+            stop_policy = StopPolicy()
+
+        self.__probe_characters()
+
+        work = self.__make_work(stop_policy, False)
+
+        return (planned_attacks[0] for planned_attacks in work)
+
+    def run_attack(self, planned_attack):
+        """
+        Render one planned attack and return its findings.
+
+        Args:
+            planned_attack (dict) - as from plan_attacks
+
+        Returns:
+            (list)
+        """
+
+        return self.__execute_attack(planned_attack)
+
+    def record_outcomes(self, planned_attacks, results_by_attack):
+        """
+        Add to the payload stats, if any, whether each attack that ran found XSS for
+        certain. A PROBABLE finding, often a reflection that never ran, isn't a win.
+
+        Args:
+            planned_attacks (list) - as from plan_attacks, at least those that ran
+            results_by_attack (dict) - findings by plan position, missing if skipped
+        """
+
+        if self.payload_stats is None:
+            return
+
+        outcomes = []
+        for planned_attack in planned_attacks:
+            if planned_attack['index'] in results_by_attack:
+                results = results_by_attack[planned_attack['index']]
+                outcomes.append((planned_attack['param']['reflect_contexts'], \
+                        planned_attack['payload_id'], \
+                        any(result['certainty'] == 'CERTAIN' for result in results)))
+
+        self.payload_stats.record(self.target_url, outcomes)
+
+    def __probe_characters(self):
+        """
+        (Private) Send the character probe for each reflected parameter, if there is a
+        character probe, and keep what survives in surviving_characters.
+        """
+
+        self.surviving_characters = [None] * len(self.params_reflected)
+
+        if self.char_probe is None:
+            return
+
+        for idx, param_reflected in enumerate(self.params_reflected):
+            trigger_str = self.make_trigger()
+            probe = {param_reflected['name'] : make_character_probe(trigger_str)}
+
+            if self.target_type == 'POST':
+                probe_url, probe_body = self.build_POST_request(probe, self.target_url, \
+                        self.params_reflected, self.params_other)
+            else:
+                probe_url = self.build_GET_request(probe, self.target_url, \
+                        self.params_reflected, self.params_other)
+                probe_body = None
+
+            self.surviving_characters[idx] = self.char_probe.find_surviving_characters( \
+                    self.target_type, probe_url, probe_body, self.headers, self.cookies, \
+                    trigger_str)
+
+    def __can_survive(self, payload, surviving):
+        """
+        (Private) Whether a payload needs no character that the character probe found
+        filtered or encoded at every reflection point.
+
+        Args:
+            payload (dict)
+            surviving (list) - as from ReflectionPrefilter.find_surviving_characters
+
+        Returns:
+            (bool)
+        """
+
+        if surviving is None:
+            return True
+
+        needed = characters_needed(self.payloads.make_attack(payload, ''))
+
+        return any(needed <= set(point) for point in surviving)
+
+    def __param_trigger_random(self, idx):
+        """
+        (Private) Trigger generator for one reflected parameter's attacks. With a trigger
+        seed it is seeded from the seed and the parameter's position, so a parameter's
+        triggers do not depend on how far planning got on the others.
+
+        Args:
+            idx (int)
+
+        Returns:
+            (random.Random)
+        """
+
+        if self.trigger_seed is None:
+            return random.Random()
+
+        return random.Random(str(self.trigger_seed) + ':' + str(idx))
+
+    def __plan_param_attacks(self, idx):
+        """
+        (Private) Make the attacks on one reflected parameter as they are drawn, in plan
+        order - each applicable payload once, with its own trigger. Payload stats, if
+        any, decide the order of the payloads, and payloads the character probe ruled
+        out are left out.
+
+        Args:
+            idx (int) - position of the parameter among the reflected ones
+
+        Yields:
+            (dict) - planned attack
+        """
+
+        param_reflected = self.params_reflected[idx]
+        surviving = self.surviving_characters[idx]
+        trigger_random = self.__param_trigger_random(idx)
+
+        if self.payload_stats is not None:
+            payloads = self.payload_stats.order(self.target_url, \
+                    param_reflected['reflect_contexts'], self.payloads)
+        else:
+            payloads = self.payloads.payloads_for(param_reflected['reflect_contexts'])
+
+        position = 0
+        for payload in payloads:
+            if not self.__can_survive(payload, surviving):
+                continue
+
+            trigger_str = self.make_trigger(trigger_random)
+            planned_attack = {}
+            planned_attack['index'] = (idx, position)
+            planned_attack['param'] = param_reflected
+            planned_attack['trigger'] = trigger_str
+            planned_attack['attack'] = self.payloads.make_attack(payload, trigger_str)
+            planned_attack['payload_id'] = payload['id']
+            position += 1
+
+            yield planned_attack
+
+    def __collect_results(self, planned_attack, rendered_page_output):
+        """
+        (Private) Analyze the render of one planned attack and return its findings.
+
+        Args:
+            planned_attack (dict)
+            rendered_page_output (obj)
+
+        Returns:
+            (list)
+        """
+
+        param_reflected = planned_attack['param']
+
+        results = self.__analyze_rendered_page_output(rendered_page_output, \
+                planned_attack['trigger'])
+
+        for result in results:
+            result['parameter'] = param_reflected['name']
+            result['deliver'] = param_reflected['delivery']
+            result['attack'] = planned_attack['attack']
+
+        return results
+
+    def __execute_attack(self, planned_attack):
+        """
+        (Private) Render one planned attack and return its findings.
+
+        Args:
+            planned_attack (dict)
+
+        Returns:
+            (list)
+        """
+
+        param_reflected = planned_attack['param']
+        attack = planned_attack['attack']
+
+        rendered_page_output = None
+        if self.target_type == 'GET':
+            rendered_page_output = self.render_GET_page(attack, self.target_url, \
+                    param_reflected, self.params_reflected, self.params_other)
+        elif self.target_type == 'POST':
+            rendered_page_output = self.render_POST_page(attack,\
+                    self.target_url, param_reflected, self.params_reflected,\
+                    self.params_other)
+
+        return self.__collect_results(planned_attack, rendered_page_output)
+
+    async def __execute_attack_async(self, planned_attack):
+        """
+        (Private) Coroutine counterpart of __execute_attack.
+
+        Args:
+            planned_attack (dict)
+
+        Returns:
+            (list)
+        """
+
+        if self.target_type == 'POST':
+            self.headers['Content-Type'] = 'application/x-www-form-urlencoded'
+
+        attacks = {}
+        attacks[planned_attack['param']['name']] = planned_attack['attack']
+        job = self.__make_render_job(attacks)
+
+        rendered_page_output = await self.renderer.render_page_async(job['method'], \
+                job['url'], job['body'], job['headers'], job['cookies'], pageEvents=True, \
+                outputs=job['outputs'])
+
+        return self.__collect_results(planned_attack, rendered_page_output)
+
+    async def __execute_single_attack_async(self, planned_attacks):
+        """
+        (Private) Unit of work for unbatched scans, a list holding one planned attack.
+
+        Args:
+            planned_attacks (list)
+
+        Returns:
+            (list) - findings for the one planned attack
+        """
+
+        return [await self.__execute_attack_async(planned_attacks[0])]
+
+    def __make_render_job(self, attacks):
+        """
+        (Private) Describe a render of the target with the given attacks in place, in the
+        form RenderBackend.render_batch takes.
+
+        Args:
+            attacks (dict) - attack string by parameter name
+
+        Returns:
+            (dict)
+        """
+
+        job = {}
+        job['method'] = self.target_type
+        job['headers'] = self.headers
+        job['cookies'] = self.cookies
+        job['pageEvents'] = True
+        job['outputs'] = XSS_ATTACK_RENDER_OUTPUTS
+        job['body'] = None
+
+        if self.target_type == 'GET':
+            job['url'] = self.build_GET_request(attacks, self.target_url, \
+                    self.params_reflected, self.params_other)
+        elif self.target_type == 'POST':
+            job['url'], job['body'] = self.build_POST_request(attacks, self.target_url, \
+                    self.params_reflected, self.params_other)
+
+        return job
+
+    def __execute_attack_batch(self, planned_attacks):
+        """
+        (Private) Render several planned attacks in one renderer request and return
+        their findings, in order.
+
+        Args:
+            planned_attacks (list)
+
+        Returns:
+            (list) - findings for each planned attack
+        """
+
+        rendered_page_outputs = self.renderer.render_batch( \
+                self.__make_batch_jobs(planned_attacks))
+
+        return [self.__collect_results(p, rendered_page_output) \
+                for p, rendered_page_output in zip(planned_attacks, rendered_page_outputs)]
+
+    async def __execute_attack_batch_async(self, planned_attacks):
+        """
+        (Private) Coroutine counterpart of __execute_attack_batch.
+
+        Args:
+            planned_attacks (list)
+
+        Returns:
+            (list)
+        """
+
+        rendered_page_outputs = await self.renderer.render_batch_async( \
+                self.__make_batch_jobs(planned_attacks))
+
+        return [self.__collect_results(p, rendered_page_output) \
+                for p, rendered_page_output in zip(planned_attacks, rendered_page_outputs)]
+
+    def __make_batch_jobs(self, planned_attacks):
+        """
+        (Private) One render job per planned attack.
+
+        Args:
+            planned_attacks (list)
+
+        Returns:
+            (list)
+        """
+
+        jobs = []
+
+        for planned_attack in planned_attacks:
+            attacks = {}
+            attacks[planned_attack['param']['name']] = planned_attack['attack']
+            jobs.append(self.__make_render_job(attacks))
+
+        return jobs
+
+    def __split_batch(self, planned_attacks, grow):
+        """
+        (Private) Split one parameter's attacks into batches. With grow, batches of 1, 2,
+        4 and so on, so a stop policy that fires early on the parameter leaves the larger
+        later batches undrawn; otherwise one batch of them all.
+
+        Args:
+            planned_attacks (iterator)
+            grow (bool)
+
+        Yields:
+            (list)
+        """
+
+        size = 1 if grow else None
+
+        while True:
+            batch = list(itertools.islice(planned_attacks, size))
+            if not batch:
+                return
+            yield batch
+            if size is not None:
+                size *= 2
+
+    def __interleave(self, work_by_param):
+        """
+        (Private) Merge each parameter's units of work round robin - the first unit of
+        every parameter, then the second, and so on - so concurrent renders spread over
+        parameters and a stop on one parameter still finds its later units undrawn.
+
+        Args:
+            work_by_param (list) - iterator of units of work per parameter
+
+        Yields:
+            (list)
+        """
+
+        while work_by_param:
+            still_going = []
+
+            for units in work_by_param:
+                unit = next(units, None)
+                if unit is not None:
+                    still_going.append(units)
+                    yield unit
+
+            work_by_param = still_going
+
+    def __until_skippable(self, units, stop_policy):
+        """
+        (Private) A parameter's units of work up to the first the stop policy makes
+        wholly skippable - attacks are drawn in plan order, so every later one is too.
+
+        Args:
+            units (iterator)
+            stop_policy (StopPolicy)
+
+        Yields:
+            (list)
+        """
+
+        for unit in units:
+            if self.__is_work_skippable(unit, stop_policy):
+                return
+            yield unit
+
+    def __make_work(self, stop_policy, batch):
+        """
+        (Private) Units of work - single attacks or batches - in the order to start them,
+        drawn as they are needed.
+
+        Args:
+            stop_policy (StopPolicy)
+            batch (bool)
+
+        Returns:
+            (iterator)
+        """
+
+        work_by_param = []
+
+        for idx in range(len(self.params_reflected)):
+            planned_attacks = self.__plan_param_attacks(idx)
+
+            if batch:
+                units = self.__split_batch(planned_attacks, self.stop_policy != 'none')
+            else:
+                units = ([planned_attack] for planned_attack in planned_attacks)
+
+            work_by_param.append(self.__until_skippable(units, stop_policy))
+
+        # A stop on the whole target is reached soonest in plan order
+        if self.stop_policy == 'first_per_target':
+            return itertools.chain.from_iterable(work_by_param)
+
+        return self.__interleave(work_by_param)
+
+    def __is_work_skippable(self, planned_attacks, stop_policy):
+        """
+        (Private) Whether the stop policy says every attack in a unit of work can be
+        skipped.
+
+        Args:
+            planned_attacks (list)
+            stop_policy (StopPolicy)
+
+        Returns:
+            (bool)
+        """
+
+        return all(stop_policy.should_skip(p) for p in planned_attacks)
+
+    def __execute_work_item(self, execute, planned_attacks, stop_policy):
+        """
+        (Private) Run one unit of work - a single attack or a batch - leaving out
+        attacks the stop policy says can be skipped, and record what was found.
+
+        Args:
+            execute (function) - takes planned attacks, returns findings for each
+            planned_attacks (list)
+            stop_policy (StopPolicy)
+
+        Returns:
+            (dict) - findings by plan position of the attacks run
+        """
+
+        results_by_attack = {}
+
+        live_attacks = [p for p in planned_attacks if not stop_policy.should_skip(p)]
+        if not live_attacks:
+            return results_by_attack
+
+        for planned_attack, results in zip(live_attacks, execute(live_attacks)):
+            results_by_attack[planned_attack['index']] = results
+            stop_policy.record(planned_attack, results)
+
+        return results_by_attack
+
+    async def __execute_work_item_async(self, execute, planned_attacks, stop_policy):
+        """
+        (Private) Coroutine counterpart of __execute_work_item.
+
+        Args:
+            execute (function) - coroutine function, takes planned attacks
+            planned_attacks (list)
+            stop_policy (StopPolicy)
+
+        Returns:
+            (dict)
+        """
+
+        results_by_attack = {}
+
+        live_attacks = [p for p in planned_attacks if not stop_policy.should_skip(p)]
+        if not live_attacks:
+            return results_by_attack
+
+        for planned_attack, results in zip(live_attacks, await execute(live_attacks)):
+            results_by_attack[planned_attack['index']] = results
+            stop_policy.record(planned_attack, results)
+
+        return results_by_attack
+
+    def __keep_results(self, planned_attacks, unit_results, attacks_run,
+                       results_by_attack):
+        """
+        (Private) Take in the findings of a finished unit of work.
+
+        Args:
+            planned_attacks (list) - the unit
+            unit_results (dict) - as from __execute_work_item
+            attacks_run (list) - filled in with the attacks that ran
+            results_by_attack (dict) - filled in by plan position
+        """
+
+        attacks_run.extend(p for p in planned_attacks if p['index'] in unit_results)
+        results_by_attack.update(unit_results)
+
+    def __run_concurrently(self, execute, work, stop_policy, attacks_run,
+                           results_by_attack):
+        """
+        (Private) Run units of work on concurrency threads, drawing the next unit as one
+        finishes. A unit the stop policy makes wholly skippable while rendering is
+        abandoned - no longer waited for, its findings left out.
+
+        Args:
+            execute (function)
+            work (iterator)
+            stop_policy (StopPolicy)
+            attacks_run (list)
+            results_by_attack (dict)
+        """
+
+        executor = ThreadPoolExecutor(max_workers=self.concurrency)
+
+        try:
+            pending = {}
+
+            while True:
+                while len(pending) < self.concurrency:
+                    w = next(work, None)
+                    if w is None:
+                        break
+                    pending[executor.submit(self.__execute_work_item, execute, w, \
+                            stop_policy)] = w
+
+                if not pending:
+                    break
+
+                done, not_done = wait(list(pending), return_when=FIRST_COMPLETED)
+                for future in done:
+                    self.__keep_results(pending.pop(future), future.result(), \
+                            attacks_run, results_by_attack)
+
+                for future in [f for f in pending \
+                        if self.__is_work_skippable(pending[f], stop_policy)]:
+                    future.cancel()
+                    del pending[future]
+        finally:
+            # Abandoned renders finish on their own, nothing waits for them
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    async def __run_concurrently_async(self, execute, work, stop_policy, attacks_run,
+                                       results_by_attack):
+        """
+        (Private) Coroutine counterpart of __run_concurrently. Abandoned units are
+        cancelled, in-flight renders included.
+
+        Args:
+            execute (function) - coroutine function
+            work (iterator)
+            stop_policy (StopPolicy)
+            attacks_run (list)
+            results_by_attack (dict)
+        """
+
+        pending = {}
+        abandoned = []
+
+        try:
+            while True:
+                while len(pending) < self.concurrency:
+                    w = next(work, None)
+                    if w is None:
+                        break
+                    pending[asyncio.ensure_future(self.__execute_work_item_async(execute, \
+                            w, stop_policy))] = w
+
+                if not pending:
+                    break
+
+                done, not_done = await asyncio.wait(list(pending), \
+                        return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    self.__keep_results(pending.pop(task), task.result(), attacks_run, \
+                            results_by_attack)
+
+                for task in [t for t in pending \
+                        if self.__is_work_skippable(pending[t], stop_policy)]:
+                    task.cancel()
+                    abandoned.append(task)
+                    del pending[task]
+        finally:
+            for task in pending:
+                task.cancel()
+                abandoned.append(task)
+            await asyncio.gather(*abandoned, return_exceptions=True)
+
     def run(self):
         """
-        Run main functionality.
+        Run main functionality. Findings come back in attack order whatever the
+        concurrency, trimmed by the stop policy. Attacks are made as work is drawn, round
+        robin across parameters, so with many renders in flight the policy still finds a
+        parameter's later attacks undrawn to skip, or in flight to abandon.
+
+        Returns:
+            (XssMapObject)
+        """
+
+        self.__probe_characters()
+
+        stop_policy = StopPolicy(self.stop_policy, self.stop_after)
+        work = self.__make_work(stop_policy, self.batch)
+
+        if self.batch:
+            execute = self.__execute_attack_batch
+        else:
+            execute = lambda attacks: [self.__execute_attack(attacks[0])]
+
+        attacks_run = []
+        results_by_attack = {}
+
+        if self.concurrency > 1:
+            self.__run_concurrently(execute, work, stop_policy, attacks_run, \
+                    results_by_attack)
+        else:
+            for w in work:
+                self.__keep_results(w, self.__execute_work_item(execute, w, stop_policy), \
+                        attacks_run, results_by_attack)
+
+        attacks_run.sort(key=lambda planned_attack: planned_attack['index'])
+        self.record_outcomes(attacks_run, results_by_attack)
+
+        return stop_policy.select(attacks_run, results_by_attack)
+
+    async def run_async(self):
+        """
+        Coroutine counterpart of run. Up to concurrency units of work are in flight at
+        once on the running event loop, no threads involved.
 
         Returns:
             (XssMapObject)
         """
 
-        output = []
-
-        for param_reflected in self.params_reflected:
-            used_payloads = []
-            for context in param_reflected['reflect_contexts']:
-                for payload in XSSMAP_PAYLOADS:
-                    if context == 'general' or context in payload['contexts']:
-                        if payload['id'] in used_payloads:
-                            continue
-                        else:
-                            used_payloads.append(payload['id'])
-                        trigger_str = self.make_trigger()
-                        attack = payload['string'].replace(TRIGGER_VALUE_PLACEHOLDER, trigger_str)
-
-                        rendered_page_output = None
-                        if self.target_type == 'GET':
-                            rendered_page_output = self.render_GET_page(attack, self.target_url, \
-                                    param_reflected, self.params_reflected, self.params_other)
-                        elif self.target_type == 'POST':
-                            rendered_page_output = self.render_POST_page(attack,\
-                                    self.target_url, param_reflected, self.params_reflected,\
-                                    self.params_other)
-
-                        results = self.__analyze_rendered_page_output(rendered_page_output, \
-                                trigger_str)
-
-                        for result in results:
-                            result['parameter'] = param_reflected['name']
-                            result['deliver'] = param_reflected['delivery']
-                            result['attack'] = attack
-                            output.append(result)
-
-        return output
+        # The probes are plain blocking requests, kept off the event loop
+        await asyncio.get_running_loop().run_in_executor(None, self.__probe_characters)
+
+        stop_policy = StopPolicy(self.stop_policy, self.stop_after)
+        work = self.__make_work(stop_policy, self.batch)
+
+        if self.batch:
+            execute = self.__execute_attack_batch_async
+        else:
+            execute = self.__execute_single_attack_async
+
+        attacks_run = []
+        results_by_attack = {}
+
+        await self.__run_concurrently_async(execute, work, stop_policy, attacks_run, \
+                results_by_attack)
+
+        attacks_run.sort(key=lambda planned_attack: planned_attack['index'])
+        self.record_outcomes(attacks_run, results_by_attack)
+
+        return stop_policy.select(attacks_run, results_by_attack)